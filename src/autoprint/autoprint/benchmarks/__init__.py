@@ -0,0 +1,45 @@
+"""
+Renderer benchmarks.
+
+Each module in this package can be run directly, e.g.::
+
+    python -m autoprint.benchmarks.metrics
+"""
+import time
+
+def sample_payload(**overrides):
+    """
+    A typical issue card payload (before deserialization)
+    """
+    payload = {
+        'summary': u'As a print service user, I want my cards to come out quickly',
+        'detail': u'When sprint planning starts we print every card in the sprint at once. ' * 6,
+        'issue_id': u'AP-123',
+        'issue_type': u'Story',
+        'reporter': u'Product Owner',
+        'date': u'2012-06-01T10:00:00',
+        'priority': u'Major',
+    }
+    payload.update(overrides)
+
+    return payload
+
+def per_call(func, repeat=5, number=20):
+    """
+    Return the best average time, in seconds, of calling func - best of 
+    repeat runs of number calls each.
+    """
+    best = None
+
+    for x in range(repeat):
+        start = time.time()
+
+        for y in range(number):
+            func()
+
+        elapsed = (time.time()-start)/number
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Worst-case benchmark for fitting card details - the old word-count cut plus
+``KeepInFrame`` shrink, against :class:`autoprint.renderers.fitting.TextFitter`.
+"""
+from reportlab.platypus import Paragraph, KeepInFrame
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.pdfgen.canvas import Canvas
+
+from ..renderers.fitting import TextFitter
+from . import per_call
+
+LOREM = u"Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut labore et dolore magna aliqua. "
+
+# name -> detail text
+CORPUS = {
+    'short': u"Fix the thing.",
+    'typical': LOREM*3,
+    'long': LOREM*150,
+    'huge': LOREM*15000,
+    'unbroken': u"x"*5000,
+    'long-words': u" ".join([u"supercalifragilisticexpialidocious"*3]*200),
+    'unicode': u"Été naïve café résumé über straße " * 100,
+}
+
+# the detail box of a 5x3" issue card
+WIDTH = 5*inch - 0.3*inch
+HEIGHT = (3*inch - 0.3*inch)/3
+
+CANVAS = Canvas(None)
+
+def _style():
+    styles = getSampleStyleSheet()
+    styles['BodyText'].fontSize = 12
+
+    return styles['BodyText']
+
+def keep_in_frame(text, style):
+    """
+    The original approach - first 50 words, shrunk to fit.
+    """
+    words = text.split()
+
+    short = u" ".join(words[:50])
+
+    if len(words) > 50:
+        short += u'...'
+
+    details = KeepInFrame(WIDTH, HEIGHT, [Paragraph(short, style),], mode="shrink", mergeSpace=0)
+    details.wrapOn(CANVAS, WIDTH, HEIGHT)
+
+def text_fitter(text, style):
+    """
+    A cold fit - a new fitter every time, so nothing is cached.
+    """
+    TextFitter(style).fit(text, WIDTH, HEIGHT).wrapOn(CANVAS, WIDTH, HEIGHT)
+
+def run(repeat=3, number=5):
+    """
+    Return a dictionary of per-fit timings in milliseconds, keyed by corpus
+    entry, for both approaches and for a warm (cached) fitter, and the
+    number of wraps a cold fit takes.
+    """
+    style = _style()
+    warm = TextFitter(style)
+
+    results = {}
+
+    for name, text in sorted(CORPUS.items()):
+        results[name] = {
+            'keep_in_frame_ms': per_call(lambda: keep_in_frame(text, style), repeat, number)*1000,
+            'fitter_ms': per_call(lambda: text_fitter(text, style), repeat, number)*1000,
+            'fitter_warm_ms': per_call(lambda: warm.fit(text, WIDTH, HEIGHT).wrapOn(CANVAS, WIDTH, HEIGHT), repeat, number)*1000,
+        }
+
+        cold = TextFitter(style)
+        cold.fit(text, WIDTH, HEIGHT)
+
+        results[name]['wraps'] = cold.wraps
+
+    return results
+
+if __name__ == '__main__':
+    print "%-12s %16s %12s %12s %6s" % ('corpus', 'KeepInFrame', 'fitter', 'warm', 'wraps')
+
+    for name, result in sorted(run().items()):
+        print "%-12s %14.2fms %10.2fms %10.2fms %6d" % (name, result['keep_in_frame_ms'], result['fitter_ms'], result['fitter_warm_ms'], result['wraps'])
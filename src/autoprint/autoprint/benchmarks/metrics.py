@@ -0,0 +1,50 @@
+"""
+Microbenchmark - per-card render cost with and without the font metrics cache
+(see :class:`autoprint.renderers.util.MetricsCache`).
+"""
+from reportlab.pdfgen.canvas import Canvas
+
+from ..renderers.issuecard import IssueCardRenderer
+from ..renderers.util import metrics, cache_paragraph_metrics
+from . import sample_payload, per_call
+
+def run(repeat=5, number=20):
+    """
+    Draw cards onto a throw-away canvas (no file is written), returns a 
+    dictionary of per-card timings in milliseconds and the cache hit rate.
+    """
+    renderer = IssueCardRenderer()
+    data = renderer.schema.deserialize(sample_payload())
+
+    canvas = Canvas(None, pagesize=renderer.settings['pagesize'])
+
+    def card():
+        renderer.draw(canvas, data)
+        canvas.showPage()
+
+    results = {}
+
+    try:
+        metrics.enabled = False
+        cache_paragraph_metrics(False)
+
+        results['uncached_ms'] = per_call(card, repeat, number)*1000
+
+        metrics.enabled = True
+        metrics.clear()
+        cache_paragraph_metrics(True)
+
+        results['cached_ms'] = per_call(card, repeat, number)*1000
+        results['hit_rate'] = metrics.stats()['hit_rate']
+    finally:
+        metrics.enabled = True
+        cache_paragraph_metrics(False)
+
+    return results
+
+if __name__ == '__main__':
+    results = run()
+
+    print "per card, uncached: %(uncached_ms).2fms" % results
+    print "per card, cached:   %(cached_ms).2fms" % results
+    print "metrics hit rate:   %(hit_rate).1f%%" % dict(hit_rate=results['hit_rate']*100)
@@ -0,0 +1,289 @@
+"""
+Renderer benchmark suite.
+
+Renders a corpus of payloads with every installed renderer and reports
+per-card latency percentiles, throughput, peak memory and output size as
+JSON, so results can be compared between releases::
+
+    python -m autoprint.benchmarks.suite --output 0.0.1.json
+    python -m autoprint.benchmarks.suite --compare 0.0.1.json
+
+Corpora live in ``corpus/<renderer>-v<version>.json``. A corpus is never
+changed once released - add a new version instead, so results stay
+comparable. Each renderer is benchmarked in a fresh process, so peak RSS
+is its own.
+"""
+import os, re, io, sys, json, time, platform, resource, argparse, datetime
+import multiprocessing
+
+import pkg_resources
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), 'corpus')
+
+CORPUS_FILE = re.compile(r'^(?P<renderer>.+)-v(?P<version>\d+)\.json$')
+
+# version of the results format
+FORMAT = 1
+
+def corpus_versions(renderer):
+    """
+    Return the available corpus versions for the named renderer, oldest first.
+    """
+    versions = []
+
+    for filename in os.listdir(CORPUS_PATH):
+        match = CORPUS_FILE.match(filename)
+
+        if match and match.group('renderer') == renderer:
+            versions.append(int(match.group('version')))
+
+    return sorted(versions)
+
+def load_corpus(renderer, version=None):
+    """
+    Load the corpus for the named renderer - the latest version unless one
+    is given. Returns None if there is no corpus for it.
+    """
+    if version is None:
+        versions = corpus_versions(renderer)
+
+        if not versions:
+            return None
+
+        version = versions[-1]
+
+    filename = os.path.join(CORPUS_PATH, '%s-v%s.json' % (renderer, version))
+
+    with io.open(filename, encoding='utf8') as corpus:
+        return json.load(corpus)
+
+def percentile(values, percent):
+    """
+    Return the given percentile of a list of numbers (nearest rank).
+    """
+    ordered = sorted(values)
+
+    if not ordered:
+        return None
+
+    rank = int(round(percent/100.0*(len(ordered)-1)))
+
+    return ordered[rank]
+
+def peak_rss():
+    """
+    Peak resident set size of this process, in kilobytes.
+    """
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # reported in bytes on OS X, kilobytes everywhere else
+    if sys.platform == 'darwin':
+        rss = rss // 1024
+
+    return rss
+
+def _measure(func):
+    """
+    Call func, returning how long it took and the size of the file it made
+    (the file is removed).
+    """
+    start = time.time()
+    filename = func()
+    elapsed = time.time() - start
+
+    try:
+        size = os.path.getsize(filename)
+    finally:
+        os.remove(filename)
+
+    return elapsed, size
+
+def benchmark_renderer(name, rounds=3, version=None):
+    """
+    Benchmark a single renderer against its corpus, returns a dictionary of
+    results. Meant to be run in a process of its own.
+    """
+    corpus = load_corpus(name, version)
+
+    if corpus is None:
+        return {'skipped': 'no corpus'}
+
+    entry = pkg_resources.get_entry_map('autoprint', 'autoprint.renderers')[name]
+
+    # rendering doesn't need the printing dependencies
+    renderer = entry.resolve()()
+    renderer.name = name
+
+    payloads = [(item['name'], renderer.schema.deserialize(item['data'])) for item in corpus['payloads']]
+
+    rss_start = peak_rss()
+
+    # warm up - the first render pays for loading fonts and images
+    for label, data in payloads:
+        _measure(lambda: renderer(data))
+
+    latencies = []
+    sizes = []
+    per_payload = {}
+
+    start = time.time()
+
+    for x in range(rounds):
+        for label, data in payloads:
+            elapsed, size = _measure(lambda: renderer(data))
+
+            latencies.append(elapsed)
+            sizes.append(size)
+            per_payload.setdefault(label, []).append(elapsed)
+
+    total = time.time() - start
+
+    results = {
+        'corpus_version': corpus['version'],
+        'cards': len(latencies),
+        'latency_ms': {
+            'mean': sum(latencies)/len(latencies)*1000,
+            'p50': percentile(latencies, 50)*1000,
+            'p90': percentile(latencies, 90)*1000,
+            'p99': percentile(latencies, 99)*1000,
+            'max': max(latencies)*1000,
+        },
+        'cards_per_sec': len(latencies)/total,
+        'pdf_bytes': {
+            'mean': sum(sizes)//len(sizes),
+            'max': max(sizes),
+        },
+        'payloads': dict(
+            (label, {'p50_ms': percentile(values, 50)*1000})
+            for label, values in per_payload.iteritems()
+        ),
+    }
+
+    # the whole corpus as one document, as the batch endpoint does it
+    if hasattr(renderer, 'batch'):
+        items = [data for label, data in payloads]
+
+        for impose in (False, True):
+            imposition = {} if impose else None
+            elapsed, size = _measure(lambda: renderer.batch(items, imposition))
+
+            results['imposed_batch' if impose else 'batch'] = {
+                'seconds': elapsed,
+                'pdf_bytes': size,
+            }
+
+    results['rss_kb'] = {
+        'start': rss_start,
+        'peak': peak_rss(),
+    }
+
+    return results
+
+def _isolated(name, rounds, version):
+    """
+    Run :func:`benchmark_renderer` in a fresh process.
+    """
+    pool = multiprocessing.Pool(1, maxtasksperchild=1)
+
+    try:
+        return pool.apply(benchmark_renderer, (name, rounds, version))
+    finally:
+        pool.terminate()
+        pool.join()
+
+def run(renderers=None, rounds=3, version=None, isolate=True):
+    """
+    Benchmark the named renderers (all installed renderers by default),
+    returns the results as a dictionary.
+    """
+    if renderers is None:
+        renderers = sorted(pkg_resources.get_entry_map('autoprint', 'autoprint.renderers'))
+
+    import reportlab
+
+    results = {
+        'format': FORMAT,
+        'autoprint': pkg_resources.get_distribution('autoprint').version,
+        'reportlab': reportlab.Version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+        'rounds': rounds,
+        'renderers': {},
+    }
+
+    for name in renderers:
+        if isolate:
+            results['renderers'][name] = _isolated(name, rounds, version)
+        else:
+            results['renderers'][name] = benchmark_renderer(name, rounds, version)
+
+    return results
+
+# (label, path into a renderer's results, higher is better?)
+COMPARED = (
+    ('p50 ms', ('latency_ms', 'p50'), False),
+    ('p99 ms', ('latency_ms', 'p99'), False),
+    ('cards/sec', ('cards_per_sec',), True),
+    ('peak RSS kB', ('rss_kb', 'peak'), False),
+    ('mean PDF bytes', ('pdf_bytes', 'mean'), False),
+)
+
+def compare(old, new):
+    """
+    Compare two sets of results, returns a list of (renderer, label, old,
+    new, change) rows where change is the relative change - positive is
+    better.
+    """
+    rows = []
+
+    for name in sorted(new['renderers']):
+        before = old['renderers'].get(name)
+        after = new['renderers'][name]
+
+        if not before or 'skipped' in before or 'skipped' in after:
+            continue
+
+        if before.get('corpus_version') != after.get('corpus_version'):
+            continue
+
+        for label, path, higher in COMPARED:
+            a, b = before, after
+            for key in path:
+                a, b = a[key], b[key]
+
+            change = float(b-a)/a if a else 0.0
+
+            rows.append((name, label, a, b, change if higher else -change))
+
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the installed autoprint renderers")
+    parser.add_argument('renderers', nargs='*', help="renderers to benchmark (default: all)")
+    parser.add_argument('--rounds', type=int, default=3, help="times to render the corpus")
+    parser.add_argument('--corpus-version', type=int, default=None, help="corpus version (default: latest)")
+    parser.add_argument('--output', help="write the results to this file (default: stdout)")
+    parser.add_argument('--compare', help="compare against results from an earlier run")
+
+    options = parser.parse_args(argv)
+
+    results = run(options.renderers or None, options.rounds, options.corpus_version)
+
+    output = json.dumps(results, indent=2, sort_keys=True, separators=(',', ': '))
+
+    if options.output:
+        with open(options.output, 'w') as out:
+            out.write(output + '\n')
+    elif not options.compare:
+        print output
+
+    if options.compare:
+        with open(options.compare) as baseline:
+            rows = compare(json.load(baseline), results)
+
+        for name, label, old, new, change in rows:
+            print "%-12s %-16s %12.2f %12.2f %+7.1f%%" % (name, label, old, new, change*100)
+
+if __name__ == '__main__':
+    main()
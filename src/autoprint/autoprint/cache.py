@@ -0,0 +1,225 @@
+"""
+Render cache - reuse rendered files for identical requests.
+
+Entries are content-addressed: the key is a hash of the renderer name, the
+deserialized data and the renderer's settings, so the same card rendered with
+the same configuration always maps to the same file.
+
+Previews are rendered into memory instead, and kept in a
+:class:`PreviewCache` by the uid of their print history record.
+"""
+import os, json, hashlib, datetime, time
+from collections import OrderedDict
+
+def _canonical(obj):
+    """
+    Fallback for :func:`json.dumps` - represent the types colander produces
+    that JSON can't handle natively.
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj)
+
+    return repr(obj)
+
+def cache_key(renderer, data, settings):
+    """
+    Build a cache key for rendering the given data with the named renderer,
+    configured with the given settings.
+    """
+    canonical = json.dumps(
+        [renderer, data, settings],
+        sort_keys=True,
+        separators=(',', ':'),
+        default=_canonical,
+    )
+
+    return hashlib.sha1(canonical).hexdigest()
+
+class RenderCache(object):
+    """
+    Least-recently-used mapping of cache keys to rendered file paths, bounded
+    by the number of entries and the total size of the files.
+
+    Files that disappear from disk are treated as misses.
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64*1024*1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._paths = set()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def holds(self, path):
+        """
+        Return True if the given file is in the cache.
+        """
+        return path in self._paths
+
+    def paths(self):
+        """
+        Return the set of files in the cache.
+        """
+        return frozenset(self._paths)
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def get(self, key):
+        """
+        Return the path of the cached file for the key, or None.
+        """
+        try:
+            path, size = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        if not os.path.exists(path):
+            self.size -= size
+            self._paths.discard(path)
+            self.misses += 1
+            return None
+
+        # re-insert to mark it as the most recently used
+        self._entries[key] = (path, size)
+        self.hits += 1
+
+        return path
+
+    def put(self, key, path):
+        """
+        Add a rendered file to the cache, evicting the least recently used
+        entries if it's over its limits.
+        """
+        if not self.enabled:
+            return
+
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+
+        if key in self._entries:
+            old_path, old_size = self._entries.pop(key)
+            self._paths.discard(old_path)
+            self.size -= old_size
+
+        self._entries[key] = (path, size)
+        self._paths.add(path)
+        self.size += size
+
+        while self._entries and (len(self._entries) > self.max_entries or self.size > self.max_bytes):
+            old_key, (old_path, old_size) = self._entries.popitem(last=False)
+            self._paths.discard(old_path)
+            self.size -= old_size
+            self.evictions += 1
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        lookups = self.hits + self.misses
+
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': float(self.hits)/lookups if lookups else 0.0,
+        }
+
+class PreviewCache(object):
+    """
+    Least-recently-used mapping of print history uids to previews rendered
+    in memory, bounded by the total size of the previews.
+
+    Each entry is a tuple of the preview's bytes, a hash of them (for its
+    ETag) and the time it was added.
+    """
+
+    def __init__(self, max_bytes=64*1024*1024):
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, uid):
+        return uid in self._entries
+
+    def get(self, uid):
+        """
+        Return the (body, hash, added) tuple for the uid, or None.
+        """
+        try:
+            entry = self._entries.pop(uid)
+        except KeyError:
+            self.misses += 1
+            return None
+
+        self._entries[uid] = entry
+        self.hits += 1
+
+        return entry
+
+    def put(self, uid, body):
+        """
+        Keep a preview, evicting the least recently used ones if it's over
+        its limit - a preview bigger than the limit isn't kept at all.
+        """
+        self.discard(uid)
+
+        self._entries[uid] = (body, hashlib.sha1(body).hexdigest(), time.time())
+        self.size += len(body)
+
+        while self._entries and self.size > self.max_bytes:
+            old_uid, (old_body, hashed, added) = self._entries.popitem(last=False)
+            self.size -= len(old_body)
+            self.evictions += 1
+
+    def discard(self, uid):
+        """
+        Forget a preview, if it's kept.
+        """
+        entry = self._entries.pop(uid, None)
+
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
@@ -0,0 +1,78 @@
+"""
+Job coalescing - send bursts of small print jobs to CUPS as one job.
+
+Every CUPS job pays for its own filter chain start up on the printer host,
+so when many cards are queued at once (e.g. the JIRA poller finding dozens
+of changed issues), jobs for the same renderer are held for a short window
+and then sent together.
+
+Merging the PDFs into a single document needs :mod:`PyPDF2`. Without it the
+files are still sent as one job, as a multi-document job.
+"""
+from cStringIO import StringIO
+from collections import OrderedDict
+
+from . import priority
+
+try:
+    from PyPDF2 import PdfFileMerger
+except ImportError:
+    PdfFileMerger = None
+
+def batches(jobs, now, window=0, size=1):
+    """
+    Group queued jobs into batches to submit together - jobs for the same
+    renderer with the same priority, in order, at most size to a batch.
+
+    A batch that isn't full is held back until its oldest job has waited
+    window seconds, unless it's a retry or urgent. Returns a tuple of the 
+    batches that are ready and whether any jobs were held back.
+    """
+    groups = OrderedDict()
+
+    for job in jobs:
+        groups.setdefault((job['renderer'], job.get('priority', priority.NORMAL)), []).append(job)
+
+    ready = []
+    held = False
+
+    for (renderer, level), group in groups.iteritems():
+        for start in range(0, len(group), size):
+            batch = group[start:start+size]
+
+            hurry = level <= priority.URGENT or any(job['attempts'] for job in batch)
+
+            if len(batch) < size and not hurry and now - batch[0]['created'] < window:
+                held = True
+                continue
+
+            ready.append(batch)
+
+    return ready, held
+
+def merge_pdfs(filenames):
+    """
+    Merge PDF files in memory, returns the merged document as a string - it
+    is streamed to CUPS without touching the disk. Requires :mod:`PyPDF2`.
+    """
+    merger = PdfFileMerger()
+    output = StringIO()
+
+    try:
+        for filename in filenames:
+            merger.append(filename, import_bookmarks=False)
+
+        merger.write(output)
+    finally:
+        merger.close()
+
+    return output.getvalue()
+
+def batch_title(titles):
+    """
+    Title of a coalesced job.
+    """
+    if len(titles) == 1:
+        return titles[0]
+
+    return "%s (+%s more)" % (titles[0], len(titles)-1)
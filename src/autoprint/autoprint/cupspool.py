@@ -0,0 +1,207 @@
+"""
+CUPS connection pool.
+
+A pycups connection must not be used by two threads at once. The pool runs
+CUPS calls in a thread pool of its own, and each call checks a connection
+out for as long as it runs - there are never more threads than connections,
+so a call never waits for one. A connection that fails is thrown away and
+replaced on next use.
+
+:func:`stream_job` sends documents to CUPS as they're read, instead of
+having pycups re-read them from a file.
+"""
+import threading
+from Queue import Queue, Empty
+
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+# calls that are safe to repeat - retried once on a fresh connection if the
+# one they were given turns out to be broken
+IDEMPOTENT = set([
+    'getDefault',
+    'getPrinters',
+    'getPrinterAttributes',
+    'getJobs',
+    'getJobAttributes',
+])
+
+# HTTP status CUPS answers each part of a streamed document with
+# (cups.HTTP_CONTINUE)
+HTTP_CONTINUE = 100
+
+# bytes sent to CUPS per write
+CHUNK_SIZE = 64*1024
+
+class StreamError(IOError):
+    """
+    Raised when CUPS stops accepting a streamed document - the connection
+    can't be trusted afterwards.
+    """
+
+def stream_job(connection, printer, title, documents, options=None, chunk_size=CHUNK_SIZE):
+    """
+    Create a job on the printer and stream documents into it, returns the
+    job id. Call it with a checked out connection (see
+    :meth:`ConnectionPool.call`).
+
+    documents is a list of (name, data) tuples, where data is a string or a
+    file-like object that is read chunk_size bytes at a time. If sending
+    fails part way, the job is cancelled.
+    """
+    job_id = connection.createJob(printer, title, options or {})
+
+    try:
+        for index, (name, data) in enumerate(documents):
+            last = index == len(documents)-1
+
+            status = connection.startDocument(printer, job_id, name, 'application/pdf', int(last))
+
+            if status != HTTP_CONTINUE:
+                raise StreamError("CUPS refused document %s of job %s (HTTP %s)" % (name, job_id, status))
+
+            if isinstance(data, basestring):
+                chunks = (data[start:start+chunk_size] for start in xrange(0, len(data), chunk_size))
+            else:
+                chunks = iter(lambda: data.read(chunk_size), '')
+
+            for chunk in chunks:
+                status = connection.writeRequestData(chunk, len(chunk))
+
+                if status != HTTP_CONTINUE:
+                    raise StreamError("CUPS stopped accepting document %s of job %s (HTTP %s)" % (name, job_id, status))
+
+            connection.finishDocument(printer)
+    except Exception:
+        try:
+            connection.cancelJob(job_id)
+        except Exception:
+            # the job dies with the connection anyway
+            pass
+
+        raise
+
+    return job_id
+
+class ConnectionPool(object):
+    """
+    Up to :attr:`size` CUPS connections, shared by up to :attr:`size`
+    concurrent calls.
+    """
+
+    def __init__(self, connect, size=4, keep_on=()):
+        """
+        :param connect: callable returning a new connection (e.g.
+                        ``cups.Connection``)
+        :param size: maximum number of connections, and concurrent calls
+        :param keep_on: exception classes that don't mean the connection is
+                        broken (e.g. ``cups.IPPError`` - CUPS answered, it
+                        just said no)
+        """
+        self.connect = connect
+        self.size = size
+        self.keep_on = tuple(keep_on)
+
+        self._idle = Queue()
+        self._lock = threading.Lock()
+
+        self.connections = 0
+        self.in_use = 0
+        self.calls = 0
+        self.failures = 0
+        self.reconnects = 0
+
+        self._pool = ThreadPool(minthreads=1, maxthreads=size, name='autoprint-cups')
+
+    def start(self):
+        self._pool.start()
+
+    def stop(self):
+        self._pool.stop()
+
+    def _checkout(self):
+        try:
+            connection = self._idle.get_nowait()
+        except Empty:
+            connection = self.connect()
+
+            with self._lock:
+                self.connections += 1
+
+        with self._lock:
+            self.in_use += 1
+
+        return connection
+
+    def _checkin(self, connection, broken=False):
+        with self._lock:
+            self.in_use -= 1
+
+            if broken:
+                self.connections -= 1
+                self.reconnects += 1
+
+        if not broken:
+            self._idle.put(connection)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call func with a checked out connection, in the calling thread.
+
+        func is either the name of a connection method, or a callable that
+        takes the connection as its first argument.
+        """
+        attempts = 2 if func in IDEMPOTENT else 1
+
+        with self._lock:
+            self.calls += 1
+
+        for attempt in range(attempts):
+            connection = self._checkout()
+
+            try:
+                if isinstance(func, basestring):
+                    result = getattr(connection, func)(*args, **kwargs)
+                else:
+                    result = func(connection, *args, **kwargs)
+            except self.keep_on:
+                self._checkin(connection)
+
+                with self._lock:
+                    self.failures += 1
+
+                raise
+            except Exception:
+                self._checkin(connection, broken=True)
+
+                if attempt == attempts-1:
+                    with self._lock:
+                        self.failures += 1
+
+                    raise
+            else:
+                self._checkin(connection)
+
+                return result
+
+    def run(self, func, *args, **kwargs):
+        """
+        Like :meth:`call`, but run in the pool's threads - returns a deferred.
+        """
+        return deferToThreadPool(reactor, self._pool, self.call, func, *args, **kwargs)
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'size': self.size,
+            'connections': self.connections,
+            'in_use': self.in_use,
+            'idle': self._idle.qsize(),
+            'waiting': self._pool.q.qsize(),
+            'calls': self.calls,
+            'failures': self.failures,
+            'reconnects': self.reconnects,
+        }
@@ -0,0 +1,92 @@
+"""
+Prometheus text exposition format.
+
+Just enough of the format (version 0.0.4) to publish the counters the print
+service already keeps - there's no registry, metrics are written out from
+the service's own state on every scrape.
+"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+def escape(value):
+    """
+    Escape a label value.
+    """
+    return unicode(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in sorted(labels.iteritems()))
+
+def format_value(value):
+    if value is None:
+        return 'NaN'
+
+    if value == float('inf'):
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class MetricsWriter(object):
+    """
+    Collects metrics and renders them in the text format.
+    """
+
+    def __init__(self, prefix='autoprint_'):
+        self.prefix = prefix
+        self.lines = []
+
+    def metric(self, name, kind, help, samples):
+        """
+        Add a counter or gauge.
+
+        :param kind: 'counter' or 'gauge'
+        :param samples: a number, or a list of (labels dictionary, number)
+                        tuples
+        """
+        name = self.prefix + name
+
+        if not isinstance(samples, list):
+            samples = [({}, samples)]
+
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s %s' % (name, kind))
+
+        for labels, value in samples:
+            self.lines.append('%s%s %s' % (name, format_labels(labels), format_value(value)))
+
+    def counter(self, name, help, samples):
+        self.metric(name, 'counter', help, samples)
+
+    def gauge(self, name, help, samples):
+        self.metric(name, 'gauge', help, samples)
+
+    def histogram(self, name, help, histograms):
+        """
+        Add a histogram.
+
+        :param histograms: list of (labels dictionary,
+                           :class:`autoprint.timing.Histogram`) tuples
+        """
+        name = self.prefix + name
+
+        self.lines.append('# HELP %s %s' % (name, help))
+        self.lines.append('# TYPE %s histogram' % name)
+
+        for labels, histogram in histograms:
+            total = 0
+
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                total += count
+
+                bucket = dict(labels, le=format_value(float(bound)))
+                self.lines.append('%s_bucket%s %s' % (name, format_labels(bucket), total))
+
+            self.lines.append('%s_bucket%s %s' % (name, format_labels(dict(labels, le='+Inf')), histogram.count))
+            self.lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(histogram.sum)))
+            self.lines.append('%s_count%s %s' % (name, format_labels(labels), histogram.count))
+
+    def text(self):
+        return (u'\n'.join(self.lines) + u'\n').encode('utf-8')
@@ -0,0 +1,223 @@
+"""
+Print history - what each session has rendered, bounded and expiring.
+
+Every render adds a :class:`PrintRecord` to the service-wide
+:class:`PrintHistory`. Records are dropped once they're older than the TTL,
+when their session has more than its share, when the history as a whole is
+full, or when their session expires. Eviction callbacks are told about every
+dropped record, so the rendered files behind them can be cleaned up.
+
+Previews rendered in memory are recorded without a filename - they aren't
+counted among the history's files.
+"""
+import time, datetime, uuid
+from collections import OrderedDict, Counter
+
+from twisted.python import log
+
+class PrintRecord(object):
+    """
+    One rendered file in a session's history.
+    """
+    __slots__ = ('uid', 'session', 'filename', 'printed', 'ip', 'renderer', 'title', 'cached', 'size', 'data', 'job_id')
+
+    def __init__(self, session, filename, ip, renderer, title, cached, size, data, job_id=None, printed=None):
+        self.uid = uuid.uuid4().hex
+        self.session = session
+        self.filename = filename
+        self.printed = printed or time.time()
+        self.ip = ip
+        self.renderer = renderer
+        self.title = title
+        self.cached = cached
+        self.size = size
+        self.data = data
+        self.job_id = job_id
+
+    @property
+    def __json__(self):
+        """
+        The record as clients see it - the filename and data stay private.
+        """
+        return {
+            'uid': self.uid,
+            'printed': datetime.datetime.fromtimestamp(self.printed).isoformat(),
+            'renderer': {
+                'id': self.renderer,
+                'title': self.title,
+            },
+            'cached': self.cached,
+            'count': len(self.data),
+            'job_id': self.job_id,
+        }
+
+class PrintHistory(object):
+    """
+    Every session's print history, oldest record first.
+
+    :attr:`max_entries` caps the whole history, :attr:`per_session` each
+    session's share of it, and records expire :attr:`ttl` seconds after
+    they were added.
+    """
+
+    def __init__(self, max_entries=10000, per_session=200, ttl=24*60*60):
+        self.max_entries = max_entries
+        self.per_session = per_session
+        self.ttl = ttl
+
+        self._records = OrderedDict()
+        # per session, uids oldest first
+        self._sessions = {}
+        # the number of records referencing each file, and its size
+        self._files = Counter()
+        self._sizes = {}
+
+        self.size = 0
+        self.evictions = Counter()
+
+        self._listeners = []
+
+    def __len__(self):
+        return len(self._records)
+
+    def onEvict(self, callback):
+        """
+        Call callback with each record that's dropped, after it's gone.
+        """
+        self._listeners.append(callback)
+
+    def references(self, filename):
+        """
+        Number of records of the given file.
+        """
+        return self._files[filename]
+
+    def filenames(self):
+        """
+        Return the set of files any record refers to.
+        """
+        return frozenset(self._files)
+
+    def add(self, record):
+        """
+        Add a record, dropping whatever it pushes over the limits. Returns
+        the record's uid.
+        """
+        self.expire()
+
+        self._records[record.uid] = record
+        self._sessions.setdefault(record.session, OrderedDict())[record.uid] = None
+
+        if record.filename is not None:
+            self._files[record.filename] += 1
+
+            if record.filename not in self._sizes:
+                self._sizes[record.filename] = record.size
+                self.size += record.size
+
+        session = self._sessions[record.session]
+
+        while len(session) > self.per_session:
+            self._drop(next(iter(session)), 'session')
+
+        while len(self._records) > self.max_entries:
+            self._drop(next(iter(self._records)), 'full')
+
+        return record.uid
+
+    def get(self, session, uid):
+        """
+        Return a session's record, or None if it doesn't have one by that
+        uid (or it has expired).
+        """
+        record = self._records.get(uid)
+
+        if record is None or record.session != session:
+            return None
+
+        if record.printed < time.time() - self.ttl:
+            self._drop(uid, 'expired')
+            return None
+
+        return record
+
+    def count(self, session):
+        return len(self._sessions.get(session, ()))
+
+    def page(self, session, offset=0, limit=None):
+        """
+        Return a list of a session's records, newest first, starting at
+        offset.
+        """
+        self.expire()
+
+        uids = list(self._sessions.get(session, ()))
+        uids.reverse()
+
+        if limit is None:
+            uids = uids[offset:]
+        else:
+            uids = uids[offset:offset+limit]
+
+        return [self._records[uid] for uid in uids]
+
+    def forget(self, session):
+        """
+        Drop all of a session's records - e.g. when it expires.
+        """
+        for uid in list(self._sessions.get(session, ())):
+            self._drop(uid, 'session_expired')
+
+    def expire(self, now=None):
+        """
+        Drop records older than the TTL. Records are kept oldest first, so
+        this stops at the first one that's still fresh.
+        """
+        horizon = (now or time.time()) - self.ttl
+
+        while self._records:
+            uid, record = next(self._records.iteritems())
+
+            if record.printed >= horizon:
+                break
+
+            self._drop(uid, 'expired')
+
+    def _drop(self, uid, reason):
+        record = self._records.pop(uid)
+
+        session = self._sessions[record.session]
+        del session[uid]
+
+        if not session:
+            del self._sessions[record.session]
+
+        if record.filename is not None:
+            self._files[record.filename] -= 1
+
+            if not self._files[record.filename]:
+                del self._files[record.filename]
+                self.size -= self._sizes.pop(record.filename)
+
+        self.evictions[reason] += 1
+
+        for callback in self._listeners:
+            try:
+                callback(record)
+            except Exception:
+                log.err(None, "Eviction callback failed for %s" % record.uid)
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'entries': len(self._records),
+            'sessions': len(self._sessions),
+            'files': len(self._files),
+            'bytes': self.size,
+            'max_entries': self.max_entries,
+            'per_session': self.per_session,
+            'ttl': self.ttl,
+            'evictions': dict(self.evictions),
+        }
@@ -0,0 +1,634 @@
+"""
+Durable print job queue.
+
+Rendered files are recorded in an SQLite database (via
+:mod:`twisted.enterprise.adbapi`) before anything is sent to CUPS, and a
+:class:`PrintDispatcher` drains the queue with bounded concurrency, retrying
+failed submissions with exponential backoff. A print request returns as
+soon as its job is queued, and queued jobs survive printer outages and
+restarts of the service.
+
+Job states:
+
+    queued -> submitting -> submitted
+                         -> queued (retry, after a delay)
+                         -> failed (out of attempts)
+
+Jobs found in the 'submitting' state on start up were interrupted by a
+crash and are queued again - so a job can, rarely, be printed twice, but is
+never lost. Submitted and failed jobs are deleted once they're older than
+the dispatcher's retention.
+
+Ready jobs are claimed in priority order, aged by how long they've been
+queued (see :mod:`autoprint.priority`).
+"""
+import os, time
+
+from twisted.enterprise import adbapi
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+from twisted.python.failure import Failure
+
+from .coalesce import batches
+from . import priority
+
+QUEUED = 'queued'
+SUBMITTING = 'submitting'
+SUBMITTED = 'submitted'
+FAILED = 'failed'
+
+STATES = (QUEUED, SUBMITTING, SUBMITTED, FAILED)
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        filename TEXT NOT NULL,
+        title TEXT NOT NULL,
+        renderer TEXT,
+        priority INTEGER NOT NULL DEFAULT %s,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        next_attempt REAL NOT NULL,
+        created REAL NOT NULL,
+        updated REAL NOT NULL,
+        cups_job_id INTEGER,
+        error TEXT
+    )
+    """ % priority.NORMAL,
+    "CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, next_attempt)",
+)
+
+# columns added since the table was first created, and their definitions
+MIGRATIONS = (
+    ('priority', "INTEGER NOT NULL DEFAULT %s" % priority.NORMAL),
+)
+
+# seconds between deleting finished jobs past their retention
+PRUNE_INTERVAL = 60*60
+
+COLUMNS = ('id', 'filename', 'title', 'renderer', 'priority', 'state', 'attempts', 'next_attempt', 'created', 'updated', 'cups_job_id', 'error')
+
+# -- interactions - each runs in a single transaction ------------------------
+
+# the SQL equivalent of autoprint.priority.sort_key - takes the aging
+ORDER = "created - (%s - priority) * ?" % priority.BULK
+
+def _setup(txn):
+    for statement in SCHEMA:
+        txn.execute(statement)
+
+    txn.execute("PRAGMA table_info(jobs)")
+
+    existing = set(row[1] for row in txn.fetchall())
+
+    for name, definition in MIGRATIONS:
+        if name not in existing:
+            txn.execute("ALTER TABLE jobs ADD COLUMN %s %s" % (name, definition))
+
+def _recover(txn, now):
+    """
+    Queue jobs that were being submitted when the service stopped.
+    """
+    txn.execute("UPDATE jobs SET state = ?, next_attempt = ?, updated = ? WHERE state = ?", (QUEUED, now, now, SUBMITTING))
+
+    return txn.rowcount
+
+def _enqueue(txn, filename, title, renderer, now, priority=priority.NORMAL):
+    txn.execute(
+        "INSERT INTO jobs (filename, title, renderer, priority, state, next_attempt, created, updated) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (filename, title, renderer, priority, QUEUED, now, now, now),
+    )
+
+    return txn.lastrowid
+
+def _position(txn, job_id, aging=priority.AGING):
+    """
+    Return the number of queued jobs that will be claimed before the given
+    one, or None if it isn't queued.
+    """
+    txn.execute(
+        "SELECT %s FROM jobs WHERE id = ? AND state = ?" % ORDER,
+        (aging, job_id, QUEUED),
+    )
+
+    row = txn.fetchone()
+
+    if row is None:
+        return None
+
+    txn.execute(
+        "SELECT COUNT(*) FROM jobs WHERE state = ? AND (%s < ? OR (%s = ? AND id < ?))" % (ORDER, ORDER),
+        (QUEUED, aging, row[0], aging, row[0], job_id),
+    )
+
+    return txn.fetchone()[0]
+
+def _claim(txn, limit, now, window=0, size=1, aging=priority.AGING):
+    """
+    Return up to limit batches of jobs that are ready to be submitted, most
+    urgent first, marking them as being submitted (see 
+    :func:`autoprint.coalesce.batches`).
+
+    Each job's 'missing' is True if its file is gone - checked here, in the
+    database's thread, to keep the disk off of the reactor thread.
+    """
+    txn.execute(
+        "SELECT %s FROM jobs WHERE state = ? AND next_attempt <= ? ORDER BY %s, id LIMIT ?" % (', '.join(COLUMNS), ORDER),
+        (QUEUED, now, aging, limit*size),
+    )
+
+    jobs = [dict(zip(COLUMNS, row)) for row in txn.fetchall()]
+
+    ready, held = batches(jobs, now, window, size)
+    ready = ready[:limit]
+
+    for batch in ready:
+        for job in batch:
+            job['state'] = SUBMITTING
+            job['attempts'] += 1
+            job['missing'] = not os.path.exists(job['filename'])
+
+            txn.execute(
+                "UPDATE jobs SET state = ?, attempts = ?, updated = ? WHERE id = ?",
+                (SUBMITTING, job['attempts'], now, job['id']),
+            )
+
+    return ready
+
+def _submitted(txn, job_ids, cups_job_id, now):
+    txn.executemany(
+        "UPDATE jobs SET state = ?, cups_job_id = ?, error = NULL, updated = ? WHERE id = ?",
+        [(SUBMITTED, cups_job_id, now, job_id) for job_id in job_ids],
+    )
+
+def _prune(txn, before):
+    """
+    Delete submitted and failed jobs last updated before the given time,
+    returns a dictionary of how many were deleted, by state.
+    """
+    where = "state IN (?, ?) AND updated < ?"
+    values = (SUBMITTED, FAILED, before)
+
+    txn.execute("SELECT state, COUNT(*) FROM jobs WHERE %s GROUP BY state" % where, values)
+    deleted = dict(txn.fetchall())
+
+    txn.execute("DELETE FROM jobs WHERE %s" % where, values)
+
+    return deleted
+
+def _update(txn, job_id, now, **values):
+    values['updated'] = now
+
+    names = sorted(values)
+
+    txn.execute(
+        "UPDATE jobs SET %s WHERE id = ?" % ', '.join('%s = ?' % name for name in names),
+        tuple(values[name] for name in names) + (job_id,),
+    )
+
+def _get(txn, job_id):
+    txn.execute("SELECT %s FROM jobs WHERE id = ?" % ', '.join(COLUMNS), (job_id,))
+
+    row = txn.fetchone()
+
+    return dict(zip(COLUMNS, row)) if row else None
+
+def _get_many(txn, job_ids, aging=priority.AGING):
+    """
+    Return a dictionary of the given jobs, keyed by id, each with its 
+    'queue_position' (None if it isn't queued). Unknown ids are left out.
+    """
+    jobs = {}
+
+    # stay well under SQLite's limit on the number of parameters
+    for start in range(0, len(job_ids), 500):
+        chunk = job_ids[start:start+500]
+
+        txn.execute(
+            "SELECT %s FROM jobs WHERE id IN (%s)" % (', '.join(COLUMNS), ', '.join('?'*len(chunk))),
+            tuple(chunk),
+        )
+
+        for row in txn.fetchall():
+            job = dict(zip(COLUMNS, row))
+            job['queue_position'] = None
+            jobs[job['id']] = job
+
+    if any(job['state'] == QUEUED for job in jobs.itervalues()):
+        # one pass over the queue in claim order, rather than a count per job
+        txn.execute(
+            "SELECT id FROM jobs WHERE state = ? ORDER BY %s, id" % ORDER,
+            (QUEUED, aging),
+        )
+
+        for position, (job_id,) in enumerate(txn.fetchall()):
+            if job_id in jobs:
+                jobs[job_id]['queue_position'] = position
+
+    return jobs
+
+def _pending_files(txn):
+    """
+    Return the set of files that jobs still waiting to be sent to CUPS
+    refer to.
+    """
+    txn.execute("SELECT DISTINCT filename FROM jobs WHERE state IN (?, ?)", (QUEUED, SUBMITTING))
+
+    return frozenset(row[0] for row in txn.fetchall())
+
+def _counts(txn):
+    txn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+
+    counts = dict((state, 0) for state in STATES)
+    counts.update(txn.fetchall())
+
+    return counts
+
+def _connected(connection):
+    """
+    Set up each new database connection.
+    """
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+
+class JobQueue(object):
+    """
+    The print job table. Every method returns a deferred.
+
+    The database is opened when the queue is built - a closed queue is
+    opened again with :meth:`open`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.dbpool = None
+
+        self.open()
+
+    def open(self):
+        """
+        Connect to the database, unless the queue is already open.
+        """
+        if self.dbpool is not None:
+            return
+
+        # SQLite allows a single writer - one connection avoids lock errors
+        self.dbpool = adbapi.ConnectionPool(
+            'sqlite3', self.path,
+            check_same_thread=False,
+            cp_min=1, cp_max=1,
+            cp_openfun=_connected,
+        )
+
+    def close(self):
+        """
+        Disconnect from the database - a closed pool can't be started
+        again, so :meth:`open` makes a new one.
+        """
+        if self.dbpool is None:
+            return
+
+        pool, self.dbpool = self.dbpool, None
+        pool.close()
+
+    def setup(self):
+        return self.dbpool.runInteraction(_setup)
+
+    def recover(self):
+        return self.dbpool.runInteraction(_recover, time.time())
+
+    def enqueue(self, filename, title, renderer=None, priority=priority.NORMAL):
+        """
+        Add a job, returns its id once it has been committed.
+        """
+        return self.dbpool.runInteraction(_enqueue, filename, title, renderer, time.time(), priority)
+
+    def position(self, job_id, aging=priority.AGING):
+        return self.dbpool.runInteraction(_position, job_id, aging)
+
+    def claim(self, limit, window=0, size=1, aging=priority.AGING):
+        return self.dbpool.runInteraction(_claim, limit, time.time(), window, size, aging)
+
+    def submitted(self, job_ids, cups_job_id):
+        """
+        Record that the jobs were sent to CUPS (together) as the given job.
+        """
+        return self.dbpool.runInteraction(_submitted, job_ids, cups_job_id, time.time())
+
+    def retry(self, job_id, error, delay):
+        now = time.time()
+
+        return self.dbpool.runInteraction(_update, job_id, now, state=QUEUED, next_attempt=now+delay, error=error)
+
+    def fail(self, job_id, error):
+        return self.dbpool.runInteraction(_update, job_id, time.time(), state=FAILED, error=error)
+
+    def prune(self, max_age):
+        """
+        Delete submitted and failed jobs older than max_age seconds.
+        """
+        return self.dbpool.runInteraction(_prune, time.time() - max_age)
+
+    def get(self, job_id):
+        return self.dbpool.runInteraction(_get, job_id)
+
+    def getMany(self, job_ids, aging=priority.AGING):
+        return self.dbpool.runInteraction(_get_many, list(job_ids), aging)
+
+    def counts(self):
+        return self.dbpool.runInteraction(_counts)
+
+    def pendingFiles(self):
+        return self.dbpool.runInteraction(_pending_files)
+
+class PrintDispatcher(object):
+    """
+    Sends queued jobs to CUPS, at most :attr:`concurrency` submissions at a
+    time.
+
+    The queue is checked every :attr:`poll_interval` seconds, and straight
+    away when a job is added (see :meth:`wake`). A failed submission is
+    retried after ``retry_delay * 2**(attempts-1)`` seconds (capped at
+    :attr:`max_delay`), until :attr:`max_attempts` is reached.
+
+    Jobs for the same renderer are coalesced - up to :attr:`batch_size` of
+    them are sent as a single CUPS job, waiting up to :attr:`window` seconds
+    for a batch to fill (see :mod:`autoprint.coalesce`).
+
+    The most urgent jobs are claimed first, aged by :attr:`aging`.
+
+    :attr:`jobs` counts the queue's jobs by state - read from the table on
+    start up, then kept up to date as the dispatcher moves jobs along, so
+    reporting on the queue never waits on the database.
+
+    Submitted and failed jobs are kept for :attr:`retention` seconds (forever
+    if it's None), so clients can still look them up.
+    """
+
+    def __init__(self, queue, submit, concurrency=2, max_attempts=5, retry_delay=2, max_delay=300, poll_interval=1, window=0, batch_size=1, aging=priority.AGING, retention=7*24*60*60):
+        """
+        :param queue: :class:`JobQueue`
+        :param submit: callable taking a list of job dictionaries, returns a
+                       deferred that fires with the id of the CUPS job they
+                       were sent as
+        """
+        self.queue = queue
+        self.submit = submit
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.window = window
+        self.batch_size = batch_size
+        self.aging = aging
+        self.retention = retention
+
+        self.in_flight = 0
+        self.submitted = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed = 0
+        self.recovered = 0
+        self.pruned = 0
+        self.jobs = dict((state, 0) for state in STATES)
+
+        self._claiming = False
+        self._again = False
+        self._loop = LoopingCall(self.wake)
+        self._pruner = LoopingCall(self.prune)
+        self._listeners = []
+
+    def onFinished(self, callback):
+        """
+        Call callback with each job that won't be submitted again - it was
+        sent to CUPS, or given up on.
+        """
+        self._listeners.append(callback)
+
+    def _finished(self, job):
+        for callback in self._listeners:
+            try:
+                callback(job)
+            except Exception:
+                log.err(None, "Error handling finished print job %s" % job['id'])
+
+    def start(self):
+        """
+        Create the table, queue any jobs interrupted by a crash and start
+        dispatching. Returns a deferred.
+
+        The dispatcher can be started again after it's stopped - the queue
+        is reopened.
+        """
+        self.queue.open()
+
+        d = self.queue.setup()
+        d.addCallback(lambda ignored: self.queue.recover())
+
+        def recovered(count):
+            self.recovered = count
+
+            if count:
+                log.msg("Re-queued %s print jobs interrupted by a restart" % count)
+
+            return self.queue.counts()
+
+        def counted(counts):
+            self.jobs.update(counts)
+
+            self._loop.start(self.poll_interval)
+
+            if self.retention is not None:
+                self._pruner.start(PRUNE_INTERVAL)
+
+        d.addCallback(recovered)
+        d.addCallback(counted)
+
+        return d
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+        if self._pruner.running:
+            self._pruner.stop()
+
+        self.queue.close()
+
+    def _moved(self, old, new, count=1):
+        """
+        Count jobs moving from one state to another.
+        """
+        self.jobs[old] -= count
+        self.jobs[new] += count
+
+    def enqueue(self, filename, title, renderer=None, priority=priority.NORMAL):
+        """
+        Add a job to the queue, returns a deferred that fires with its id.
+        """
+        d = self.queue.enqueue(filename, title, renderer, priority)
+
+        def queued(job_id):
+            self.jobs[QUEUED] += 1
+            return job_id
+
+        d.addCallback(queued)
+
+        return d
+
+    def prune(self):
+        """
+        Delete finished jobs older than the retention. Returns a deferred.
+        """
+        d = self.queue.prune(self.retention)
+
+        def pruned(deleted):
+            for state, count in deleted.iteritems():
+                self.jobs[state] -= count
+                self.pruned += count
+
+        def failed(failure):
+            log.err(failure, "Couldn't prune the print job queue")
+
+        d.addCallbacks(pruned, failed)
+
+        return d
+
+    def delay(self, attempts):
+        """
+        Seconds to wait before the given (1-based) attempt is retried.
+        """
+        return min(self.retry_delay * 2**(attempts-1), self.max_delay)
+
+    def wake(self):
+        """
+        Claim as many batches of ready jobs as there are free slots, and 
+        submit them.
+        """
+        free = self.concurrency - self.in_flight
+
+        if free <= 0:
+            return
+
+        if self._claiming:
+            self._again = True
+            return
+
+        self._claiming = True
+
+        d = self.queue.claim(free, self.window, self.batch_size, self.aging)
+
+        def claimed(batches):
+            self.in_flight += len(batches)
+            self._moved(QUEUED, SUBMITTING, sum(len(batch) for batch in batches))
+
+            for batch in batches:
+                self._dispatch(batch)
+
+        def failed(failure):
+            log.err(failure, "Couldn't read the print job queue")
+
+        def done(result):
+            self._claiming = False
+
+            if self._again:
+                self._again = False
+                self.wake()
+
+        d.addCallbacks(claimed, failed)
+        d.addBoth(done)
+
+        return d
+
+    def _failed(self, job, error):
+        """
+        Retry a job that couldn't be submitted, or give up on it.
+        """
+        if job['attempts'] >= self.max_attempts:
+            self.failed += 1
+            log.msg("Print job %s failed after %s attempts: %s" % (job['id'], job['attempts'], error))
+            self._finished(job)
+
+            d = self.queue.fail(job['id'], error)
+            d.addCallback(lambda ignored: self._moved(SUBMITTING, FAILED))
+            return d
+
+        self.retries += 1
+
+        d = self.queue.retry(job['id'], error, self.delay(job['attempts']))
+        d.addCallback(lambda ignored: self._moved(SUBMITTING, QUEUED))
+        return d
+
+    def _dispatch(self, batch):
+        updates = []
+        jobs = []
+
+        for job in batch:
+            if not job['missing']:
+                jobs.append(job)
+            else:
+                # not worth retrying
+                job['attempts'] = self.max_attempts
+                updates.append(self._failed(job, "%s no longer exists" % job['filename']))
+
+        if jobs:
+            d = defer.maybeDeferred(self.submit, jobs)
+
+            def submitted(cups_job_id):
+                self.submitted += len(jobs)
+                self.batches += 1
+
+                for job in jobs:
+                    self._finished(job)
+
+                d = self.queue.submitted([job['id'] for job in jobs], cups_job_id)
+                d.addCallback(lambda ignored: self._moved(SUBMITTING, SUBMITTED, len(jobs)))
+                return d
+
+            def failed(failure):
+                error = failure.getErrorMessage()
+                return defer.gatherResults([self._failed(job, error) for job in jobs])
+
+            d.addCallbacks(submitted, failed)
+
+            updates.append(d)
+
+        def done(result):
+            self.in_flight -= 1
+            self.wake()
+
+            if isinstance(result, Failure):
+                log.err(result, "Couldn't update print jobs %s" % ', '.join(str(job['id']) for job in batch))
+
+        d = defer.gatherResults(updates, consumeErrors=True)
+        d.addBoth(done)
+
+    def position(self, job_id):
+        """
+        Return a deferred that fires with the number of queued jobs that will
+        be sent before the given one (None once it's no longer queued).
+        """
+        return self.queue.position(job_id, self.aging)
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'concurrency': self.concurrency,
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'batches': self.batches,
+            'window': self.window,
+            'batch_size': self.batch_size,
+            'aging': self.aging,
+            'retries': self.retries,
+            'failed': self.failed,
+            'recovered': self.recovered,
+            'retention': self.retention,
+            'pruned': self.pruned,
+            'jobs': dict(self.jobs),
+        }
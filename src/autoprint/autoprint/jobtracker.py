@@ -0,0 +1,260 @@
+"""
+CUPS job tracker - follow submitted print jobs without a CUPS call per client.
+
+The tracker keeps a small in-memory table of the CUPS jobs the service has
+submitted. While any of them are still active it polls CUPS on an interval
+with a ``getJobs`` call per run of nearby job ids, each limited to the ids it
+covers, so any number of clients can watch their jobs, CUPS sees a request or
+two per interval, and one stuck job never drags in every job queued since.
+"""
+import time, datetime
+from collections import OrderedDict
+
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+# job-state values (RFC 2911)
+JOB_STATES = {
+    3: 'pending',
+    4: 'held',
+    5: 'processing',
+    6: 'stopped',
+    7: 'canceled',
+    8: 'aborted',
+    9: 'completed',
+}
+
+# states a job never leaves
+FINISHED = set(['canceled', 'aborted', 'completed', 'gone'])
+
+# job ids further apart than this are fetched by separate getJobs calls,
+# rather than listing every job in between
+GAP = 20
+
+# the attributes fetched for each job
+ATTRIBUTES = [
+    'job-id',
+    'job-state',
+    'job-state-reasons',
+    'job-media-sheets-completed',
+    'job-printer-uri',
+]
+
+def job_ranges(job_ids, gap=GAP):
+    """
+    Return the (first, last) ids of runs of the given job ids, starting a new
+    run wherever two ids are more than gap apart.
+    """
+    ranges = []
+
+    for job_id in sorted(job_ids):
+        if ranges and job_id - ranges[-1][1] <= gap:
+            ranges[-1][1] = job_id
+        else:
+            ranges.append([job_id, job_id])
+
+    return [tuple(run) for run in ranges]
+
+class JobState(object):
+    """
+    What CUPS last said about a job.
+    """
+    __slots__ = ('job_id', 'state', 'reasons', 'sheets', 'printer', 'updated')
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.state = 'unknown'
+        self.reasons = ()
+        self.sheets = 0
+        self.printer = None
+        self.updated = None
+
+    @property
+    def finished(self):
+        return self.state in FINISHED
+
+    def update(self, attributes, now):
+        self.state = JOB_STATES.get(attributes.get('job-state'), 'unknown')
+
+        reasons = attributes.get('job-state-reasons') or ()
+
+        if isinstance(reasons, basestring):
+            reasons = (reasons,)
+
+        self.reasons = tuple(reason for reason in reasons if reason != 'none')
+        self.sheets = attributes.get('job-media-sheets-completed') or 0
+
+        uri = attributes.get('job-printer-uri')
+        self.printer = uri.rsplit('/', 1)[-1] if uri else None
+
+        self.updated = now
+
+    def asdict(self):
+        return {
+            'job_id': self.job_id,
+            'state': self.state,
+            'reasons': list(self.reasons),
+            'sheets': self.sheets,
+            'printer': self.printer,
+            'updated': datetime.datetime.fromtimestamp(self.updated).isoformat() if self.updated else None,
+        }
+
+class JobTracker(object):
+    """
+    Table of :class:`JobState`, keyed by CUPS job id.
+
+    Finished jobs are kept for :attr:`retention` seconds, and at most
+    :attr:`max_jobs` jobs are kept at all (oldest dropped first).
+    """
+
+    def __init__(self, cups, interval=2, retention=3600, max_jobs=10000):
+        """
+        :param cups: :class:`autoprint.cupspool.ConnectionPool`
+        :param interval: seconds between polls, while any job is active
+        """
+        self.cups = cups
+        self.interval = interval
+        self.retention = retention
+        self.max_jobs = max_jobs
+
+        self.jobs = OrderedDict()
+
+        self.polls = 0
+        self.errors = 0
+        self.error = None
+
+        self._polling = False
+        self._loop = LoopingCall(self.poll)
+
+    def start(self):
+        self._loop.start(self.interval, now=False)
+
+    def stop(self):
+        if self._loop.running:
+            self._loop.stop()
+
+    def track(self, job_id):
+        """
+        Start following a CUPS job - it's picked up by the next poll.
+        """
+        if job_id is None or job_id in self.jobs:
+            return
+
+        self.jobs[job_id] = JobState(job_id)
+
+        while len(self.jobs) > self.max_jobs:
+            self.jobs.popitem(last=False)
+
+    def get(self, job_id):
+        """
+        Return the :class:`JobState` of a CUPS job, tracking it if it isn't
+        already (e.g. a job submitted before a restart).
+        """
+        self.track(job_id)
+
+        return self.jobs.get(job_id)
+
+    def active(self):
+        """
+        Ids of the tracked jobs that haven't finished.
+        """
+        return [job_id for job_id, job in self.jobs.iteritems() if not job.finished]
+
+    def _expire(self, now):
+        horizon = now - self.retention
+
+        expired = [
+            job_id for job_id, job in self.jobs.iteritems()
+            if job.finished and job.updated < horizon
+        ]
+
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def _polled(self, results, active, now):
+        """
+        Update the table from the ``getJobs`` results - active jobs CUPS no
+        longer knows about have been purged from its history.
+        """
+        result = {}
+
+        for jobs in results:
+            result.update(jobs)
+
+        for job_id in active:
+            job = self.jobs.get(job_id)
+
+            if job is None:
+                continue
+
+            if job_id in result:
+                job.update(result[job_id], now)
+            else:
+                job.state = 'gone'
+                job.updated = now
+
+        self.polls += 1
+        self.error = None
+
+        self._expire(now)
+
+    def poll(self):
+        """
+        Fetch the state of every active job, with a CUPS call per run of
+        nearby ids (see :func:`job_ranges`). Returns a deferred, or None if
+        there was nothing to do.
+        """
+        active = self.active()
+
+        if not active:
+            self._expire(time.time())
+            return
+
+        if self._polling:
+            return
+
+        self._polling = True
+
+        # CUPS lists jobs in id order, so a limit covering the run returns
+        # every job in it that still exists
+        d = defer.gatherResults([
+            self.cups.run(
+                'getJobs',
+                which_jobs='all',
+                first_job_id=first,
+                limit=last - first + 1,
+                requested_attributes=ATTRIBUTES,
+            )
+            for first, last in job_ranges(active)
+        ], consumeErrors=True)
+
+        def polled(results):
+            self._polled(results, active, time.time())
+
+        def failed(failure):
+            failure.trap(defer.FirstError)
+
+            self.errors += 1
+            self.error = failure.value.subFailure.getErrorMessage()
+            log.msg("Couldn't poll CUPS jobs: %s" % self.error)
+
+        def done(result):
+            self._polling = False
+
+        d.addCallbacks(polled, failed)
+        d.addBoth(done)
+
+        return d
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'tracked': len(self.jobs),
+            'active': len(self.active()),
+            'polls': self.polls,
+            'errors': self.errors,
+            'error': self.error,
+        }
@@ -0,0 +1,326 @@
+"""
+Printer pool - spread print jobs across several CUPS queues.
+
+Each job goes to the printer that can take it soonest: one that is accepting
+jobs, isn't stopped or out of paper, loads the job's page size, and has the
+fewest jobs waiting. Printer state comes from the
+:class:`autoprint.printerstate.PrinterStateCache`, so choosing a printer
+never calls CUPS.
+
+A printer that rejects a job is skipped for :attr:`PrinterPool.cooldown`
+seconds, and the job fails over to the next best printer.
+"""
+import re, time, threading
+from collections import deque
+
+from reportlab.lib.units import inch, mm
+
+# printer-state values (RFC 2911)
+IDLE = 3
+PROCESSING = 4
+STOPPED = 5
+
+# printer-state-reasons that mean a printer can't print right now - CUPS
+# adds a -report, -warning or -error suffix to most of them
+BLOCKING_REASONS = (
+    'paused',
+    'shutdown',
+    'offline',
+    'media-empty',
+    'media-needed',
+    'media-jam',
+    'door-open',
+    'cover-open',
+    'input-tray-missing',
+    'output-area-full',
+    'marker-supply-empty',
+    'toner-empty',
+)
+
+# page sizes within this many points of each other are the same size
+SIZE_TOLERANCE = 3
+
+UNITS = {
+    'in': inch,
+    'mm': mm,
+}
+
+# PWG 5101.1 media names (e.g. na_index-3x5_3x5in), and the wNNNhNNN names
+# CUPS uses for sizes in points
+PWG_MEDIA = re.compile(r'^(?P<class>[a-z0-9-]+)_(?P<name>[a-z0-9.-]+)_(?P<width>[\d.]+)x(?P<height>[\d.]+)(?P<unit>in|mm)$')
+POINTS_MEDIA = re.compile(r'^w(?P<width>[\d.]+)h(?P<height>[\d.]+)$')
+
+MEDIA_BOX = re.compile(r'/MediaBox\s*\[\s*([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s*\]')
+
+# IPP status codes that mean the printer is the problem, not the job - the
+# job is sent to another printer instead
+FAILOVER_STATUSES = set([
+    0x0406, # client-error-not-found (the queue was deleted)
+    0x0502, # server-error-service-unavailable
+    0x0506, # server-error-not-accepting-jobs
+    0x0507, # server-error-busy
+])
+
+class NoPrinterAvailable(Exception):
+    """
+    Raised when no printer can take a job right now.
+    """
+
+def media_size(name):
+    """
+    Return the (width, height) in points of a CUPS media name, None if it
+    isn't understood.
+    """
+    match = PWG_MEDIA.match(name)
+
+    if match:
+        scale = UNITS[match.group('unit')]
+        return float(match.group('width'))*scale, float(match.group('height'))*scale
+
+    match = POINTS_MEDIA.match(name)
+
+    if match:
+        return float(match.group('width')), float(match.group('height'))
+
+    return None
+
+def _same_size(a, b):
+    return abs(a[0] - b[0]) <= SIZE_TOLERANCE and abs(a[1] - b[1]) <= SIZE_TOLERANCE
+
+def supports(attributes, pagesize):
+    """
+    Return True if a printer with the given attributes loads paper of the
+    given (width, height) in points, in either orientation.
+
+    Printers that don't list the sizes they support are assumed to take
+    anything.
+    """
+    if pagesize is None:
+        return True
+
+    supported = attributes.get('media-supported') or []
+
+    if isinstance(supported, basestring):
+        supported = [supported]
+
+    rotated = (pagesize[1], pagesize[0])
+
+    sizes = []
+    custom = {}
+
+    for name in supported:
+        size = media_size(name)
+
+        if size is None:
+            continue
+
+        if name.startswith('custom_min_') or name.startswith('custom_max_'):
+            custom[name[7:10]] = size
+        else:
+            sizes.append(size)
+
+    if not sizes and not custom:
+        return True
+
+    for size in sizes:
+        if _same_size(size, pagesize) or _same_size(size, rotated):
+            return True
+
+    if 'min' in custom and 'max' in custom:
+        low, high = custom['min'], custom['max']
+
+        for width, height in (pagesize, rotated):
+            if low[0] - SIZE_TOLERANCE <= width <= high[0] + SIZE_TOLERANCE and low[1] - SIZE_TOLERANCE <= height <= high[1] + SIZE_TOLERANCE:
+                return True
+
+    return False
+
+def unavailable(attributes):
+    """
+    Return the reason a printer with the given attributes can't print right
+    now, or None if it can.
+    """
+    if attributes.get('printer-state') == STOPPED:
+        return 'stopped'
+
+    if attributes.get('printer-is-accepting-jobs') is False:
+        return 'not accepting jobs'
+
+    reasons = attributes.get('printer-state-reasons') or []
+
+    if isinstance(reasons, basestring):
+        reasons = [reasons]
+
+    for reason in reasons:
+        if reason.endswith('-report'):
+            continue
+
+        for blocking in BLOCKING_REASONS:
+            if reason == blocking or reason.startswith(blocking + '-'):
+                return reason
+
+    return None
+
+def printer_fault(error):
+    """
+    Return True if a CUPS error (``cups.IPPError``) says the printer can't
+    take jobs, rather than that the job itself is bad.
+    """
+    return bool(error.args) and error.args[0] in FAILOVER_STATUSES
+
+def page_size(filename):
+    """
+    Return the (width, height) in points of the first page of a PDF, None
+    if it can't be found (page dictionaries are never compressed in the
+    files reportlab writes).
+    """
+    with open(filename, 'rb') as pdf:
+        match = MEDIA_BOX.search(pdf.read())
+
+    if match is None:
+        return None
+
+    x1, y1, x2, y2 = [float(value) for value in match.groups()]
+
+    return abs(x2 - x1), abs(y2 - y1)
+
+class PrinterPool(object):
+    """
+    The printers jobs can be sent to, and how much work each one has had.
+
+    Queue depth is the printer's queued-job-count from the state cache, plus
+    the jobs sent to it since that was fetched. Ties go to the printer that
+    was used least recently.
+
+    :meth:`choose` and :meth:`submitted` are called from CUPS threads.
+    """
+
+    def __init__(self, state, cooldown=60, window=300):
+        """
+        :param state: :class:`autoprint.printerstate.PrinterStateCache`
+        :param cooldown: seconds to skip a printer after it rejects a job
+        :param window: seconds of history throughput is measured over
+        """
+        self.state = state
+        self.cooldown = cooldown
+        self.window = window
+
+        self._lock = threading.Lock()
+
+        # per printer - times jobs were sent, counters, last failure
+        self._sent = {}
+        self._counts = {}
+        self._failed = {}
+
+    def _history(self, name):
+        if name not in self._sent:
+            self._sent[name] = deque()
+            self._counts[name] = {'jobs': 0, 'files': 0, 'failures': 0}
+
+        sent = self._sent[name]
+        horizon = time.time() - self.window
+
+        while sent and sent[0] < horizon:
+            sent.popleft()
+
+        return sent
+
+    def _depth(self, name, attributes):
+        """
+        Estimated number of jobs waiting on the printer.
+        """
+        updated = self.state.updated or 0
+        recent = sum(1 for sent in self._history(name) if sent > updated)
+
+        return (attributes.get('queued-job-count') or 0) + recent
+
+    def _problem(self, name, attributes):
+        """
+        Return the reason the printer shouldn't get jobs, or None.
+        """
+        reason = unavailable(attributes)
+
+        if reason:
+            return reason
+
+        failed = self._failed.get(name)
+
+        if failed and time.time() - failed[0] < self.cooldown:
+            return 'failed: %s' % failed[1]
+
+        return None
+
+    def choose(self, pagesize=None, exclude=()):
+        """
+        Return the name of the best printer for a job with the given page
+        size, skipping those in exclude. Raises :class:`NoPrinterAvailable`
+        if none can take it.
+        """
+        candidates = []
+        problems = []
+
+        with self._lock:
+            for name, attributes in self.state.printers.items():
+                if name in exclude:
+                    continue
+
+                problem = self._problem(name, attributes)
+
+                if problem is None and not supports(attributes, pagesize):
+                    problem = "doesn't load %sx%s pt paper" % pagesize
+
+                if problem:
+                    problems.append('%s: %s' % (name, problem))
+                    continue
+
+                sent = self._history(name)
+                last = sent[-1] if sent else 0
+
+                candidates.append((self._depth(name, attributes), last, name))
+
+        if not candidates:
+            raise NoPrinterAvailable("No printer can take the job (%s)" % ('; '.join(problems) or 'no printers'))
+
+        return min(candidates)[2]
+
+    def submitted(self, name, files=1):
+        """
+        Record that a job of the given number of files was sent to a printer.
+        """
+        with self._lock:
+            self._history(name).append(time.time())
+            self._counts[name]['jobs'] += 1
+            self._counts[name]['files'] += files
+            self._failed.pop(name, None)
+
+    def failed(self, name, error):
+        """
+        Record that a printer rejected a job - it's skipped until the
+        cooldown runs out, or it takes a job again.
+        """
+        with self._lock:
+            self._history(name)
+            self._counts[name]['failures'] += 1
+            self._failed[name] = (time.time(), str(error))
+
+    def stats(self):
+        """
+        Return a dictionary of per-printer statistics suitable for status
+        reporting, keyed by printer name.
+        """
+        stats = {}
+
+        with self._lock:
+            for name, attributes in self.state.printers.items():
+                sent = self._history(name)
+
+                stats[name] = dict(self._counts[name])
+                stats[name].update({
+                    'state': attributes.get('printer-state'),
+                    'available': self._problem(name, attributes) is None,
+                    'problem': self._problem(name, attributes),
+                    'queue_depth': self._depth(name, attributes),
+                    'jobs_per_minute': len(sent) * 60.0 / self.window,
+                })
+
+        return stats
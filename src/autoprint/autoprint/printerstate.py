@@ -0,0 +1,310 @@
+"""
+Printer state cache - printer status without a CUPS round-trip per request.
+
+The attributes of the printers in use (the default printer, unless a list is
+configured) are fetched in the background, on an interval and whenever CUPS
+reports a printer event through a notification subscription, and kept in
+memory for the status resources and the printer pool to read.
+
+CUPS is only ever called from a dedicated thread, with a connection of its
+own, so status checks never queue behind print jobs (or vice-versa).
+"""
+import time, datetime
+from collections import OrderedDict
+
+from twisted.internet import reactor, defer
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from twisted.python import log
+
+# printer events that should trigger a refresh
+EVENTS = [
+    'printer-added',
+    'printer-deleted',
+    'printer-modified',
+    'printer-state-changed',
+    'printer-config-changed',
+]
+
+class PrinterStateCache(object):
+    """
+    In-memory copy of the printers' attributes.
+
+    :attr:`refresh` runs every :attr:`interval` seconds. If
+    :attr:`notify_interval` is set, CUPS is also polled for printer events
+    that often (a cheap call) and a refresh is triggered as soon as one
+    arrives. Subscriptions are renewed as they run out, and re-created if
+    CUPS forgets them (e.g. after a restart).
+    """
+
+    def __init__(self, connect, interval=30, notify_interval=2, lease=300, max_age=None, printers=None):
+        """
+        :param connect: callable that returns a new CUPS connection
+                        (e.g. ``cups.Connection``)
+        :param interval: seconds between full refreshes
+        :param notify_interval: seconds between checks for printer events,
+                                None to only refresh on the interval
+        :param lease: lifetime of the CUPS subscription, in seconds
+        :param max_age: state older than this (in seconds) is reported as
+                        stale, defaults to twice the interval
+        :param printers: names of the printers to watch, None for the
+                         default printer
+        """
+        self.connect = connect
+        self.names = list(printers) if printers else None
+        self.interval = interval
+        self.notify_interval = notify_interval
+        self.lease = lease
+        self.max_age = max_age or interval*2
+
+        # the first (or default) printer and its attributes
+        self.printer = None
+        self.attributes = {}
+        # attributes of every watched printer, and the errors of any that
+        # couldn't be fetched
+        self.printers = OrderedDict()
+        self.errors = {}
+        self.updated = None
+        self.error = None
+
+        self.refreshes = 0
+        self.events = 0
+
+        # only touched from the CUPS thread
+        self._connection = None
+        self.subscription = None
+        self._sequence = 0
+        self._subscribed = None
+
+        self._refreshing = False
+        self._again = False
+        self._checking = False
+
+        self._pool = ThreadPool(minthreads=1, maxthreads=1, name='autoprint-printer-state')
+        self._loops = []
+
+    def _call(self, func, *args):
+        """
+        Run func in the CUPS thread.
+        """
+        return deferToThreadPool(reactor, self._pool, func, *args)
+
+    def start(self):
+        self._pool.start()
+
+        self._loops = [LoopingCall(self.refresh)]
+
+        if self.notify_interval:
+            self._loops.append(LoopingCall(self.check))
+
+        self._loops[0].start(self.interval)
+
+        if self.notify_interval:
+            self._loops[1].start(self.notify_interval, now=False)
+
+    def stop(self):
+        """
+        Stop refreshing and cancel the subscription. Returns a deferred.
+        """
+        for loop in self._loops:
+            if loop.running:
+                loop.stop()
+
+        d = self._call(self._unsubscribe)
+        d.addErrback(lambda failure: None)
+        d.addBoth(lambda result: self._pool.stop())
+
+        return d
+
+    # -- CUPS thread ----------------------------------------------------------
+
+    def _connected(self):
+        if self._connection is None:
+            self._connection = self.connect()
+
+        return self._connection
+
+    def _fetch(self):
+        """
+        Return a dictionary of the attributes of each watched printer, and a 
+        dictionary of the errors of those that couldn't be fetched (e.g. the
+        printer was deleted).
+        """
+        try:
+            connection = self._connected()
+
+            names = self.names
+
+            if names is None:
+                default = connection.getDefault()
+                names = [default] if default else []
+
+            printers = OrderedDict()
+            errors = {}
+
+            for name in names:
+                try:
+                    printers[name] = connection.getPrinterAttributes(name)
+                except Exception, e:
+                    errors[name] = str(e)
+
+            if names and not printers:
+                # nothing worked - most likely the connection is gone
+                raise IOError("Couldn't fetch any printers: %s" % '; '.join(errors.values()))
+        except Exception:
+            # start over with a new connection next time
+            self._connection = None
+            raise
+
+        return printers, errors
+
+    def _subscribe(self):
+        """
+        Make sure there is a live subscription to printer events.
+        """
+        connection = self._connected()
+
+        if self.subscription is not None and time.time() - self._subscribed < self.lease/2.0:
+            return
+
+        if self.subscription is not None:
+            try:
+                connection.renewSubscription(self.subscription, self.lease)
+                self._subscribed = time.time()
+                return
+            except Exception:
+                self.subscription = None
+
+        self.subscription = connection.createSubscription('/', events=EVENTS, lease_duration=self.lease)
+        self._sequence = 0
+        self._subscribed = time.time()
+
+    def _unsubscribe(self):
+        if self.subscription is not None and self._connection is not None:
+            self._connection.cancelSubscription(self.subscription)
+
+        self.subscription = None
+
+    def _check(self):
+        """
+        Return the number of printer events since the last check.
+        """
+        try:
+            self._subscribe()
+
+            notifications = self._connection.getNotifications([self.subscription], [self._sequence+1])
+        except Exception:
+            self.subscription = None
+            self._connection = None
+            raise
+
+        events = [
+            event for event in notifications.get('events', [])
+            if event.get('notify-sequence-number', 0) > self._sequence
+        ]
+
+        if events:
+            self._sequence = max(event['notify-sequence-number'] for event in events)
+
+        return len(events)
+
+    # -- reactor thread -------------------------------------------------------
+
+    def refresh(self):
+        """
+        Fetch the printer state now. Refreshes requested while one is
+        running are merged into a single follow-up refresh.
+        """
+        if self._refreshing:
+            self._again = True
+            return
+
+        self._refreshing = True
+
+        d = self._call(self._fetch)
+        d.addCallbacks(self._updated, self._failed)
+        d.addBoth(self._refreshed)
+
+        return d
+
+    def _updated(self, result):
+        self.printers, self.errors = result
+
+        if self.printers:
+            self.printer, self.attributes = self.printers.items()[0]
+        else:
+            self.printer, self.attributes = None, {}
+
+        self.updated = time.time()
+        self.error = None
+        self.refreshes += 1
+
+    def _failed(self, failure):
+        self.error = failure.getErrorMessage()
+        log.msg("Printer status refresh failed: %s" % self.error)
+
+    def _refreshed(self, result):
+        self._refreshing = False
+
+        if self._again:
+            self._again = False
+            self.refresh()
+
+    def check(self):
+        """
+        Check for printer events, refreshing if there were any.
+        """
+        if self._checking:
+            return
+
+        self._checking = True
+
+        def checked(count):
+            if count:
+                self.events += count
+                self.refresh()
+
+        def failed(failure):
+            log.msg("Printer event check failed: %s" % failure.getErrorMessage())
+
+        def done(result):
+            self._checking = False
+
+        d = self._call(self._check)
+        d.addCallbacks(checked, failed)
+        d.addBoth(done)
+
+    @property
+    def age(self):
+        """
+        Seconds since the state was last refreshed, None if it never was.
+        """
+        if self.updated is None:
+            return None
+
+        return time.time() - self.updated
+
+    @property
+    def stale(self):
+        age = self.age
+
+        return age is None or age > self.max_age or self.error is not None
+
+    def status(self):
+        """
+        Return a dictionary of the cached printer state and its freshness.
+        """
+        return {
+            'printer': self.printer,
+            'attributes': self.attributes,
+            'printers': self.printers,
+            'printer_errors': self.errors,
+            'updated': datetime.datetime.fromtimestamp(self.updated).isoformat() if self.updated else None,
+            'age': self.age,
+            'stale': self.stale,
+            'error': self.error,
+            'refreshes': self.refreshes,
+            'events': self.events,
+            'subscribed': self.subscription is not None,
+        }
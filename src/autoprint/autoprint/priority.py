@@ -0,0 +1,39 @@
+"""
+Print priorities - which render or print job goes next.
+
+Lower numbers go first. Waiting work ages: every :data:`AGING` seconds a job
+has waited counts as one level of priority, so a steady stream of urgent
+cards can't starve bulk prints forever.
+
+Because every waiting job ages at the same rate, the order of two jobs never
+changes once they're both queued - it's fixed by :func:`sort_key`, which is
+cheap to keep in a heap or an SQL ``ORDER BY``.
+"""
+
+# someone is waiting on the result (a preview)
+INTERACTIVE = 0
+# e.g. Blocker and Critical cards
+URGENT = 1
+NORMAL = 2
+# e.g. Minor and Trivial cards
+LOW = 3
+# batches and reprints
+BULK = 4
+
+NAMES = {
+    INTERACTIVE: 'interactive',
+    URGENT: 'urgent',
+    NORMAL: 'normal',
+    LOW: 'low',
+    BULK: 'bulk',
+}
+
+# default seconds of waiting worth one level of priority
+AGING = 60
+
+def sort_key(priority, submitted, aging=AGING):
+    """
+    Return the key to order a job by - the time it was submitted, less
+    aging seconds for every level it's more urgent than :data:`BULK`.
+    """
+    return submitted - (BULK - priority)*aging
@@ -4,7 +4,12 @@ Common renderer classes and utilities.
 
 from zope.interface import Interface, implements, Attribute
 
-import os, colander
+import os, tempfile, colander, json, hashlib
+from reportlab.pdfgen.canvas import Canvas
+
+from .imposition import Imposition
+from .. import timing, priority
+from ..util import ResourceEncoder
 
 image_path = os.path.join(os.path.dirname(__file__), 'images')
 
@@ -21,9 +26,28 @@ class IRenderer(Interface):
     content_type = Attribute("Mime-type for the type of printable object this renderer creates")
     __json__ = Attribute("Representation of this renderer that JSON can serialize")
     
-    def __call__(data):
+    def __call__(data, output=None):
         """
         Given the data, generate a printable file and return the path to it.
+        
+        If output is given, the file is written there (a path, or a file-like
+        object) and output is returned instead.
+        """
+    
+    def batch(items, imposition=None, output=None):
+        """
+        Given a list of data, generate a single printable file with one page
+        per item and return the path to it. 
+        
+        If imposition options are given (see :class:`Imposition`), several 
+        items are laid out on each page instead. See :meth:`__call__` for
+        output.
+        """
+    
+    def priority(data):
+        """
+        Return the print priority of the given data (see 
+        :mod:`autoprint.priority`).
         """
 
 class Renderer(object):
@@ -37,12 +61,93 @@ class Renderer(object):
     
     def __init__(self, **settings):
         """
-        Settings will be applied onto the :attr:`settings` property.
+        Settings will be applied onto a copy of the :attr:`settings` 
+        defaults.
+        """
+        self.settings = dict(self.settings, **settings)
+        
+        self._encoded = None
+    
+    def encoded(self):
+        """
+        Return a tuple of the JSON description of the renderer (see 
+        :attr:`__json__`) and its ETag. Settings are fixed when the renderer
+        is created, so the schema is only converted and the JSON only 
+        encoded once.
+        """
+        if self._encoded is None:
+            body = json.dumps(self, sort_keys=True, indent=4, cls=ResourceEncoder)
+            
+            self._encoded = (body, '"%s"' % hashlib.sha1(body).hexdigest())
+        
+        return self._encoded
+    
+    def __call__(self, data, output=None):
+        """
+        Render a single page.
         """
-        self.settings.update(settings)
+        return self.batch([data], None, output)
     
-    def __call__(data):
-        pass
+    def priority(self, data):
+        """
+        Everything prints at normal priority unless a renderer says otherwise.
+        """
+        return priority.NORMAL
+    
+    def batch(self, items, imposition=None, output=None):
+        """
+        Render every item onto its own page of a single PDF, returns the path
+        to the file.
+        
+        :param imposition: dictionary of :class:`Imposition` options - if 
+                           given, items are tiled onto larger sheets instead.
+        :param output: path or file-like object to write to (see
+                       :class:`autoprint.spool.Spool`), a new temporary file
+                       if None
+        """
+        if output is None:
+            handle, output = tempfile.mkstemp(suffix=".pdf")
+            os.close(handle)
+        
+        with timing.phase('layout'):
+            if imposition is None:
+                canvas = Canvas(output, pagesize=self.settings['pagesize'])
+                
+                for data in items:
+                    self.draw(canvas, data)
+                    canvas.showPage()
+            else:
+                sheet = Imposition(self.settings['pagesize'], **imposition)
+                slots = sheet.slots
+                
+                canvas = Canvas(output, pagesize=sheet.sheet_size)
+                
+                for index, data in enumerate(items):
+                    slot = index % sheet.per_sheet
+                    
+                    if slot == 0:
+                        if index:
+                            canvas.showPage()
+                        sheet.drawCutMarks(canvas)
+                    
+                    canvas.saveState()
+                    canvas.translate(*slots[slot])
+                    self.draw(canvas, data)
+                    canvas.restoreState()
+                
+                canvas.showPage()
+        
+        with timing.phase('save'):
+            canvas.save()
+        
+        return output
+    
+    def draw(self, canvas, data):
+        """
+        Expected to be overloaded by child classes - draw the given data onto 
+        the current page of the canvas. 
+        """
+        raise NotImplementedError
     
     @property
     def __json__(self):
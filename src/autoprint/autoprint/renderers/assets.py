@@ -0,0 +1,149 @@
+"""
+Image assets for renderers.
+
+Icons are decoded once, scaled down to the resolution they're actually
+printed at, and shared between every card that uses them - so a render does
+no image I/O of its own.
+
+SVG icons are supported when :mod:`svglib` is installed.
+"""
+import os, threading
+
+from PIL import Image as PILImage
+from reportlab.lib.utils import ImageReader
+from reportlab.lib.units import inch
+
+try:
+    from svglib.svglib import svg2rlg
+except ImportError:
+    svg2rlg = None
+
+from .util import Icon
+
+RASTER_EXTENSIONS = ('.png', '.gif', '.jpg', '.jpeg')
+
+class AssetManager(object):
+    """
+    Loads every image in a directory, keyed by file name.
+
+    Raster images are resampled so they are no bigger than :attr:`size` at
+    :attr:`dpi`; SVG images are converted to ReportLab drawings scaled to
+    :attr:`size`.
+    """
+
+    def __init__(self, path, size=0.4*inch, dpi=300):
+        """
+        :param path: directory to load images from
+        :param size: the largest size (in points) an image will be printed at
+        :param dpi: print resolution
+        """
+        self.path = path
+        self.size = size
+        self.dpi = dpi
+
+        self._assets = {}
+        self._lock = threading.Lock()
+
+        self.load()
+
+    @property
+    def pixels(self):
+        """
+        Largest dimension, in pixels, to keep raster images at.
+        """
+        return int(round(self.size/inch*self.dpi))
+
+    def load(self):
+        """
+        Load (or reload) every image in the directory.
+        """
+        assets = {}
+
+        for name in sorted(os.listdir(self.path)):
+            asset = self._load(os.path.join(self.path, name))
+
+            if asset is not None:
+                assets[name] = asset
+
+        with self._lock:
+            self._assets = assets
+
+    def _load(self, filename):
+        """
+        Decode a single image - returns an ImageReader, a Drawing or None if
+        the file isn't an image we can handle.
+        """
+        if not os.path.isfile(filename):
+            return None
+        
+        extension = os.path.splitext(filename)[1].lower()
+
+        if extension in RASTER_EXTENSIONS:
+            image = PILImage.open(filename)
+            image.load()
+
+            if max(image.size) > self.pixels:
+                image.thumbnail((self.pixels, self.pixels), PILImage.ANTIALIAS)
+
+            reader = ImageReader(image)
+
+            # decode the pixel data now, so the first card doesn't pay for it
+            # (and threads don't race to do it)
+            reader.getRGBData()
+            reader.getTransparent()
+
+            return reader
+
+        if extension == '.svg' and svg2rlg is not None:
+            drawing = svg2rlg(filename)
+
+            factor = self.size/max(drawing.width, drawing.height)
+
+            drawing.scale(factor, factor)
+            drawing.width *= factor
+            drawing.height *= factor
+
+            return drawing
+
+        return None
+
+    def __contains__(self, name):
+        return name in self._assets
+
+    def get(self, name):
+        """
+        Return the shared ImageReader or Drawing for the named image. 
+        
+        Images that weren't found by :meth:`load` (e.g. an absolute path set
+        in a renderer's settings) are loaded on first use.
+        """
+        try:
+            return self._assets[name]
+        except KeyError:
+            pass
+        
+        asset = self._load(os.path.join(self.path, name))
+        
+        if asset is None:
+            raise KeyError(name)
+        
+        with self._lock:
+            self._assets[name] = asset
+        
+        return asset
+
+    def icon(self, name, width, height):
+        """
+        Return a flowable that draws the named image at the given size.
+        """
+        return Icon(self.get(name), width, height)
+
+    def stats(self):
+        """
+        Return a dictionary of information suitable for status reporting.
+        """
+        return {
+            'path': self.path,
+            'count': len(self._assets),
+            'pixels': self.pixels,
+        }
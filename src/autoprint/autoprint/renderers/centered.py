@@ -7,7 +7,7 @@ from zope.interface import Interface, implements, Attribute
 import zope.schema, zope.component
 from zope.schema.vocabulary import SimpleVocabulary
 from zope.component.factory import Factory, IFactory
-import tempfile
+import tempfile, os
 
 from reportlab.pdfgen import canvas
 import reportlab.lib.colors
@@ -89,7 +89,8 @@ class CenteredPageRenderer:
     title = "Message Centered On a Page."
     
     def __init__(self):
-        junk, self.output = tempfile.mkstemp(suffix=".pdf")
+        handle, self.output = tempfile.mkstemp(suffix=".pdf")
+        os.close(handle)
     
     def __call__(self, data):
         margin_left, margin_bottom, margin_right, margin_top = data['margins']
@@ -0,0 +1,315 @@
+"""
+Text fitting - find the largest font size at which a block of text fits a box.
+
+This replaces ``KeepInFrame(..., mode="shrink")``, which re-wraps the whole
+paragraph over and over as it scales it down. Here the text is first cut down
+to what could possibly fit at the smallest size (by measured width, reading
+the text as a stream of words so a huge description is never split in one
+go). The size it's set at is estimated from the same measurements - the
+largest size at which the lines the words need fit the lines the box has -
+and a wrap that comes out too tall says how many lines the text really
+takes, so most fits take a single wrap, and never more than a few before
+falling back to a binary search. Wrap results are cached, and the paragraph
+that's returned keeps the lines it was fitted with, so laying it out in its
+frame doesn't break them all over again.
+"""
+import re, math
+
+from reportlab.platypus import Paragraph
+from reportlab.lib.styles import ParagraphStyle
+
+from .util import metrics
+
+WORD = re.compile(r'\S+')
+
+ELLIPSIS = u'...'
+
+# wraps tried from the estimated size before searching
+STEPS = 3
+
+class FittedParagraph(Paragraph):
+    """
+    A Paragraph that has already been wrapped at :attr:`fitted` points wide
+    - wrapping it at that width again keeps the lines it has.
+    """
+    fitted = None
+
+    def wrap(self, availWidth, availHeight):
+        if availWidth == self.fitted:
+            return self.width, self.height
+
+        self.fitted = None
+
+        return Paragraph.wrap(self, availWidth, availHeight)
+
+def iter_words(text):
+    """
+    Yield the words in text one at a time, without splitting the whole string.
+    """
+    for match in WORD.finditer(text):
+        yield match.group()
+
+class TextFitter(object):
+    """
+    Fits text into a box by picking a font size between :attr:`min_size`
+    and :attr:`max_size`, truncating the text if it won't fit at all.
+    """
+
+    def __init__(self, style, min_size=6, max_size=None, precision=0.5, max_entries=4096):
+        """
+        :param style: ParagraphStyle to base the text on - its leading is
+                      scaled along with the font size
+        :param min_size: smallest font size to use
+        :param max_size: largest font size to use, defaults to the style's
+        :param precision: stop searching when the size range is this small
+        :param max_entries: bound on the number of cached wrap results
+        """
+        self.style = style
+        self.min_size = min_size
+        self.max_size = max_size or style.fontSize
+        self.precision = precision
+        self.max_entries = max_entries
+
+        self._leading = float(style.leading)/style.fontSize
+        self._styles = {}
+        self._wrapped = {}
+
+        self.wraps = 0
+        self.hits = 0
+
+    def _style(self, size):
+        try:
+            return self._styles[size]
+        except KeyError:
+            style = self._styles[size] = ParagraphStyle(
+                '%s-%s' % (self.style.name, size),
+                parent=self.style,
+                fontSize=size,
+                leading=size*self._leading,
+            )
+            return style
+
+    def _wrap(self, text, size, width):
+        """
+        Wrap the text at the given size and width - returns the height, the
+        number of words on each line (None if the paragraph isn't a simple
+        one) and the wrapped paragraph. The paragraph is None if the result
+        was cached.
+        """
+        key = (text, size, width)
+
+        try:
+            wrapped = self._wrapped[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            return wrapped + (None,)
+
+        if len(self._wrapped) >= self.max_entries:
+            self._wrapped = {}
+
+        self.wraps += 1
+
+        paragraph = FittedParagraph(text, self._style(size))
+        height = paragraph.wrap(width, 1e6)[1]
+        paragraph.fitted = width
+
+        # only simple paragraphs keep their words per line
+        if paragraph.blPara.kind == 0:
+            words = [len(line[1]) for line in paragraph.blPara.lines]
+        else:
+            words = None
+
+        self._wrapped[key] = (height, words)
+
+        return height, words, paragraph
+
+    def _paragraph(self, text, size, paragraph=None):
+        """
+        Return the paragraph a wrap made, or a new one if it was cached.
+        """
+        return paragraph or FittedParagraph(text, self._style(size))
+
+    def _height(self, text, size, width):
+        return self._wrap(text, size, width)[0]
+
+    def _truncate(self, text, width, height):
+        """
+        Return the words that could fit in the box at the smallest size (by
+        measured width, allowing each line to end an average word short -
+        but no more than a tenth of the width, as long words are broken),
+        whether any were dropped, and the width of the words kept at the
+        smallest size.
+        """
+        lines = int(height // (self.min_size*self._leading))
+
+        font = self.style.fontName
+        space = metrics.stringWidth(u' ', font, self.min_size)
+
+        words = []
+        used = 0
+
+        for word in iter_words(text):
+            measured = metrics.stringWidth(word, font, self.min_size) + space
+
+            slack = min((used + measured)/(len(words) + 1), width/10.0)
+
+            if used + measured > lines*(width - slack):
+                return words, True, used
+
+            words.append(word)
+            used += measured
+
+        return words, False, used
+
+    def _snap(self, size):
+        """
+        Round a size down to the search precision, within the allowed sizes -
+        so only a few styles and wraps are ever made.
+        """
+        size = math.floor(size/self.precision)*self.precision
+
+        return min(max(size, self.min_size), self.max_size)
+
+    def _lines(self, size, height):
+        """
+        Number of lines the box has room for at the given size.
+        """
+        return height // (size*self._leading)
+
+    def _estimate(self, measured, count, width, height):
+        """
+        Return the largest size the words look like they fit at, given their
+        width at the smallest size - allowing each line to end an average
+        word short, as in :meth:`_truncate`.
+        """
+        size = self._snap(self.max_size)
+
+        while size > self.min_size:
+            scale = size/self.min_size
+            slack = min(measured*scale/max(count, 1), width/10.0)
+
+            if math.ceil(measured*scale/(width - slack)) <= self._lines(size, height):
+                return size
+
+            size = self._snap(size - self.precision)
+
+        return self.min_size
+
+    def _smaller(self, size, needed, height):
+        """
+        Return the largest size below one the text took needed points of
+        height at that fits the box, if the text's lines shrink with it.
+        """
+        lines = round(needed/(size*self._leading))
+        smaller = self._snap(size - self.precision)
+
+        while smaller > self.min_size and lines*smaller/size > self._lines(smaller, height):
+            smaller = self._snap(smaller - self.precision)
+
+        return smaller
+
+    def _fitting_words(self, text, width, height):
+        """
+        Return (an upper bound on) how many words of text fit in the box at
+        the smallest size - counted from the lines of a single wrap.
+        """
+        words = self._wrap(text, self.min_size, width)[1]
+
+        if words is None:
+            return len(WORD.findall(text))
+
+        lines = int(height // (self.min_size*self._leading))
+
+        # long words split over several lines are counted once per piece,
+        # which can only over-estimate
+        return sum(words[:lines])
+
+    def fit(self, text, width, height):
+        """
+        Return a Paragraph holding as much of text as fits in a box of the
+        given size, at the largest font size that fits.
+        """
+        words, truncated, measured = self._truncate(text, width, height)
+
+        fitted = u' '.join(words)
+
+        if not truncated:
+            # start from the estimate, stepping down by how far over it is
+            size = self._estimate(measured, len(words), width, height)
+
+            for step in range(STEPS):
+                needed, lines, paragraph = self._wrap(fitted, size, width)
+
+                if needed <= height:
+                    return self._paragraph(fitted, size, paragraph)
+
+                if size <= self.min_size:
+                    break
+
+                size = self._smaller(size, needed, height)
+            else:
+                # still too big - search between the smallest size and the
+                # last one tried
+                return self._search(fitted, width, height, size)
+        else:
+            fitted += ELLIPSIS
+
+        needed, lines, paragraph = self._wrap(fitted, self.min_size, width)
+
+        # even the smallest size is too big - drop words until it fits
+        if needed > height:
+            low, high = 0, self._fitting_words(fitted, width, height)
+
+            # the estimate is nearly always right, or one word off for the
+            # ellipsis - check it before falling back to a search
+            for count in range(high, max(high-3, 0), -1):
+                if self._height(u' '.join(words[:count]) + ELLIPSIS, self.min_size, width) <= height:
+                    low = high = count
+                    break
+
+            while low < high:
+                middle = (low+high+1)//2
+
+                if self._height(u' '.join(words[:middle]) + ELLIPSIS, self.min_size, width) <= height:
+                    low = middle
+                else:
+                    high = middle-1
+
+            fitted = u' '.join(words[:low]) + ELLIPSIS
+            paragraph = None
+
+        return self._paragraph(fitted, self.min_size, paragraph)
+
+    def _search(self, fitted, width, height, high):
+        """
+        Binary search for the largest size up to high that fits.
+        """
+        low, high = float(self.min_size), float(high)
+
+        if self._height(fitted, high, width) <= height:
+            low = high
+
+        while high-low > self.precision:
+            middle = self._snap((low+high)/2)
+
+            if middle <= low:
+                break
+
+            if self._height(fitted, middle, width) <= height:
+                low = middle
+            else:
+                high = middle
+
+        return FittedParagraph(fitted, self._style(low))
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'entries': len(self._wrapped),
+            'wraps': self.wraps,
+            'hits': self.hits,
+        }
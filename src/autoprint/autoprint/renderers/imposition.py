@@ -0,0 +1,144 @@
+"""
+Imposition - lay several cards out on each physical sheet.
+
+A renderer's pagesize is the size of a single card. When imposing, cards are
+drawn into a grid of slots on a larger sheet, with gutters between them and
+optional cut marks outside of the grid so the sheet can be trimmed.
+"""
+from reportlab.lib.units import inch
+import reportlab.lib.pagesizes
+
+SHEET_SIZES = {
+    'letter': reportlab.lib.pagesizes.letter,
+    'legal': reportlab.lib.pagesizes.legal,
+    'A4': reportlab.lib.pagesizes.A4,
+}
+
+class Imposition(object):
+    """
+    Grid of card-sized slots on a sheet.
+
+    The sheet is turned to landscape if that fits more cards on it.
+    """
+
+    def __init__(self, card_size, sheet_size='letter', gutter=0.125*inch, margin=0.25*inch, cut_marks=True, mark_length=0.125*inch):
+        """
+        :param card_size: (width, height) of a single card, in points
+        :param sheet_size: (width, height) of the sheet in points, or one of
+                           the names in :data:`SHEET_SIZES`
+        :param gutter: space between cards, in points
+        :param margin: minimum space between the grid and the sheet edge
+        :param cut_marks: draw trim marks around the grid?
+        :param mark_length: length of the trim marks, in points
+        """
+        if not isinstance(sheet_size, (tuple, list)):
+            sheet_size = SHEET_SIZES[sheet_size]
+
+        self.card_width, self.card_height = card_size
+        self.gutter = gutter
+        self.margin = margin
+        self.cut_marks = cut_marks
+        self.mark_length = mark_length
+
+        width, height = sheet_size
+
+        portrait = self._fit(min(width, height), max(width, height))
+        landscape = self._fit(max(width, height), min(width, height))
+
+        if landscape[0]*landscape[1] > portrait[0]*portrait[1]:
+            self.sheet_size = (max(width, height), min(width, height))
+            self.columns, self.rows = landscape
+        else:
+            self.sheet_size = (min(width, height), max(width, height))
+            self.columns, self.rows = portrait
+
+        if not self.per_sheet:
+            raise ValueError("A %sx%s card won't fit on a %sx%s sheet" % (self.card_width, self.card_height, width, height))
+
+    def _fit(self, width, height):
+        """
+        Return how many (columns, rows) of cards fit on a sheet of the given size.
+        """
+        def count(available, size):
+            return max(int((available - 2*self.margin + self.gutter) // (size + self.gutter)), 0)
+
+        return count(width, self.card_width), count(height, self.card_height)
+
+    @property
+    def per_sheet(self):
+        return self.columns*self.rows
+
+    @property
+    def grid_size(self):
+        """
+        (width, height) of the grid of cards, including the inner gutters
+        """
+        return (
+            self.columns*self.card_width + (self.columns-1)*self.gutter,
+            self.rows*self.card_height + (self.rows-1)*self.gutter,
+        )
+
+    @property
+    def origin(self):
+        """
+        Bottom-left corner of the grid - the grid is centered on the sheet
+        """
+        sheet_width, sheet_height = self.sheet_size
+        grid_width, grid_height = self.grid_size
+
+        return (sheet_width-grid_width)/2.0, (sheet_height-grid_height)/2.0
+
+    @property
+    def slots(self):
+        """
+        List of the bottom-left corner of every card slot, in reading order
+        (top left first).
+        """
+        x, y = self.origin
+
+        output = []
+
+        for row in range(self.rows-1, -1, -1):
+            for column in range(self.columns):
+                output.append((
+                    x + column*(self.card_width+self.gutter),
+                    y + row*(self.card_height+self.gutter),
+                ))
+
+        return output
+
+    def drawCutMarks(self, canvas):
+        """
+        Draw trim marks in the margin, lined up with the edges of every card.
+        """
+        if not self.cut_marks:
+            return
+
+        x, y = self.origin
+        grid_width, grid_height = self.grid_size
+
+        # the edges of every column and row
+        xs = set()
+        for column in range(self.columns):
+            left = x + column*(self.card_width+self.gutter)
+            xs.update((left, left+self.card_width))
+
+        ys = set()
+        for row in range(self.rows):
+            bottom = y + row*(self.card_height+self.gutter)
+            ys.update((bottom, bottom+self.card_height))
+
+        offset = min(self.mark_length/2.0, self.margin/4.0)
+
+        canvas.saveState()
+        canvas.setLineWidth(0.25)
+
+        for edge in xs:
+            canvas.line(edge, y-offset, edge, y-offset-self.mark_length)
+            canvas.line(edge, y+grid_height+offset, edge, y+grid_height+offset+self.mark_length)
+
+        for edge in ys:
+            canvas.line(x-offset, edge, x-offset-self.mark_length, edge)
+            canvas.line(x+grid_width+offset, edge, x+grid_width+offset+self.mark_length, edge)
+
+        canvas.restoreState()
@@ -1,10 +1,9 @@
-import tempfile, os
+import os
 from zope.interface import implements
 import colander, deform
 
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Frame, Table, TableStyle, KeepInFrame
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Frame, Table, TableStyle
 from reportlab.platypus.flowables import XBox, Image
-from reportlab.pdfgen.canvas import Canvas 
 from reportlab.lib.styles import getSampleStyleSheet 
 from reportlab.rl_config import defaultPageSize 
 from reportlab.lib.units import inch 
@@ -12,8 +11,11 @@ from reportlab.pdfbase.pdfmetrics import stringWidth, getFont
 from reportlab.lib.colors import pink, black, red, blue, green, lightgrey, darkgrey
 
 from .util import PullBox
+from .assets import AssetManager
+from .fitting import TextFitter
 
 from . import IRenderer, Renderer, image_path
+from .. import priority
 
 ISSUE_TYPES = (
     u'Operational Task',
@@ -138,15 +140,43 @@ class IssueCardRenderer(Renderer):
             'Unknown': '#FFFFFF',
         },
         
+        # print priority of a card, by issue priority (see autoprint.priority)
+        'print_priorities': {
+            'Blocker': priority.URGENT,
+            'Critical': priority.URGENT,
+            'Major': priority.NORMAL,
+            'Minor': priority.LOW,
+            'Trivial': priority.LOW,
+            'Unknown': priority.NORMAL,
+        },
+        
         'pagesize':(5*inch, 3*inch),
         
         'font':"Helvetica",
         'fontSize':12,
         'margin':inch*0.15,
+        
+        # icons are pre-scaled to this size at this resolution
+        'icon_size':inch*0.4,
+        'icon_dpi':300,
     }
      
     content_type = "application/pdf"
+    
+    def __init__(self, **settings):
+        Renderer.__init__(self, **settings)
+        
+        self.assets = AssetManager(image_path, self.settings['icon_size'], self.settings['icon_dpi'])
+        self.fitter = TextFitter(self._getStyleSheet()['BodyText'])
      
+    def priority(self, data):
+        """
+        Blocker and Critical cards jump the queue, Minor and Trivial ones wait.
+        """
+        priorities = self.settings['print_priorities']
+        
+        return priorities.get(data['priority'], priorities['Unknown'])
+    
     def _getStyleSheet(self):
         """
         Generate a custom stylesheet
@@ -159,33 +189,30 @@ class IssueCardRenderer(Renderer):
         
         return styles
         
-    def __call__(self, data):
-        """
-        Generate the PDF
+    def _background(self, canvas, border):
         """
-        junk, output = tempfile.mkstemp(suffix=".pdf")
-        
-        icon = self.settings['icons'].get(data['issue_type'], self.settings['icons']['Unknown'])
-        priority_icon = self.settings['priority_icons'].get(data['priority'], self.settings['priority_icons']['Unknown'])
-        priority_color = self.settings['priority_colors'].get(data['priority'], self.settings['priority_colors']['Unknown'])
-        
-        icon = os.path.join(image_path, icon)
-        priority_icon = os.path.join(image_path, priority_icon)
-        
-        styles = self._getStyleSheet()
-        
-        canvas = Canvas(output, pagesize=self.settings['pagesize'])
+        Draw the static parts of the card - the border, the checkbox labels 
+        and the checkboxes - into a form XObject, once per canvas. Every card 
+        in the document then references the same form.
         
+        Returns the name of the form.
+        """
         margin = self.settings['margin']
         page_width, page_height = self.settings['pagesize']
         
+        name = "IssueCardBackground-%s-%s-%s-%s" % (int(page_width), int(page_height), int(margin*100), int(bool(border)))
+        
+        if canvas.hasForm(name):
+            return name
+        
         frame_width = page_width-(margin*2)
         frame_height = page_height-(margin*2)
         
-        main = Frame(margin, margin, frame_width, frame_height, showBoundary=0, leftPadding=0, bottomPadding=0, rightPadding=0, topPadding=0)
         footer = Frame(margin, margin, frame_width, frame_height, showBoundary=0, leftPadding=0, bottomPadding=0, rightPadding=0, topPadding=0)
         
-        if data['border']:
+        canvas.beginForm(name, upperx=page_width, uppery=page_height)
+        
+        if border:
             canvas.setLineWidth(0.5)
             canvas.rect(1, 1, page_width-2, page_height-2, stroke=1, fill=0)
             
@@ -206,6 +233,78 @@ class IssueCardRenderer(Renderer):
         canvas.drawString(0, -10, "BLOCKED")
         canvas.restoreState()
         
+        # special style to get rid of all padding
+        NoPadding = TableStyle([
+                ('LEFTPADDING',     (0,0),  (-1,-1),  0),
+                ('RIGHTPADDING',    (0,0),  (-1,-1),  0),
+                ('TOPPADDING',      (0,0),  (-1,-1),  0),
+                ('BOTTOMPADDING',   (0,0),  (-1,-1),  0),
+        ]) 
+        
+        checkbox_style = TableStyle([
+                ('LEFTPADDING',     (0,0),  (-1,-1),  6),
+                ('RIGHTPADDING',    (0,0),  (-1,-1),  6),
+                ('TOPPADDING',      (0,0),  (-1,-1),  6),
+                ('BOTTOMPADDING',   (0,0),  (-1,-1),  6),
+        ])
+        
+        checkbox_width = (frame_width/2)-6
+        
+        interrupted_data = [
+            [PullBox(checkbox_width, inch*0.15, 1),],
+            [PullBox(checkbox_width, inch*0.15, 2),],
+            [PullBox(checkbox_width, inch*0.15, 3),],
+        ]
+        
+        interrupted_table = Table(interrupted_data)
+        
+        blocked_data = [
+            [PullBox(checkbox_width, inch*0.15, 1, align="right"),],
+            [PullBox(checkbox_width, inch*0.15, 2, align="right"),],
+            [PullBox(checkbox_width, inch*0.15, 3, align="right"),],
+        ]
+        
+        blocked_table = Table(blocked_data)
+        
+        checkboxes = Table(
+            [[interrupted_table, blocked_table],],
+            style=NoPadding,
+        )
+        
+        # use translate to get the checkboxes to always render at the bottom of the
+        # page, even if the summary text is short.
+        checkboxes_width, checkboxes_height  = checkboxes.wrapOn(canvas, frame_width, frame_height)
+        
+        # 
+        canvas.saveState()
+        canvas.translate(0, -frame_height+checkboxes_height)
+        footer.addFromList([checkboxes,], canvas)
+        canvas.restoreState()
+        
+        canvas.endForm()
+        
+        return name
+        
+    def draw(self, canvas, data):
+        """
+        Draw a single card onto the current page of the canvas
+        """
+        icon = self.settings['icons'].get(data['issue_type'], self.settings['icons']['Unknown'])
+        priority_icon = self.settings['priority_icons'].get(data['priority'], self.settings['priority_icons']['Unknown'])
+        priority_color = self.settings['priority_colors'].get(data['priority'], self.settings['priority_colors']['Unknown'])
+        
+        styles = self._getStyleSheet()
+        
+        margin = self.settings['margin']
+        page_width, page_height = self.settings['pagesize']
+        
+        frame_width = page_width-(margin*2)
+        frame_height = page_height-(margin*2)
+        
+        main = Frame(margin, margin, frame_width, frame_height, showBoundary=0, leftPadding=0, bottomPadding=0, rightPadding=0, topPadding=0)
+        
+        canvas.doForm(self._background(canvas, data['border']))
+        
         ######### use a table to hold the header
         #
         # +--------+-------------------------+-------+
@@ -219,7 +318,7 @@ class IssueCardRenderer(Renderer):
         
         header_data = [
             [ 
-              Image(icon, inch*0.4, inch*0.4),
+              self.assets.icon(icon, inch*0.4, inch*0.4),
               [
                Paragraph('<para size="18"><b>%(issue_id)s</b></para>' % data, styles['BodyText']), 
                Spacer(1,2),
@@ -231,7 +330,7 @@ class IssueCardRenderer(Renderer):
                Paragraph('<para size="10" alignment="center"><b>Opened: %s</b></para>' % data['date'].strftime('%m/%d @ %I:%M %p'), styles['BodyText']), 
               ],
               # XBox(inch*0.4, inch*0.4, ""),
-              Image(priority_icon, inch*0.4, inch*0.4),
+              self.assets.icon(priority_icon, inch*0.4, inch*0.4),
             ],
         ]
         
@@ -254,53 +353,9 @@ class IssueCardRenderer(Renderer):
         # The text of the story
         story = Paragraph("<b>"+data['summary']+"</b>", styles['BodyText'])
         
-        # the text of the description - just the first 20 words 
-        detail_words = data['detail'].split()
-        
-        short_detail = " ".join(detail_words[:50])
-        
-        if len(detail_words) > 50:
-            short_detail += '...'
-        
-        details = KeepInFrame(frame_width, frame_height/3, [Paragraph(short_detail, styles['BodyText']),], mode="shrink", mergeSpace=0)
-        
-        # special style to get rid of all padding
-        NoPadding = TableStyle([
-                ('LEFTPADDING',     (0,0),  (-1,-1),  0),
-                ('RIGHTPADDING',    (0,0),  (-1,-1),  0),
-                ('TOPPADDING',      (0,0),  (-1,-1),  0),
-                ('BOTTOMPADDING',   (0,0),  (-1,-1),  0),
-        ]) 
-        
-        checkbox_style = TableStyle([
-                ('LEFTPADDING',     (0,0),  (-1,-1),  6),
-                ('RIGHTPADDING',    (0,0),  (-1,-1),  6),
-                ('TOPPADDING',      (0,0),  (-1,-1),  6),
-                ('BOTTOMPADDING',   (0,0),  (-1,-1),  6),
-        ])
-        
-        checkbox_width = (frame_width/2)-6
-        
-        interrupted_data = [
-            [PullBox(checkbox_width, inch*0.15, 1),],
-            [PullBox(checkbox_width, inch*0.15, 2),],
-            [PullBox(checkbox_width, inch*0.15, 3),],
-        ]
-        
-        interrupted_table = Table(interrupted_data)
-        
-        blocked_data = [
-            [PullBox(checkbox_width, inch*0.15, 1, align="right"),],
-            [PullBox(checkbox_width, inch*0.15, 2, align="right"),],
-            [PullBox(checkbox_width, inch*0.15, 3, align="right"),],
-        ]
-        
-        blocked_table = Table(blocked_data)
-        
-        checkboxes = Table(
-            [[interrupted_table, blocked_table],],
-            style=NoPadding,
-        )
+        # the text of the description - as much as fits in the space left, 
+        # as large as it fits
+        details = self.fitter.fit(data['detail'], frame_width, frame_height/3)
         
         main.addFromList(
             [
@@ -310,21 +365,3 @@ class IssueCardRenderer(Renderer):
             ],
             canvas
         )
-        
-        # use translate to get the checkboxes to always render at the bottom of the
-        # page, even if the summary text is short.
-        story_width, story_height  = story.wrap(frame_width, frame_height)
-        checkboxes_width, checkboxes_height  = checkboxes.wrapOn(canvas, frame_width, frame_height)
-        
-        # 
-        canvas.saveState()
-        canvas.translate(0, -frame_height+checkboxes_height)
-        footer.addFromList([checkboxes,], canvas)
-        canvas.restoreState()
-        
-        canvas.showPage()
-        
-        canvas.save()
-        
-        return output
-
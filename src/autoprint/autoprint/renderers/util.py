@@ -1,6 +1,105 @@
 from reportlab.platypus.flowables import Flowable
 from reportlab.pdfbase.pdfmetrics import stringWidth, getFont
 from reportlab.lib.colors import pink, black, red, blue, green, lightgrey, darkgrey
+import reportlab.platypus.paragraph
+
+class MetricsCache(object):
+    """
+    Bounded memo of font measurements - string widths keyed on 
+    (font, size, text), and font faces keyed on the font name.
+    
+    When the width table reaches :attr:`max_entries` it's simply emptied: 
+    it refills quickly, and LRU bookkeeping on every lookup would cost about 
+    as much as measuring a short word in the first place.
+    """
+    
+    def __init__(self, max_entries=65536):
+        self.max_entries = max_entries
+        self.enabled = True
+        
+        self._widths = {}
+        self._faces = {}
+        
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+    
+    def stringWidth(self, text, font, size, encoding='utf8'):
+        """
+        Drop-in replacement for :func:`reportlab.pdfbase.pdfmetrics.stringWidth`
+        """
+        if not self.enabled or encoding != 'utf8':
+            return stringWidth(text, font, size, encoding)
+        
+        key = (font, size, text)
+        
+        try:
+            width = self._widths[key]
+        except KeyError:
+            self.misses += 1
+            
+            if len(self._widths) >= self.max_entries:
+                self._widths = {}
+                self.resets += 1
+            
+            width = self._widths[key] = stringWidth(text, font, size)
+            
+            return width
+        
+        self.hits += 1
+        
+        return width
+    
+    def face(self, font):
+        """
+        Return the face object for the named font
+        """
+        try:
+            return self._faces[font]
+        except KeyError:
+            face = self._faces[font] = getFont(font).face
+            return face
+    
+    def clear(self):
+        """
+        Forget everything - call this if fonts are (re-)registered.
+        """
+        self._widths = {}
+        self._faces = {}
+    
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        lookups = self.hits + self.misses
+        
+        return {
+            'entries': len(self._widths),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'resets': self.resets,
+            'hit_rate': float(self.hits)/lookups if lookups else 0.0,
+        }
+
+# shared by the helpers in this module and the renderers
+metrics = MetricsCache()
+
+def cache_paragraph_metrics(enabled=True):
+    """
+    Make :mod:`reportlab.platypus.paragraph` measure words through 
+    :data:`metrics`, so wrapping the same words again (the same summary, 
+    the same boilerplate on every card) is a dictionary lookup.
+    
+    This patches ReportLab for the whole process, so it's left to whoever
+    runs the renderers to opt in - the render executors do when asked to
+    (see :mod:`autoprint.workers`). Passing False restores ReportLab's own
+    function.
+    """
+    if enabled:
+        reportlab.platypus.paragraph.stringWidth = metrics.stringWidth
+    else:
+        reportlab.platypus.paragraph.stringWidth = stringWidth
 
 def telemetry(font, size):
     """
@@ -14,10 +113,10 @@ def telemetry(font, size):
       'max_height': float, ascent+descent
     }
     """
-    face = getFont(font).face
+    face = metrics.face(font)
     
     # +30% 'fudge' factor
-    m_width = stringWidth('M', font, size)*1.3
+    m_width = metrics.stringWidth('M', font, size)*1.3
     
     ascent = float(face.ascent)*m_width/1000       
     descent = float(face.descent*-1)*m_width/1000
@@ -33,7 +132,7 @@ def print_centered_text(canvas, text, page_width, page_height, font, size):
     """
     Draw some text centered on the page
     """
-    string_width = stringWidth(text, font, size)
+    string_width = metrics.stringWidth(text, font, size)
     
     info = telemetry(font, size)
     
@@ -111,9 +210,9 @@ class PullBox(Flowable):
         if self.number:
             self.number = str(self.number)
             # +30% 'fudge' factor
-            m_width = stringWidth('M', self.font, self.size)
-            number_height = float(getFont(self.font).face.ascent)*m_width/1000
-            number_width = stringWidth(self.number, self.font, self.size)
+            m_width = metrics.stringWidth('M', self.font, self.size)
+            number_height = float(metrics.face(self.font).ascent)*m_width/1000
+            number_width = metrics.stringWidth(self.number, self.font, self.size)
             
             x = box_start+(box_width/2)-(number_width/2)
             y = (box_width/2)-(number_height/2)
@@ -121,3 +220,27 @@ class PullBox(Flowable):
             self.canv.setFont(self.font, self.size)
             self.canv.setFillColor(lightgrey)
             self.canv.drawString(x, y, self.number)
+
+class Icon(Flowable):
+    """
+    Draws a pre-loaded image at a fixed size. 
+    
+    The image can be an :class:`ImageReader` or a ReportLab ``Drawing`` 
+    (see :mod:`autoprint.renderers.assets`) - either way it's shared, not 
+    decoded again for every card.
+    """
+    def __init__(self, image, width, height):
+        Flowable.__init__(self)
+        self.image = image
+        self.width = width
+        self.height = height
+    
+    def __repr__(self):
+        return "Icon(%r)" % (self.image)
+    
+    def draw(self):
+        if hasattr(self.image, 'drawOn'):
+            # a Drawing - it's already been scaled to size
+            self.image.drawOn(self.canv, 0, 0)
+        else:
+            self.canv.drawImage(self.image, 0, 0, self.width, self.height, mask='auto')
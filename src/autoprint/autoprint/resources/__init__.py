@@ -9,6 +9,10 @@ from twisted.internet import defer
 from twisted.web.server import NOT_DONE_YET
 import json
 
+# JSON encoder for objects with a __json__ property - lives in util so
+# renderers can use it without importing the web layer
+from ..util import ResourceEncoder
+
 class JinjaTemplateResource(Resource):
     """
     Add jinja2 template processing functionality
@@ -31,24 +35,6 @@ class JinjaTemplateResource(Resource):
         d = deferToThread(self._render_template, request)
         return NOT_DONE_YET
         
-class ResourceEncoder(json.JSONEncoder):
-    """
-    Custom encoder that flattens out objects in a sane way
-    """
-    
-    def default(self, obj):
-        """
-        Override default to provide a __json__ property. It's expected
-        to be a dictionary (or other json serializable object).
-        """
-        
-        try:
-            return obj.__json__
-        except AttributeError:
-            pass
-        
-        return json.JSONEncoder.default(self, obj)
-
 class JSONResource(Resource):
     """
     Marshalls JSON data in the _data dictionary.
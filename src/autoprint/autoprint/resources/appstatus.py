@@ -3,6 +3,7 @@ Service Status Resources
 """
 from . import JinjaTemplateResource, JSONResource
 from .. import templates
+from ..renderers.util import metrics
 
 import json
 from twisted.web.server import NOT_DONE_YET
@@ -14,10 +15,12 @@ def service_status(request):
     
     :todo: Add in other useful information
     """
-    d = request.transport.protocol.factory.printerStatus()
+    factory = request.transport.protocol.factory
+    
+    d = factory.printerStatus()
     
     def renderers(data):
-        renderers = request.transport.protocol.factory.renderers
+        renderers = factory.renderers
         data['renderers'] = {}
         
         # convert the renderers into something serializable
@@ -27,6 +30,22 @@ def service_status(request):
                  'description': renderer.description,
             }
         
+        data['render_workers'] = factory.renderExecutor.stats()
+        data['render_cache'] = factory.renderCache.stats()
+        data['previews'] = factory.previews.stats()
+        data['text_metrics'] = metrics.stats()
+        data['timings'] = factory.timings.stats()
+        data['cups'] = factory.cups.stats()
+        data['printer_pool'] = factory.printers.stats()
+        data['history'] = factory.printHistory.stats()
+        data['spool'] = factory.spool.stats()
+        data['thumbnails'] = factory.thumbnailer.stats()
+        
+        # the dispatcher keeps the queue's counts, so this doesn't touch
+        # the job database
+        data['print_queue'] = factory.dispatcher.stats()
+        data['print_queue']['tracker'] = factory.jobTracker.stats()
+        
         return data
     
     d.addCallback(renderers)
@@ -0,0 +1,104 @@
+"""
+Job Resources - follow queued print jobs
+"""
+from . import JSONResource
+
+# most jobs a single /jobs request can ask about
+MAX_IDS = 500
+
+def parse_ids(values):
+    """
+    Turn the values of the 'ids' query argument (comma separated, may be
+    repeated) into a list of job ids. Raises ValueError on anything that
+    isn't a job id.
+    """
+    ids = []
+
+    for value in values:
+        for part in value.split(','):
+            part = part.strip()
+
+            if part:
+                ids.append(int(part))
+
+    return ids
+
+class Job(JSONResource):
+    """
+    GET: the status of a queued job (JSON) - see
+    :meth:`autoprint.services.printing.PrintService.jobStatus`.
+    """
+    isLeaf = True
+
+    def __init__(self, job_id):
+        self._job_id = job_id
+
+        JSONResource.__init__(self)
+
+    def _adjust_data(self, request):
+        factory = request.transport.protocol.factory
+
+        try:
+            job_id = int(self._job_id)
+        except ValueError:
+            request.setResponseCode(404)
+            self._data = {'error': 'No such job'}
+            return
+
+        d = factory.jobStatus([job_id])
+
+        def found(jobs):
+            if job_id not in jobs:
+                request.setResponseCode(404)
+                self._data = {'error': 'No such job'}
+            else:
+                self._data = jobs[job_id]
+
+        d.addCallback(found)
+
+        return d
+
+class Jobs(JSONResource):
+    """
+    GET: the status of several queued jobs (JSON) - takes their ids as the
+         'ids' query argument, e.g. /jobs?ids=1,2,3. Ids that aren't known
+         are returned in 'missing'.
+    """
+
+    def getChild(self, name, request):
+        if name:
+            return Job(name)
+
+        return self
+
+    def _adjust_data(self, request):
+        factory = request.transport.protocol.factory
+
+        try:
+            ids = parse_ids(request.args.get('ids', []))
+        except ValueError:
+            request.setResponseCode(400)
+            self._data = {'error': 'ids must be a comma separated list of job ids'}
+            return
+
+        if not ids:
+            request.setResponseCode(400)
+            self._data = {'error': 'Expected the ids query argument'}
+            return
+
+        if len(ids) > MAX_IDS:
+            request.setResponseCode(400)
+            self._data = {'error': 'At most %s jobs can be asked about at once' % MAX_IDS}
+            return
+
+        d = factory.jobStatus(ids)
+
+        def found(jobs):
+            self._data = {
+                'jobs': [jobs[job_id] for job_id in ids if job_id in jobs],
+                'missing': [job_id for job_id in ids if job_id not in jobs],
+            }
+
+        d.addCallback(found)
+
+        return d
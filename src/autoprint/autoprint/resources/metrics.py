@@ -0,0 +1,185 @@
+"""
+Metrics Resource - service metrics in the Prometheus text format
+"""
+from twisted.web.resource import Resource
+from twisted.internet import reactor
+
+from ..exposition import MetricsWriter, CONTENT_TYPE
+
+def service_metrics(factory):
+    """
+    Return the print service's metrics, in the text exposition format.
+
+    Everything is read from counters the service already keeps - CUPS is
+    never called, so this is cheap enough to scrape every few seconds.
+    """
+    writer = MetricsWriter()
+
+    # requests
+    writer.counter('http_requests_total', "HTTP requests handled, by route, method and status code.", [
+        ({'route': route, 'method': method, 'code': code}, count)
+        for (route, method, code), count in sorted(factory.requestStats.counts.iteritems())
+    ])
+
+    writer.histogram('http_request_duration_seconds', "HTTP request latency, by route and method.", [
+        ({'route': route, 'method': method}, histogram)
+        for (route, method), histogram in factory.requestStats.histograms()
+    ])
+
+    # render/print pipeline - 'render' is the whole render, 'cups' the CUPS
+    # submit (see autoprint.timing)
+    writer.histogram('phase_duration_seconds', "Duration of each phase of the render/print pipeline, by renderer.", [
+        ({'renderer': renderer, 'phase': phase}, histogram)
+        for (renderer, phase), histogram in factory.timings.histograms()
+    ])
+
+    # render cache
+    cache = factory.renderCache.stats()
+
+    writer.counter('render_cache_hits_total', "Renders served from the render cache.", cache['hits'])
+    writer.counter('render_cache_misses_total', "Renders not found in the render cache.", cache['misses'])
+    writer.counter('render_cache_evictions_total', "Entries evicted from the render cache.", cache['evictions'])
+    writer.gauge('render_cache_entries', "Entries in the render cache.", cache['entries'])
+    writer.gauge('render_cache_bytes', "Size of the files in the render cache.", cache['bytes'])
+
+    # previews rendered into memory
+    previews = factory.previews.stats()
+
+    writer.counter('preview_cache_hits_total', "Previews served from memory.", previews['hits'])
+    writer.counter('preview_cache_misses_total', "Previews asked for that had been evicted.", previews['misses'])
+    writer.counter('preview_cache_evictions_total', "Previews evicted from memory.", previews['evictions'])
+    writer.gauge('preview_cache_entries', "Previews kept in memory.", previews['entries'])
+    writer.gauge('preview_cache_bytes', "Size of the previews kept in memory.", previews['bytes'])
+
+    # render workers
+    workers = factory.renderExecutor.stats()
+
+    writer.gauge('render_queue_depth', "Renders waiting for a worker.", workers['queued'])
+    writer.gauge('render_in_flight', "Renders running.", workers['in_flight'])
+    writer.gauge('render_workers', "Render workers.", workers['size'])
+    writer.counter('renders_total', "Renders finished, by outcome.", [
+        ({'outcome': 'completed'}, workers['completed']),
+        ({'outcome': 'failed'}, workers['failed']),
+    ])
+
+    # the reactor's thread pool (deferToThread)
+    pool = reactor.getThreadPool()
+
+    writer.gauge('thread_pool_queue_depth', "Calls waiting for a thread in the reactor's thread pool.", pool.q.qsize())
+    writer.gauge('thread_pool_working', "Busy threads in the reactor's thread pool.", len(pool.working))
+    writer.gauge('thread_pool_threads', "Threads in the reactor's thread pool.", len(pool.threads))
+
+    # printing
+    writer.counter('print_jobs_total', "Print jobs sent to CUPS, by outcome.", [
+        ({'outcome': outcome}, count)
+        for outcome, count in sorted(factory.printJobs.iteritems())
+    ])
+
+    # the print job queue dispatcher
+    dispatcher = factory.dispatcher.stats()
+
+    writer.gauge('print_dispatch_in_flight', "Queued jobs being sent to CUPS.", dispatcher['in_flight'])
+    writer.counter('print_dispatch_total', "Queued jobs the dispatcher finished with, by outcome.", [
+        ({'outcome': 'submitted'}, dispatcher['submitted']),
+        ({'outcome': 'retried'}, dispatcher['retries']),
+        ({'outcome': 'failed'}, dispatcher['failed']),
+    ])
+    writer.counter('print_dispatch_batches_total', "CUPS jobs the dispatcher sent queued jobs as.", dispatcher['batches'])
+    writer.gauge('print_queue_jobs', "Jobs in the print queue, by state.", [
+        ({'state': state}, count)
+        for state, count in sorted(dispatcher['jobs'].iteritems())
+    ])
+    writer.counter('print_jobs_pruned_total', "Finished jobs deleted from the queue after their retention.", dispatcher['pruned'])
+
+    # CUPS jobs followed for /jobs
+    tracker = factory.jobTracker.stats()
+
+    writer.gauge('tracked_jobs', "CUPS jobs followed by the job tracker.", tracker['tracked'])
+    writer.gauge('tracked_jobs_active', "Followed CUPS jobs that haven't finished.", tracker['active'])
+    writer.counter('job_polls_total', "Times CUPS was polled for the state of followed jobs.", tracker['polls'])
+    writer.counter('job_poll_errors_total', "Failed polls for the state of followed jobs.", tracker['errors'])
+
+    # CUPS connections used to submit jobs
+    connections = factory.cups.stats()
+
+    writer.gauge('cups_connections', "Open CUPS connections.", connections['connections'])
+    writer.gauge('cups_connections_in_use', "CUPS connections in use.", connections['in_use'])
+    writer.gauge('cups_calls_waiting', "CUPS calls waiting for a connection.", connections['waiting'])
+    writer.counter('cups_calls_total', "CUPS calls made through the connection pool.", connections['calls'])
+    writer.counter('cups_call_failures_total', "CUPS calls that failed.", connections['failures'])
+    writer.counter('cups_reconnects_total', "Broken CUPS connections replaced.", connections['reconnects'])
+
+    # printers jobs are spread across
+    printers = sorted(factory.printers.stats().iteritems())
+
+    writer.gauge('printer_available', "1 if the printer can take jobs.", [
+        ({'printer': name}, int(stats['available'])) for name, stats in printers
+    ])
+    writer.gauge('printer_queue_depth', "Estimated jobs waiting on the printer.", [
+        ({'printer': name}, stats['queue_depth']) for name, stats in printers
+    ])
+    writer.counter('printer_jobs_total', "CUPS jobs sent to the printer.", [
+        ({'printer': name}, stats['jobs']) for name, stats in printers
+    ])
+    writer.counter('printer_files_total', "Files sent to the printer.", [
+        ({'printer': name}, stats['files']) for name, stats in printers
+    ])
+    writer.counter('printer_failures_total', "Jobs the printer rejected.", [
+        ({'printer': name}, stats['failures']) for name, stats in printers
+    ])
+
+    # printer status cache
+    printer = factory.printerState
+
+    writer.gauge('printer_status_age_seconds', "Seconds since the printer status was last refreshed.", printer.age)
+    writer.gauge('printer_status_stale', "1 if the cached printer status is stale.", int(printer.stale))
+    writer.counter('printer_status_refreshes_total', "Printer status refreshes.", printer.refreshes)
+    writer.counter('printer_events_total', "Printer events received from CUPS.", printer.events)
+
+    # sessions and history
+    history = factory.printHistory.stats()
+
+    writer.gauge('sessions', "Active sessions.", len(factory.sessions))
+    writer.gauge('history_entries', "Entries in the print history of every session.", history['entries'])
+    writer.counter('history_evictions_total', "Entries dropped from the print history, by reason.", [
+        ({'reason': reason}, count)
+        for reason, count in sorted(history['evictions'].iteritems())
+    ])
+    writer.gauge('history_files', "Rendered files referenced by the print history.", history['files'])
+    writer.gauge('history_bytes', "Size of the rendered files referenced by the print history.", history['bytes'])
+
+    # the spool rendered files are written to, as of its last sweep
+    spool = factory.spool.stats()
+
+    writer.gauge('spool_files', "Rendered files in the spool.", spool['files'])
+    writer.gauge('spool_bytes', "Size of the rendered files in the spool.", spool['bytes'])
+    writer.gauge('spool_referenced_bytes', "Size of the spooled files still in use.", spool['referenced_bytes'])
+    writer.gauge('spool_max_bytes', "Size the spool is swept down to.", spool['max_bytes'])
+    writer.counter('spool_swept_files_total', "Files deleted by the spool sweeper.", spool['swept'])
+    writer.counter('spool_swept_bytes_total', "Bytes deleted by the spool sweeper.", spool['swept_bytes'])
+    writer.gauge('spool_filesystem_free_bytes', "Free space on the file system rendered files are written to.", spool['filesystem_free_bytes'])
+    writer.gauge('spool_filesystem_size_bytes', "Size of the file system rendered files are written to.", spool['filesystem_size_bytes'])
+
+    # thumbnails
+    thumbnails = factory.thumbnailer.stats()
+
+    writer.counter('thumbnails_made_total', "Thumbnails rasterized.", thumbnails['made'])
+    writer.counter('thumbnail_failures_total', "Thumbnails that couldn't be made.", thumbnails['failures'])
+    writer.gauge('thumbnails_pending', "Thumbnails being made.", thumbnails['pending'])
+    writer.counter('thumbnail_cache_hits_total', "Thumbnails served from the thumbnail cache.", thumbnails['hits'])
+    writer.counter('thumbnail_cache_misses_total', "Thumbnails not found in the thumbnail cache.", thumbnails['misses'])
+    writer.counter('thumbnail_cache_evictions_total', "Thumbnails evicted from the thumbnail cache.", thumbnails['evictions'])
+    writer.gauge('thumbnail_cache_bytes', "Size of the thumbnail cache.", thumbnails['bytes'])
+
+    return writer.text()
+
+class Metrics(Resource):
+    """
+    GET: service metrics in the Prometheus text exposition format.
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('content-type', CONTENT_TYPE)
+
+        return service_metrics(request.transport.protocol.factory)
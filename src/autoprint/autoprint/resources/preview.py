@@ -0,0 +1,360 @@
+"""
+Preview Resources - serve rendered files from the spool, and previews
+rendered into memory
+
+Rendered files never change once they're written, so the preview is served
+with a strong ETag (a hash of its content), answers conditional requests
+with 304s, and supports single byte ranges - browser PDF viewers use them to
+load big multi-card previews a page at a time. Files are mapped into memory
+and handed to the transport by Twisted's static producers, rather than read
+through a file object, and are gzipped for clients that accept it.
+
+:class:`MemoryPreview` serves a preview from memory the same way.
+"""
+import os, mmap, gzip, re
+from collections import OrderedDict
+from cStringIO import StringIO
+
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.static import NoRangeStaticProducer, SingleRangeStaticProducer
+from twisted.web import http
+from twisted.internet.threads import deferToThread
+from twisted.internet import defer
+from twisted.python import log
+
+from ..util import file_digest
+
+# files bigger than this are never gzipped - the whole file is compressed
+# in memory
+GZIP_MAX_BYTES = 8*1024*1024
+
+# content hashes remembered, by path, size and modification time
+DIGESTS = 1024
+
+# gzipped content kept, by content hash - up to this many bytes of it, so
+# the same preview isn't compressed again for every GET
+GZIP_CACHE_BYTES = 16*1024*1024
+
+# previews belong to a session, so only the browser may cache them
+CACHE_CONTROL = 'private, max-age=3600'
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+_digests = OrderedDict()
+
+_gzipped = OrderedDict()
+_gzipped_bytes = 0
+
+def remember(key, hashed):
+    """
+    Keep a file's hash, forgetting the oldest once there are too many.
+    Called in the reactor thread.
+    """
+    _digests[key] = hashed
+
+    while len(_digests) > DIGESTS:
+        _digests.popitem(last=False)
+
+    return hashed
+
+def keep(hashed, body):
+    """
+    Keep gzipped content, forgetting the least recently used once there's
+    too much. Called in the reactor thread.
+    """
+    global _gzipped_bytes
+
+    if hashed in _gzipped:
+        _gzipped_bytes -= len(_gzipped.pop(hashed))
+
+    _gzipped[hashed] = body
+    _gzipped_bytes += len(body)
+
+    while _gzipped and _gzipped_bytes > GZIP_CACHE_BYTES:
+        _gzipped_bytes -= len(_gzipped.popitem(last=False)[1])
+
+    return body
+
+def kept(hashed):
+    """
+    Return gzipped content that was kept, by its content hash, or None.
+    """
+    body = _gzipped.pop(hashed, None)
+
+    if body is not None:
+        # re-insert to mark it as the most recently used
+        _gzipped[hashed] = body
+
+    return body
+
+def parse_range(header, size):
+    """
+    Return the (first, last) byte offsets of a Range header, None if it
+    should be ignored (it isn't a single byte range). Raises ValueError if
+    the range can't be satisfied.
+    """
+    match = RANGE.match(header.strip().replace(' ', ''))
+
+    if match is None:
+        return None
+
+    first, last = match.groups()
+
+    if not first:
+        if not last:
+            return None
+
+        # the last n bytes
+        length = int(last)
+
+        if not length or not size:
+            raise ValueError(header)
+
+        return max(size - length, 0), size - 1
+
+    first = int(first)
+
+    if last and int(last) < first:
+        # not a valid range, so it's ignored
+        return None
+
+    if first >= size:
+        raise ValueError(header)
+
+    return first, min(int(last), size - 1) if last else size - 1
+
+def etag_matches(header, etag):
+    """
+    Return True if an If-None-Match header matches the ETag (quoted, as
+    sent) - the weak comparison. If-Range needs the ETag itself.
+    """
+    tags = [tag.strip() for tag in header.split(',')]
+
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+def accepts_gzip(header):
+    """
+    Return True if an Accept-Encoding header allows gzip.
+    """
+    for coding in (header or '').split(','):
+        parts = coding.strip().split(';')
+
+        if parts[0].strip() not in ('gzip', '*'):
+            continue
+
+        quality = 1.0
+
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        if quality > 0:
+            return True
+
+    return False
+
+def gzipped(body):
+    """
+    Return the bytes, gzipped.
+    """
+    output = StringIO()
+
+    with gzip.GzipFile(fileobj=output, mode='wb', compresslevel=6, mtime=0) as compressed:
+        compressed.write(body)
+
+    return output.getvalue()
+
+def compress(path):
+    """
+    Return a file's content, gzipped.
+    """
+    with open(path, 'rb') as f:
+        return gzipped(f.read())
+
+class Preview(Resource):
+    """
+    GET: a rendered file - see the module documentation.
+    """
+    isLeaf = True
+
+    def __init__(self, filename, content_type='application/pdf'):
+        Resource.__init__(self)
+
+        self._filename = filename
+        self._content_type = content_type
+
+    def render_GET(self, request):
+        try:
+            stat = os.stat(self._filename)
+        except OSError:
+            request.setResponseCode(404)
+            return 'No such file'
+
+        key = (self._filename, stat.st_size, stat.st_mtime)
+
+        if key in _digests:
+            d = defer.succeed(_digests[key])
+        else:
+            d = deferToThread(file_digest, self._filename)
+            d.addCallback(lambda hashed: remember(key, hashed))
+
+        d.addCallback(self._respond, request, stat.st_size, stat.st_mtime)
+        d.addErrback(self._failed, request)
+
+        return NOT_DONE_YET
+
+    def _failed(self, failure, request):
+        log.err(failure, "Couldn't serve %s" % self._filename)
+
+        if not request.finished:
+            request.setResponseCode(500)
+            request.finish()
+
+    def _compressed(self):
+        """
+        Return a deferred that fires with the content, gzipped.
+        """
+        return deferToThread(compress, self._filename)
+
+    def _content(self):
+        """
+        Return the content, as a file-like object for Twisted's producers.
+        """
+        with open(self._filename, 'rb') as f:
+            # the mapping outlives the descriptor, and the file if the spool
+            # sweeps it mid-download
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _respond(self, hashed, request, size, modified):
+        encode = (
+            size
+            and size <= GZIP_MAX_BYTES
+            and not request.getHeader('range')
+            and accepts_gzip(request.getHeader('accept-encoding'))
+        )
+
+        # each encoding is its own representation, with its own ETag
+        etag = '"%s%s"' % (hashed, '-gzip' if encode else '')
+
+        request.setHeader('etag', etag)
+        request.setHeader('cache-control', CACHE_CONTROL)
+        request.setHeader('vary', 'Accept-Encoding')
+        request.setHeader('accept-ranges', 'bytes')
+        request.setHeader('content-type', self._content_type)
+
+        matches = request.getHeader('if-none-match')
+
+        if matches is not None:
+            # If-Modified-Since is ignored when there's an ETag to compare
+            request.setHeader('last-modified', http.datetimeToString(modified))
+
+            if etag_matches(matches, etag):
+                request.setResponseCode(http.NOT_MODIFIED)
+                request.finish()
+                return
+        elif request.setLastModified(modified) is http.CACHED:
+            request.finish()
+            return
+
+        if encode:
+            body = kept(hashed)
+
+            if body is not None:
+                d = defer.succeed(body)
+            else:
+                d = self._compressed()
+                d.addCallback(lambda body: keep(hashed, body))
+
+            d.addCallback(self._write, request)
+            return d
+
+        span = None
+        header = request.getHeader('range')
+        condition = request.getHeader('if-range')
+
+        # If-Range only matches the strong ETag itself - not W/ or *
+        if header and (condition is None or condition.strip() == etag):
+            try:
+                span = parse_range(header, size)
+            except ValueError:
+                request.setResponseCode(http.REQUESTED_RANGE_NOT_SATISFIABLE)
+                request.setHeader('content-range', 'bytes */%d' % size)
+                request.setHeader('content-length', '0')
+                request.finish()
+                return
+
+        if span is None:
+            first, last = 0, size - 1
+        else:
+            first, last = span
+
+            request.setResponseCode(http.PARTIAL_CONTENT)
+            request.setHeader('content-range', 'bytes %d-%d/%d' % (first, last, size))
+
+        length = last - first + 1
+
+        request.setHeader('content-length', str(length))
+
+        if request.method == 'HEAD' or not length:
+            request.finish()
+            return
+
+        content = self._content()
+
+        if span is None:
+            producer = NoRangeStaticProducer(request, content)
+        else:
+            producer = SingleRangeStaticProducer(request, content, first, length)
+
+        producer.start()
+
+    def _write(self, body, request):
+        request.setHeader('content-encoding', 'gzip')
+        request.setHeader('content-length', str(len(body)))
+
+        if request.method != 'HEAD':
+            request.write(body)
+
+        request.finish()
+
+class MemoryPreview(Preview):
+    """
+    GET: a preview rendered into memory - see the module documentation.
+    """
+
+    def __init__(self, body, hashed, modified, content_type='application/pdf'):
+        """
+        :param body: the preview's bytes
+        :param hashed: a hash of body, for its ETag
+        :param modified: when it was rendered
+        """
+        Preview.__init__(self, None, content_type)
+
+        self._body = body
+        self._hashed = hashed
+        self._modified = modified
+
+    def render_GET(self, request):
+        d = defer.maybeDeferred(self._respond, self._hashed, request, len(self._body), self._modified)
+        d.addErrback(self._failed, request)
+
+        return NOT_DONE_YET
+
+    def _failed(self, failure, request):
+        log.err(failure, "Couldn't serve a preview")
+
+        if not request.finished:
+            request.setResponseCode(500)
+            request.finish()
+
+    def _compressed(self):
+        return deferToThread(gzipped, self._body)
+
+    def _content(self):
+        return StringIO(self._body)
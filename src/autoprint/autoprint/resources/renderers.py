@@ -4,18 +4,18 @@ Resources related to the renderer API
 
 from . import JinjaTemplateResource, JSONResource
 from .. import templates
-from ..session import IPrintedFiles, PrintedFiles
+from ..session import IPrintedFiles
+from .. import priority
+from .preview import Preview, MemoryPreview, etag_matches
 
-import json, uuid
+import os, json
 from twisted.web.server import NOT_DONE_YET
 from twisted.internet.threads import deferToThread
-from twisted.web.resource import Resource
-from twisted.web.static import File, NoRangeStaticProducer
-from twisted.python.filepath import FilePath
-from twisted.web.error import NoResource
+from twisted.internet import defer
+from twisted.web.resource import Resource, NoResource
 from deform import Form, ValidationFailure
 import colander
-from datetime import datetime
+from collections import OrderedDict
 
 def flatten_args(request):
     """
@@ -33,6 +33,83 @@ def flatten_args(request):
             
     return output
 
+# /history pages - the default and largest number of records per page
+HISTORY_PAGE = 50
+HISTORY_MAX_PAGE = 500
+
+# renderer descriptions only change with their settings - clients may keep
+# them for a minute, then check the ETag
+DESCRIPTION_CACHE_CONTROL = 'public, max-age=60'
+
+def record_printed(request, renderer, filename, cached, data):
+    """
+    Add a rendered file to the session's print history, returns its unique id.
+    """
+    info = IPrintedFiles(request.getSession())
+    
+    return info.add(filename, request.getClientIP(), renderer, cached, os.path.getsize(filename), data)
+
+def record_preview(request, renderer, body, data):
+    """
+    Add a preview rendered into memory to the session's print history, and
+    keep it with the service's previews. Returns its unique id.
+    """
+    info = IPrintedFiles(request.getSession())
+    
+    unique_id = info.add(None, request.getClientIP(), renderer, False, len(body), data)
+    
+    request.transport.protocol.factory.previews.put(unique_id, body)
+    
+    return unique_id
+
+def preview_resource(request, renderer, uid):
+    """
+    Return the resource that serves a file in the session's print history,
+    from memory or the spool, or None if it's gone.
+    """
+    to_serve = IPrintedFiles(request.getSession()).get(uid)
+    
+    if to_serve is None:
+        return None
+    
+    if to_serve.filename is None:
+        preview = request.transport.protocol.factory.previews.get(uid)
+        
+        if preview is None:
+            return None
+        
+        body, hashed, added = preview
+        
+        return MemoryPreview(body, hashed, added, renderer.content_type)
+    
+    if not os.path.exists(to_serve.filename):
+        return None
+    
+    return Preview(to_serve.filename, renderer.content_type)
+
+def record_queued(request, unique_id, job_id):
+    """
+    Note the print job a file in the session's print history was queued as.
+    """
+    printed = IPrintedFiles(request.getSession()).get(unique_id)
+    
+    if printed is not None:
+        printed.job_id = job_id
+
+def int_arg(request, name, default, minimum=0, maximum=None):
+    """
+    Read an integer query argument, clamped to the given range. Raises 
+    ValueError if it isn't an integer.
+    """
+    value = int(request.args.get(name, [default])[0])
+    
+    value = max(value, minimum)
+    
+    if maximum is not None:
+        value = min(value, maximum)
+    
+    return value
+
 class RendererForm(Resource):
     """
     GET: render the schema into an HTML form (uses: mod:`deform`).
@@ -95,7 +172,11 @@ class Renderer(JSONResource):
     """
     GET: Returns a renderer dumped as JSON.
     POST: Runs the renderer (JSON body expected), returns a URL to download the file.
-    PUT: runs the renderer and sends it off to CUPs
+    PUT: runs the renderer and queues it to be sent off to CUPs (202, with
+         the id of the queued job and its position in the queue)
+    
+    Previews (POST) are rendered ahead of everything else, prints at the
+    priority the renderer gives the data (see :mod:`autoprint.priority`).
     """
     
     def __init__(self, renderer):
@@ -104,21 +185,43 @@ class Renderer(JSONResource):
         
         JSONResource.__init__(self)
     
+    def render_GET(self, request):
+        return self._describe(request)
+    
+    def _describe(self, request):
+        """
+        Send the renderer's pre-encoded description, or a 304 if the client
+        already has it - only for plain GETs, responses to POST and PUT
+        serialize :attr:`_data`.
+        """
+        body, etag = self._renderer.encoded()
+        
+        request.setHeader('content-type', 'application/json')
+        request.setHeader('etag', etag)
+        request.setHeader('cache-control', DESCRIPTION_CACHE_CONTROL)
+        
+        matches = request.getHeader('if-none-match')
+        
+        if matches is not None and etag_matches(matches, etag):
+            request.setResponseCode(304)
+        else:
+            request.write(body)
+        
+        request.finish()
+    
     def getChild(self, name, request):
         """
         Overload getChild to pick up a request for a RendererForm
         """
-        session = request.getSession()
-        
         if name == 'form':
             return RendererForm(self._renderer)
+        elif name == 'batch':
+            return RendererBatch(self._renderer)
         else:
-            info = IPrintedFiles(session)
-            
-            to_serve = info.get(name, {'filename':None})
+            preview = preview_resource(request, self._renderer, name)
             
-            if to_serve['filename']:
-                return File(to_serve['filename'])
+            if preview is not None:
+                return preview
             else:
                 return NoResource()     
                 
@@ -128,49 +231,77 @@ class Renderer(JSONResource):
         Run the data supplied by the client through the Renderer
         """
         schema = self._renderer.schema
-        session = request.getSession()
+        factory = request.transport.protocol.factory
+        timer = factory.timer(self._renderer.name)
+        
         try:
-            appstruct = schema.deserialize(self._data)
-            filename = self._renderer(appstruct)
-            
-            info = IPrintedFiles(session)
-            
-            unique_id = str(uuid.uuid4().hex)
-            
-            info[unique_id] = {
-                'filename': filename,
-                'printed': datetime.now(),
-                'ip': request.getClientIP(),
-                'renderer': {
-                    'title':self._renderer.title,
-                    'id': self._renderer.name,
-                },
+            with timer.time('deserialize'):
+                appstruct = schema.deserialize(self._data)
+        except colander.Invalid, e:
+            request.setResponseCode(400)
+            self._data = e.asdict()
+            timer.setHeader(request)
+            return JSONResource.render_GET(self, request)
+        
+        # previews are only ever fetched by the client, so they're rendered
+        # into memory - prints are written to the spool for the queue
+        preview = request.method == 'POST'
+        
+        if preview:
+            level = priority.INTERACTIVE
+        else:
+            level = self._renderer.priority(appstruct)
+        
+        # the renderer runs off of the reactor thread
+        d = factory.render(self._renderer.name, appstruct, timer, level, memory=preview)
+        
+        def rendered(result):
+            if preview:
+                body, cached = result
                 
-            }
-            
-            if request.method == 'POST':
-                self._data = {'printed': unique_id}
-                return self.render_GET(request)
+                self._data = {'printed': record_preview(request, self._renderer, body, data=[appstruct])}
+                timer.setHeader(request)
+                return JSONResource.render_GET(self, request)
             else:
                 # PUT
-                d = request.transport.protocol.factory.printFile(filename, self._renderer.title)
+                filename, cached = result
+                
+                unique_id = record_printed(request, self._renderer, filename, cached, data=[appstruct])
                 
-                def result(jobid):
+                d = factory.queueFile(filename, self._renderer.title, self._renderer.name, timer, level)
+                
+                def result(queued):
+                    # queued - the dispatcher sends it on to CUPS
+                    jobid, position = queued
+                    
+                    record_queued(request, unique_id, jobid)
+                    
+                    request.setResponseCode(202)
+                    
                     self._data = {
                         'printed': unique_id,
                         'job_id': jobid,
+                        'queue_position': position,
+                        'priority': priority.NAMES[level],
                     }
                     
-                    return self.render_GET(request)
+                    timer.setHeader(request)
+                    return JSONResource.render_GET(self, request)
                     
                 d.addCallback(result)
                 
-                return NOT_DONE_YET
-            
-        except colander.Invalid, e:
-            request.setResponseCode(400)
-            self._data = e.asdict()
-            return self.render_GET(request)
+                return d
+        
+        def failed(failure):
+            request.setResponseCode(500)
+            self._data = {'error': failure.getErrorMessage()}
+            timer.setHeader(request)
+            return JSONResource.render_GET(self, request)
+        
+        d.addCallback(rendered)
+        d.addErrback(failed)
+        
+        return NOT_DONE_YET
     
     def render_POST(self, request):
         """
@@ -190,6 +321,116 @@ class Renderer(JSONResource):
         return self._render(request)
         
     
+class RendererBatch(JSONResource):
+    """
+    POST: Runs the renderer over a JSON array of payloads, producing a single
+          multi-page file. Returns an id to download the file.
+    PUT: Same, but queues the file to be sent to CUPS as a single job.
+    
+    Payloads that fail validation are skipped - their errors are returned in
+    the 'errors' dictionary, keyed by their (string) index in the array.
+    
+    Cards are tiled onto full sheets (see the 'imposition' setting of the 
+    print service) unless the 'impose' query argument is 0.
+    
+    Batches print at bulk priority.
+    """
+    isLeaf = True
+    
+    def __init__(self, renderer):
+        self._renderer = renderer
+        
+        JSONResource.__init__(self)
+    
+    def _render(self, request):
+        schema = self._renderer.schema
+        factory = request.transport.protocol.factory
+        
+        if not isinstance(self._data, list):
+            request.setResponseCode(400)
+            self._data = {'error': 'Expected a JSON array of payloads'}
+            return self.render_GET(request)
+        
+        timer = factory.timer(self._renderer.name)
+        
+        appstructs = []
+        errors = {}
+        
+        with timer.time('deserialize'):
+            for index, payload in enumerate(self._data):
+                try:
+                    appstructs.append(schema.deserialize(payload))
+                except colander.Invalid, e:
+                    errors[str(index)] = e.asdict()
+        
+        if not appstructs:
+            request.setResponseCode(400)
+            self._data = {'errors': errors}
+            timer.setHeader(request)
+            return self.render_GET(request)
+        
+        impose = request.args.get('impose', ['1'])[0].lower() not in ('0', 'false', 'no')
+        
+        preview = request.method == 'POST'
+        
+        if preview:
+            level = priority.INTERACTIVE
+        else:
+            level = priority.BULK
+        
+        d = factory.renderBatch(self._renderer.name, appstructs, impose, timer, level, memory=preview)
+        
+        def rendered(result):
+            if preview:
+                body, cached = result
+                
+                unique_id = record_preview(request, self._renderer, body, data=appstructs)
+            else:
+                filename, cached = result
+                
+                unique_id = record_printed(request, self._renderer, filename, cached, data=appstructs)
+            
+            self._data = {
+                'printed': unique_id,
+                'count': len(appstructs),
+                'errors': errors,
+            }
+            
+            if preview:
+                timer.setHeader(request)
+                return self.render_GET(request)
+            
+            d = factory.queueFile(filename, self._renderer.title, self._renderer.name, timer, level)
+            
+            def result(queued):
+                request.setResponseCode(202)
+                self._data['job_id'], self._data['queue_position'] = queued
+                record_queued(request, unique_id, self._data['job_id'])
+                self._data['priority'] = priority.NAMES[level]
+                timer.setHeader(request)
+                return self.render_GET(request)
+            
+            d.addCallback(result)
+            
+            return d
+        
+        def failed(failure):
+            request.setResponseCode(500)
+            self._data = {'error': failure.getErrorMessage()}
+            timer.setHeader(request)
+            return self.render_GET(request)
+        
+        d.addCallback(rendered)
+        d.addErrback(failed)
+        
+        return NOT_DONE_YET
+    
+    def render_POST(self, request):
+        return self._render(request)
+    
+    def render_PUT(self, request):
+        return self._render(request)
+
 class RendererList(JSONResource):
     """
     Returns a list of renderers as JSON
@@ -209,24 +450,125 @@ class RendererList(JSONResource):
 
 class RendererPrintedList(JSONResource):
     """
-    Returns a dictionary of printed items via JSON
+    GET: Returns a page of the session's printed items via JSON, newest 
+         first. Takes 'offset' and 'limit' query arguments - the total is
+         returned in the x-total-count header, and the next page in a 
+         'next' link header.
+    PUT: Reprint items - expects a JSON array of their uids. Items from the 
+         same renderer are tiled onto sheets and queued for CUPS as one job,
+         at bulk priority.
     """
     def _adjust_data(self, request):
+        if request.method in ('POST', 'PUT'):
+            return
+        
         session = request.getSession()
         info = IPrintedFiles(session)
         
-        # filter out any possibly sensitive data (e.g. the filename)
-        to_return = []
+        try:
+            offset = int_arg(request, 'offset', 0)
+            limit = int_arg(request, 'limit', HISTORY_PAGE, 1, HISTORY_MAX_PAGE)
+        except ValueError:
+            request.setResponseCode(400)
+            self._data = {'error': 'offset and limit must be integers'}
+            return
+        
+        total = len(info)
+        
+        request.setHeader('x-total-count', str(total))
+        
+        if offset + limit < total:
+            request.setHeader('link', '<%s?offset=%s&limit=%s>; rel="next"' % (request.path, offset + limit, limit))
+        
+        # records only serialize what's safe to show (e.g. not the filename)
+        self._data = info.page(offset, limit)
+    
+    def render_PUT(self, request):
+        factory = request.transport.protocol.factory
+        info = IPrintedFiles(request.getSession())
+        
+        if not isinstance(self._data, list):
+            request.setResponseCode(400)
+            self._data = {'error': 'Expected a JSON array of uids'}
+            return self.render_GET(request)
+        
+        missing = [uid for uid in self._data if uid not in info]
+        
+        if missing:
+            request.setResponseCode(404)
+            self._data = {'missing': missing}
+            return self.render_GET(request)
+        
+        # group the cards by renderer, keeping the order they were asked for
+        grouped = OrderedDict()
+        
+        for uid in self._data:
+            printed = info[uid]
+            grouped.setdefault(printed.renderer, []).extend(printed.data)
         
-        for uid, printed in info.iteritems():
+        timers = []
+        
+        def reprint(name, items):
+            renderer = factory.renderers[name]
             
-            to_return.append({
-                    'printed': printed['printed'].isoformat(),
-                    'renderer': printed['renderer'],
-                    'uid': uid,
-            })
+            timer = factory.timer(name)
+            timers.append(timer)
+            
+            d = factory.renderBatch(name, items, True, timer)
+            
+            def rendered(result):
+                filename, cached = result
+                
+                unique_id = record_printed(request, renderer, filename, cached, data=items)
+                
+                d = factory.queueFile(filename, renderer.title, name, timer, priority.BULK)
+                
+                def queued((jobid, position)):
+                    record_queued(request, unique_id, jobid)
+                    
+                    return {
+                        'renderer': name,
+                        'printed': unique_id,
+                        'count': len(items),
+                        'job_id': jobid,
+                        'queue_position': position,
+                        'priority': priority.NAMES[priority.BULK],
+                    }
+                
+                d.addCallback(queued)
+                
+                return d
+            
+            d.addCallback(rendered)
+            
+            return d
+        
+        d = defer.gatherResults([reprint(name, items) for name, items in grouped.iteritems()], consumeErrors=True)
         
-        self._data = to_return
+        def timed(result):
+            for timer in timers:
+                timer.finish()
+            
+            request.setHeader('server-timing', ', '.join(timer.header() for timer in timers))
+            
+            return result
+        
+        def result(jobs):
+            request.setResponseCode(202)
+            self._data = {'jobs': jobs}
+            return self.render_GET(request)
+        
+        def failed(failure):
+            request.setResponseCode(500)
+            self._data = {'error': failure.getErrorMessage()}
+            return self.render_GET(request)
+        
+        d.addBoth(timed)
+        
+        d.addCallback(result)
+        d.addErrback(failed)
+        
+        return NOT_DONE_YET
     
 
 class RendererAPI(Resource):
@@ -236,6 +578,8 @@ class RendererAPI(Resource):
                         POST, preview renderer
                         PUT, print renderer
     /renderers/[name]/form - GET, HTML rendering of a deform form.
+    /renderers/[name]/batch - POST, preview many payloads as one file
+                              PUT, print many payloads as one job
     """
     
     def render_GET(self, request):
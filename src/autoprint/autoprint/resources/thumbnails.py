@@ -0,0 +1,97 @@
+"""
+Thumbnail Resources - PNG previews of rendered files
+"""
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET
+from twisted.internet import defer
+from twisted.python import log
+
+from .preview import Preview
+
+def width_arg(request, default):
+    """
+    Read the width ('w') query argument. Raises ValueError if it isn't a
+    positive integer.
+    """
+    width = int(request.args.get('w', [default])[0])
+
+    if width <= 0:
+        raise ValueError(width)
+
+    return width
+
+class Thumbnail(Resource):
+    """
+    GET: a PNG of the first page of a file - ?w= picks the width, which is
+         rounded up to the nearest width thumbnails are made at. The file
+         is looked up with the factory's thumbnailSource method, which may
+         return a deferred.
+    """
+    isLeaf = True
+
+    def __init__(self, thumbnail_id):
+        Resource.__init__(self)
+
+        self._id = thumbnail_id
+
+    def render_GET(self, request):
+        factory = request.transport.protocol.factory
+
+        try:
+            width = width_arg(request, factory.thumbnailer.width)
+        except ValueError:
+            request.setResponseCode(400)
+            return 'w must be a positive integer'
+
+        source = factory.thumbnailSource(self._id, request)
+
+        if source is None:
+            request.setResponseCode(404)
+            return 'No such file'
+
+        if not isinstance(source, defer.Deferred):
+            return self._thumbnail(source, width, request)
+
+        def lost(failure):
+            log.err(failure, "Couldn't find the file for thumbnail %s" % self._id)
+
+            request.setResponseCode(500)
+            request.finish()
+
+        source.addCallbacks(self._thumbnail, lost, callbackArgs=(width, request))
+
+        return NOT_DONE_YET
+
+    def _thumbnail(self, filename, width, request):
+        factory = request.transport.protocol.factory
+
+        d = factory.thumbnailer.thumbnail(filename, width)
+
+        def made(path):
+            body = Preview(path, 'image/png').render_GET(request)
+
+            if body is not NOT_DONE_YET:
+                request.write(body)
+                request.finish()
+
+        def failed(failure):
+            log.msg("Couldn't make a thumbnail of %s: %s" % (filename, failure.getErrorMessage()))
+
+            request.setResponseCode(503)
+            request.write('Thumbnails are not available')
+            request.finish()
+
+        d.addCallbacks(made, failed)
+
+        return NOT_DONE_YET
+
+class Thumbnails(Resource):
+    """
+    Container for :class:`Thumbnail` resources, by id.
+    """
+
+    def getChild(self, name, request):
+        if name:
+            return Thumbnail(name)
+
+        return Resource.getChild(self, name, request)
@@ -4,6 +4,7 @@ Services provided by this application.
 
 from twisted.web.server import Site
 from twisted.web.resource import Resource
+from twisted.internet import reactor
 
 class ConfigurableSite(Site):
     """
@@ -21,6 +22,9 @@ class ConfigurableSite(Site):
     # to __init__, but aren't valid arguments to Site.__init__()
     _defaults = None
     
+    # True between startFactory() and stopFactory()
+    running = False
+    
     def _filter_settings(self, kwargs):
         """
         Takes a dictionary of key-word arguments - sets self.settings, and returns
@@ -50,3 +54,26 @@ class ConfigurableSite(Site):
     
         Site.__init__(self, self.root(), **kwargs)
         
+        reactor.addSystemEventTrigger('before', 'shutdown', self._shutdown)
+    
+    def startFactory(self):
+        self.running = True
+        Site.startFactory(self)
+    
+    def stopFactory(self):
+        """
+        Child classes stop whatever they started here - it's called once the
+        site stops listening, or as the reactor shuts down, whichever comes
+        first. Only ever called while :attr:`running`.
+        """
+        self.running = False
+        Site.stopFactory(self)
+    
+    def _shutdown(self):
+        """
+        Stop before the reactor shuts down rather than when the ports close,
+        so the reactor waits for any deferred stopFactory() returns.
+        """
+        if self.running:
+            return self.stopFactory()
+        
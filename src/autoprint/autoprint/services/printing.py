@@ -5,10 +5,30 @@ The Print Service
 from twisted.web.server import NOT_DONE_YET
 from . import ConfigurableSite
 from twisted.internet.threads import deferToThread
+from twisted.internet import defer
+from twisted.internet.task import LoopingCall
 from twisted.web.resource import Resource
+from twisted.python import failure, log
 import cups, pkg_resources
-from ..resources import appstatus, renderers
+from ..resources import appstatus, renderers, metrics, jobs, thumbnails
 from ..util import loadRenderers
+from ..workers import createExecutor, MEMORY
+from ..cache import RenderCache, PreviewCache, cache_key
+from ..timing import Timings, RequestStats
+from ..printerstate import PrinterStateCache
+from ..cupspool import ConnectionPool, stream_job
+from ..printers import PrinterPool, NoPrinterAvailable, printer_fault, page_size
+from ..jobqueue import JobQueue, PrintDispatcher, SUBMITTED
+from ..jobtracker import JobTracker
+from ..history import PrintHistory
+from ..spool import Spool, PREFIX
+from ..thumbnails import Thumbnailer, ThumbnailCache, rasterizer
+from ..session import IPrintedFiles
+from ..coalesce import PdfFileMerger, merge_pdfs, batch_title
+from .. import priority
+import os
+import time, datetime
+from collections import Counter
 
 class PrintService(ConfigurableSite):
     """
@@ -16,10 +36,81 @@ class PrintService(ConfigurableSite):
     requests into physical paper via CUPS
     """
     _defaults = {
+        # thumbnails of rendered files (see autoprint.thumbnails) - made
+        # with PyMuPDF if it's installed, otherwise with ImageMagick from
+        # imagemagick_path (None to find it on the path). They're made at
+        # thumbnail_width ahead of time, and at any of thumbnail_widths on
+        # request, and kept in thumbnail_directory (a directory in the spool
+        # if None)
         'imagemagick_path': None,
-        'thumbnail_width': None,
+        'thumbnail_width': 256,
+        'thumbnail_widths': (128, 256, 512),
+        'thumbnail_workers': 2,
+        'thumbnail_directory': None,
+        'thumbnail_cache_bytes': 64*1024*1024,
+        # name of the CUPS queue to print to, or a list of them to spread
+        # jobs across - None for the default printer
         'printer_to_use': None,
+        # seconds to skip a printer after it rejects a job
+        'printer_cooldown': 60,
+        # where rendered files are written - the same directory of the
+        # user's in the system's temporary directory on every run if None
+        # (see autoprint.spool.default_directory). Files nothing refers to
+        # are deleted once they're older than spool_max_age seconds, or
+        # earlier while the spool is bigger than spool_max_bytes; the spool
+        # is checked every spool_sweep_interval
         'working_directory': None,
+        'spool_max_bytes': 1024*1024*1024,
+        'spool_max_age': 60*60,
+        'spool_sweep_interval': 60,
+        'render_backend': 'thread',
+        'render_workers': 4,
+        'render_max_jobs': 100,
+        'render_timeout': 60,
+        # measure the words of wrapped paragraphs through the font metrics
+        # cache (see autoprint.renderers.util.cache_paragraph_metrics)
+        'render_paragraph_metrics': True,
+        'render_cache_entries': 256,
+        'render_cache_bytes': 64*1024*1024,
+        # previews (POSTs) are rendered into memory, and kept there for
+        # clients to fetch - up to this many bytes of them
+        'preview_cache_bytes': 64*1024*1024,
+        # options for autoprint.renderers.imposition.Imposition, used to tile
+        # batches and reprints onto full sheets. None disables imposition.
+        'imposition': {
+            'sheet_size': 'letter',
+            'cut_marks': True,
+        },
+        # seconds between printer status refreshes, and between checks for
+        # CUPS printer events (None to disable the event subscription)
+        'printer_status_interval': 30,
+        'printer_notify_interval': 2,
+        # CUPS connections (and concurrent CUPS calls) for submitting jobs
+        'cups_connections': 4,
+        # the durable print job queue - defaults to autoprint-jobs.sqlite in
+        # the spool, which is the same directory on every run, so queued
+        # jobs survive a restart. Submitted and failed jobs are kept for job_retention
+        # seconds (None to keep them forever)
+        'job_database': None,
+        'job_retention': 7*24*60*60,
+        'print_concurrency': 2,
+        'print_max_attempts': 5,
+        'print_retry_delay': 2,
+        'print_retry_max_delay': 300,
+        # hold queued jobs for up to this many seconds, so bursts for the
+        # same renderer go to CUPS as one job of at most this many files
+        'print_coalesce_window': 1,
+        'print_coalesce_max': 50,
+        # print history - at most this many records in all, and per session,
+        # kept for at most this many seconds
+        'history_max_entries': 10000,
+        'history_per_session': 200,
+        'history_ttl': 24*60*60,
+        # seconds between checks on the CUPS jobs clients may be following
+        'job_poll_interval': 2,
+        # seconds a queued render or print job waits to move up one priority
+        # level (see autoprint.priority)
+        'priority_aging': priority.AGING,
     }
     
     def root(self):
@@ -29,41 +120,624 @@ class PrintService(ConfigurableSite):
         root.putChild("status", appstatus.ServiceStatusJSON())
         root.putChild("renderers", renderers.RendererAPI())
         root.putChild("history", renderers.RendererPrintedList())
+        root.putChild("jobs", jobs.Jobs())
+        root.putChild("thumbnails", thumbnails.Thumbnails())
+        root.putChild("metrics", metrics.Metrics())
         
         return root
     
     def __init__(self, **kwargs):
         ConfigurableSite.__init__(self, **kwargs)
         
-        self._connection = cups.Connection()
+        self.cups = ConnectionPool(
+            cups.Connection,
+            self.settings['cups_connections'],
+            keep_on=(cups.IPPError, NoPrinterAvailable),
+        )
+        
         self.renderers = loadRenderers()
-        self.printer = self._connection.getDefault()
-
+        
+        self.spool = Spool(
+            self.settings['working_directory'],
+            self.settings['spool_max_bytes'],
+            self.settings['spool_max_age'],
+        )
+        
+        self.thumbnailer = Thumbnailer(
+            ThumbnailCache(
+                self.settings['thumbnail_directory'] or os.path.join(self.spool.directory, 'thumbnails'),
+                self.settings['thumbnail_cache_bytes'],
+            ),
+            rasterizer(self.settings['imagemagick_path']),
+            self.settings['thumbnail_workers'],
+            self.settings['thumbnail_widths'],
+            self.settings['thumbnail_width'],
+        )
+        
+        self.renderExecutor = createExecutor(
+            self.settings['render_backend'],
+            self.renderers,
+            self.settings['render_workers'],
+            max_jobs=self.settings['render_max_jobs'],
+            timeout=self.settings['render_timeout'],
+            paragraph_metrics=self.settings['render_paragraph_metrics'],
+            aging=self.settings['priority_aging'],
+        )
+        
+        self.renderCache = RenderCache(
+            self.settings['render_cache_entries'],
+            self.settings['render_cache_bytes'],
+        )
+        
+        self.previews = PreviewCache(self.settings['preview_cache_bytes'])
+        
+        # renders currently running, by cache key - identical requests that
+        # arrive while one is running wait for it instead of rendering again
+        self._rendering = {}
+        
+        self.timings = Timings()
+        self.requestStats = RequestStats()
+        
+        # print jobs sent to CUPS, by outcome
+        self.printJobs = Counter()
+        
+        printers = self.settings['printer_to_use']
+        
+        if isinstance(printers, basestring):
+            printers = [printers]
+        
+        self.printerState = PrinterStateCache(
+            cups.Connection,
+            interval=self.settings['printer_status_interval'],
+            notify_interval=self.settings['printer_notify_interval'],
+            printers=printers,
+        )
+        
+        self.printers = PrinterPool(self.printerState, self.settings['printer_cooldown'])
+        
+        self.jobQueue = JobQueue(
+            self.settings['job_database'] or os.path.join(self.spool.directory, 'autoprint-jobs.sqlite')
+        )
+        
+        self.dispatcher = PrintDispatcher(
+            self.jobQueue,
+            self._submitJobs,
+            concurrency=self.settings['print_concurrency'],
+            max_attempts=self.settings['print_max_attempts'],
+            retry_delay=self.settings['print_retry_delay'],
+            max_delay=self.settings['print_retry_max_delay'],
+            window=self.settings['print_coalesce_window'],
+            batch_size=self.settings['print_coalesce_max'],
+            aging=self.settings['priority_aging'],
+            retention=self.settings['job_retention'],
+        )
+        self.dispatcher.onFinished(lambda job: self._released(job['filename']))
+        
+        self.jobTracker = JobTracker(self.cups, self.settings['job_poll_interval'])
+        
+        self.printHistory = PrintHistory(
+            self.settings['history_max_entries'],
+            self.settings['history_per_session'],
+            self.settings['history_ttl'],
+        )
+        self.printHistory.onEvict(self._evicted)
+        
+        # rendered files waiting in the print queue, and how many jobs each
+        # is waiting for
+        self._queuedFiles = Counter()
+        
+        self._expireHistory = LoopingCall(self.printHistory.expire)
+        self._sweepSpool = LoopingCall(self.sweepSpool)
     
-    def _printerStatus(self):
+    def startFactory(self):
+        self.renderExecutor.start()
+        self.printerState.start()
+        self.cups.start()
+        self.dispatcher.start()
+        self.jobTracker.start()
+        
+        self._expireHistory.start(60, now=False)
+        self._sweepSpool.start(self.settings['spool_sweep_interval'], now=False)
+        
+        self.thumbnailer.start()
+        self.thumbnailer.watch(self.spool.directory, PREFIX)
+        
+        ConfigurableSite.startFactory(self)
+    
+    def stopFactory(self):
         """
-        Return a dictionary containing information about the current printer
-        status.
+        Stop everything startFactory() started, in reverse. Returns a
+        deferred that fires once it has all stopped.
         """
-        printer = self._connection.getDefault()
-        attributes = self._connection.getPrinterAttributes(printer)
+        if not self.running:
+            return
+        
+        for loop in (self._expireHistory, self._sweepSpool):
+            if loop.running:
+                loop.stop()
+        
+        stops = (
+            self.thumbnailer.stop,
+            self.jobTracker.stop,
+            self.dispatcher.stop,
+            self.cups.stop,
+            self.printerState.stop,
+            self.renderExecutor.stop,
+        )
+        
+        d = defer.DeferredList([defer.maybeDeferred(stop) for stop in stops], consumeErrors=True)
+        
+        def stopped(results):
+            for success, result in results:
+                if not success:
+                    log.err(result, "Error stopping the print service")
+        
+        d.addCallback(stopped)
         
-        return {
-            'printer': printer,
-            'attributes': attributes,
-        }
+        ConfigurableSite.stopFactory(self)
+        
+        return d
+    
+    def _route(self, request):
+        """
+        Collapse the request's path into a route, so per-route metrics don't
+        grow with every renderer, printed file or bad URL.
+        """
+        segments = request.path.split('/')[1:]
+        
+        if segments[0] not in self.resource.children:
+            return 'other'
+        
+        if segments[0] == 'renderers' and len(segments) > 1 and segments[1]:
+            if len(segments) == 2 or not segments[2]:
+                return '/renderers/{renderer}'
+            
+            if segments[2] in ('form', 'batch'):
+                return '/renderers/{renderer}/%s' % segments[2]
+            
+            return '/renderers/{renderer}/{printed}'
+        
+        if segments[0] == 'jobs' and len(segments) > 1 and segments[1]:
+            return '/jobs/{job}'
+        
+        if segments[0] == 'thumbnails' and len(segments) > 1 and segments[1]:
+            return '/thumbnails/{printed}'
+        
+        return '/' + segments[0]
+    
+    def getResourceFor(self, request):
+        request.started = time.time()
+        
+        return ConfigurableSite.getResourceFor(self, request)
+    
+    def log(self, request):
+        """
+        Record the request in the per-route metrics as it finishes.
+        """
+        ConfigurableSite.log(self, request)
+        
+        started = getattr(request, 'started', None)
+        
+        if started is not None:
+            self.requestStats.observe(self._route(request), request.method, request.code, time.time() - started)
+    
+    def timer(self, renderer):
+        """
+        Return a :class:`autoprint.timing.RequestTimer` to time the phases of
+        a request to the named renderer.
+        """
+        return self.timings.timer(renderer)
+    
+    def _render(self, renderer, method, args, timer=None, priority=priority.NORMAL, memory=False):
+        """
+        Call the given method of the named renderer through the render cache
+        and the render executor, at the given priority.
+        
+        The file is written to a new path in the spool, which is passed to
+        the method after args.
+        
+        Returns a deferred that fires with a tuple of the rendered file's path
+        and a flag that is True if the file came from the render cache.
+        
+        If memory is True, the file is rendered into memory instead, and the
+        deferred fires with its bytes in place of the path - these renders 
+        skip the render cache, which holds files.
+        
+        The phases of the render are recorded in timer, if given.
+        """
+        if timer is None:
+            timer = self.timer(renderer)
+        
+        start = time.time()
+        
+        def timed(result):
+            filename, phases = result
+            
+            phases['render'] = time.time() - start
+            timer.update(phases)
+            
+            return filename
+        
+        if memory:
+            d = self.renderExecutor.submit(renderer, method, *(tuple(args) + (MEMORY,)), priority=priority)
+            d.addCallback(timed)
+            d.addCallback(lambda body: (body, False))
+            return d
+        
+        def submit():
+            output = self.spool.path()
+            
+            def failed(failure):
+                self._discard(output)
+                return failure
+            
+            d = self.renderExecutor.submit(renderer, method, *(tuple(args) + (output,)), priority=priority)
+            d.addErrback(failed)
+            
+            return d
+        
+        if not self.renderCache.enabled:
+            d = submit()
+            d.addCallback(timed)
+            d.addCallback(lambda filename: (filename, False))
+            return d
+        
+        key = cache_key(renderer, [method, args], self.renderers[renderer].settings)
+        
+        filename = self.renderCache.get(key)
+        
+        if filename:
+            return defer.succeed((filename, True))
+        
+        if key in self._rendering:
+            d = defer.Deferred()
+            self._rendering[key].append(d)
+            
+            def waited(result):
+                timer.record('render', time.time() - start)
+                return result
+            
+            d.addCallback(waited)
+            
+            return d
+        
+        waiting = self._rendering[key] = []
+        
+        def rendered(filename):
+            self.renderCache.put(key, filename)
+            return filename
+        
+        def notify(result):
+            del self._rendering[key]
+            
+            for d in waiting:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback((result, True))
+            
+            return result
+        
+        d = submit()
+        d.addCallback(timed)
+        d.addCallback(rendered)
+        d.addBoth(notify)
+        d.addCallback(lambda filename: (filename, False))
+        
+        return d
+    
+    def render(self, renderer, data, timer=None, priority=priority.NORMAL, memory=False):
+        """
+        Run the named renderer with the (deserialized) data off of the reactor
+        thread. See :meth:`_render` for the result.
+        """
+        return self._render(renderer, '__call__', (data,), timer, priority, memory)
+    
+    def renderBatch(self, renderer, items, impose=False, timer=None, priority=priority.BULK, memory=False):
+        """
+        Render a list of (deserialized) data into a single multi-page file.
+        See :meth:`_render` for the result.
+        
+        If impose is True, the cards are tiled onto sheets as configured by
+        the 'imposition' setting.
+        """
+        imposition = None
+        
+        if impose and self.settings['imposition'] is not None:
+            imposition = self.settings['imposition']
+        
+        return self._render(renderer, 'batch', (items, imposition), timer, priority, memory)
     
     def printerStatus(self):
-        return deferToThread(self._printerStatus)
+        """
+        Return a deferred that fires with a dictionary of the current printer
+        status - read from the printer state cache, CUPS isn't called.
+        """
+        return defer.succeed(self.printerState.status())
+        
+    def printFile(self, path, title, timer=None):
+        """
+        Send a file to the best available printer (see 
+        :class:`autoprint.printers.PrinterPool`).
+        
+        The time spent waiting for a thread ('print_wait') and in CUPS 
+        ('cups') is recorded in timer, if given.
+        """
+        return self.printFiles([path], title, timer)
+    
+    def printFiles(self, paths, title, timer=None):
+        """
+        Send several files to a printer as a single job - merged into one
+        document if PyPDF2 is installed (the time that takes is recorded as
+        'merge'), otherwise as a multi-document job.
         
-    def printFile(self, path, title):
+        The files are streamed to CUPS (see 
+        :func:`autoprint.cupspool.stream_job`), and merged documents never
+        touch the disk.
+        
+        If the chosen printer turns out to be unable to take jobs, the next
+        best one is tried.
+        
+        The files are opened (and merged) before a CUPS connection is checked
+        out, so a missing file fails the job without counting against the
+        connection or the printers.
         """
-        Send a file to the print queue.
+        start = time.time()
+        
+        def documents():
+            if len(paths) > 1 and PdfFileMerger is not None:
+                return [(title, merge_pdfs(paths))]
+            
+            return [(os.path.basename(path), open(path, 'rb')) for path in paths]
+        
+        def prepare():
+            pagesize = page_size(paths[0])
+            merged = documents()
+            
+            return pagesize, merged, time.time()
+        
+        def close(merged):
+            for name, data in merged:
+                if not isinstance(data, basestring):
+                    data.close()
+        
+        def printFiles(connection, pagesize, merged, merging):
+            started = time.time()
+            tried = []
+            
+            try:
+                while True:
+                    printer = self.printers.choose(pagesize, tried)
+                    
+                    try:
+                        jobid = stream_job(connection, printer, title, merged)
+                    except cups.IPPError, e:
+                        if not printer_fault(e):
+                            raise
+                        
+                        self.printers.failed(printer, e)
+                        tried.append(printer)
+                        
+                        # start the files again for the next printer
+                        for name, data in merged:
+                            if not isinstance(data, basestring):
+                                data.seek(0)
+                        
+                        continue
+                    
+                    self.printers.submitted(printer, len(paths))
+                    
+                    return jobid, merging, started, time.time()
+            finally:
+                close(merged)
+        
+        def send(prepared):
+            d = self.cups.run(printFiles, *prepared)
+            
+            def unsent(failure):
+                # closed here too if the pool never ran printFiles
+                close(prepared[1])
+                return failure
+            
+            d.addErrback(unsent)
+            
+            return d
+        
+        def timed(result):
+            jobid, merging, started, finished = result
+            
+            if timer is not None:
+                if len(paths) > 1:
+                    timer.record('merge', merging - start)
+                
+                timer.record('print_wait', started - merging)
+                timer.record('cups', finished - started)
+            
+            self.printJobs['submitted'] += 1
+            
+            return jobid
+        
+        def failed(failure):
+            self.printJobs['failed'] += 1
+            return failure
+        
+        d = deferToThread(prepare)
+        d.addCallback(send)
+        d.addCallbacks(timed, failed)
+        
+        return d
+    
+    def queueFile(self, path, title, renderer=None, timer=None, priority=priority.NORMAL):
+        """
+        Add a file to the durable print queue - it's sent to CUPS by the 
+        dispatcher. Returns a deferred that fires with a tuple of the queued
+        job's id and its position in the queue (the number of jobs that will
+        be sent before it) once it's safely stored.
         """
+        start = time.time()
+        
+        self._queuedFiles[path] += 1
+        
+        d = self.dispatcher.enqueue(path, title, renderer, priority)
         
-        return deferToThread(self._connection.printFile,
-            title=title,           # title
-            printer=self.printer,       # the printer to use (it's name)
-            filename=path,         # file to print
-            options={},
+        def queued(job_id):
+            if timer is not None:
+                timer.record('enqueue', time.time() - start)
+            
+            d = self.dispatcher.position(job_id)
+            d.addCallback(lambda position: (job_id, position))
+            
+            return d
+        
+        def wake(result):
+            self.dispatcher.wake()
+            return result
+        
+        d.addCallback(queued)
+        d.addCallback(wake)
+        
+        return d
+    
+    def _submitJobs(self, jobs):
+        """
+        Send a batch of queued jobs to CUPS as one job - used by the 
+        dispatcher. The CUPS job is followed by the job tracker.
+        """
+        d = self.printFiles(
+            [job['filename'] for job in jobs],
+            batch_title([job['title'] for job in jobs]),
+            self.timer(jobs[0]['renderer']),
         )
+        
+        def track(jobid):
+            self.jobTracker.track(jobid)
+            return jobid
+        
+        d.addCallback(track)
+        
+        return d
+    
+    def _discard(self, filename):
+        """
+        Delete a rendered file, unless the print history, the render cache or
+        the print queue still needs it.
+        """
+        if self.printHistory.references(filename) or self.renderCache.holds(filename) or self._queuedFiles[filename]:
+            return
+        
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+    
+    def sweepSpool(self):
+        """
+        Delete the spool's files that have outlived its quotas, keeping any
+        the print history, the render cache or the print queue still refer
+        to. The sweep runs in a thread.
+        
+        The queue is asked for its files too - jobs it recovered after a
+        restart aren't in _queuedFiles.
+        """
+        d = self.jobQueue.pendingFiles()
+        
+        def sweep(pending):
+            referenced = self.printHistory.filenames() | self.renderCache.paths() | frozenset(self._queuedFiles) | pending
+            
+            return deferToThread(self.spool.sweep, referenced)
+        
+        d.addCallback(sweep)
+        # keep sweeping after a failure
+        d.addErrback(log.err, "Spool sweep failed")
+        
+        return d
+    
+    def _evicted(self, record):
+        """
+        A record was dropped from the print history.
+        """
+        if record.filename is None:
+            self.previews.discard(record.uid)
+        else:
+            self._discard(record.filename)
+    
+    def _released(self, filename):
+        """
+        A queued file has been sent to CUPS, which keeps its own copy, or
+        its job has failed for good.
+        """
+        self._queuedFiles[filename] -= 1
+        
+        if self._queuedFiles[filename] <= 0:
+            del self._queuedFiles[filename]
+            self._discard(filename)
+    
+    def thumbnailSource(self, uid, request):
+        """
+        Return the file a thumbnail shows - one the session has printed,
+        by the uid in its print history. None if there isn't one.
+        
+        Previews rendered in memory are written to the spool (by their hash,
+        so only once) when a thumbnail is asked for - for those, this returns
+        a deferred that fires with the path.
+        """
+        printed = IPrintedFiles(request.getSession()).get(uid)
+        
+        if printed is None:
+            return None
+        
+        if printed.filename is None:
+            preview = self.previews.get(uid)
+            
+            if preview is None:
+                return None
+            
+            body, hashed, added = preview
+            
+            return deferToThread(self.spool.store, body, 'preview-%s.pdf' % hashed)
+        
+        if not os.path.exists(printed.filename):
+            return None
+        
+        return printed.filename
+    
+    def jobStatus(self, job_ids):
+        """
+        Return a deferred that fires with a dictionary of the status of the 
+        given queued jobs, keyed by id (unknown ids are left out).
+        
+        The queue is a local database, and what CUPS says comes from the job
+        tracker - so this never calls CUPS, however many clients ask.
+        """
+        d = self.jobQueue.getMany(job_ids, self.settings['priority_aging'])
+        
+        def status(jobs):
+            result = {}
+            
+            for job_id, job in jobs.iteritems():
+                tracked = self.jobTracker.get(job['cups_job_id'])
+                
+                state = job['state']
+                
+                if state == SUBMITTED and tracked is not None and tracked.state != 'unknown':
+                    state = tracked.state
+                
+                result[job_id] = {
+                    'job_id': job_id,
+                    'state': state,
+                    'queue_state': job['state'],
+                    'queue_position': job['queue_position'],
+                    'priority': priority.NAMES.get(job['priority']),
+                    'renderer': job['renderer'],
+                    'attempts': job['attempts'],
+                    'error': job['error'],
+                    'created': datetime.datetime.fromtimestamp(job['created']).isoformat(),
+                    'updated': datetime.datetime.fromtimestamp(job['updated']).isoformat(),
+                    'cups': tracked.asdict() if tracked is not None else None,
+                }
+            
+            return result
+        
+        d.addCallback(status)
+        
+        return d
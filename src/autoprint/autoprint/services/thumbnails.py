@@ -1,19 +1,80 @@
 """
 Service that generates (and serves) thumbnail images from printable files
 
-:todo: shelling out to ImageMagick now to create the thumbnails - not sure how
-       scalable that is, it might be a good idea to use another mechanism
+Thumbnails of the files in a directory are served at /thumbnails/<file
+name>?w=<width>, and made ahead of time as files are written there. The
+print service serves thumbnails of the files each session has printed the
+same way - see :mod:`autoprint.thumbnails`.
 """
 
-from twisted.web.server import NOT_DONE_YET
 from . import ConfigurableSite
-from twisted.internet.threads import deferToThread
 from twisted.web.resource import Resource
-from twisted.internet import inotify
-from twisted.python import filepath
+from ..resources import thumbnails
+from ..thumbnails import Thumbnailer, ThumbnailCache, rasterizer
+import os
 
 class ThumbnailService(ConfigurableSite):
     """
-    
+    Twisted service that serves thumbnails of the files in a directory
     """
+    _defaults = {
+        # the directory of printable files
+        'directory': None,
+        # see PrintService
+        'imagemagick_path': None,
+        'thumbnail_width': 256,
+        'thumbnail_widths': (128, 256, 512),
+        'thumbnail_workers': 2,
+        'thumbnail_directory': None,
+        'thumbnail_cache_bytes': 64*1024*1024,
+    }
+    
+    def root(self):
+        root = Resource()
+        root.putChild("thumbnails", thumbnails.Thumbnails())
+        return root
+    
+    def __init__(self, **kwargs):
+        ConfigurableSite.__init__(self, **kwargs)
+        
+        self.directory = os.path.abspath(self.settings['directory'])
+        
+        self.thumbnailer = Thumbnailer(
+            ThumbnailCache(
+                self.settings['thumbnail_directory'] or os.path.join(self.directory, '.thumbnails'),
+                self.settings['thumbnail_cache_bytes'],
+            ),
+            rasterizer(self.settings['imagemagick_path']),
+            self.settings['thumbnail_workers'],
+            self.settings['thumbnail_widths'],
+            self.settings['thumbnail_width'],
+        )
+    
+    def startFactory(self):
+        self.thumbnailer.start()
+        self.thumbnailer.watch(self.directory)
+        
+        ConfigurableSite.startFactory(self)
+    
+    def stopFactory(self):
+        if not self.running:
+            return
+        
+        self.thumbnailer.stop()
+        
+        ConfigurableSite.stopFactory(self)
     
+    def thumbnailSource(self, name, request):
+        """
+        Return the file a thumbnail shows - one directly in the directory,
+        by name. None if there isn't one.
+        """
+        if name != os.path.basename(name) or name.startswith('.'):
+            return None
+        
+        path = os.path.join(self.directory, name)
+        
+        if not os.path.isfile(path):
+            return None
+        
+        return path
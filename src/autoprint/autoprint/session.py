@@ -5,15 +5,58 @@ from zope.interface import Interface, Attribute, implements
 from twisted.python.components import registerAdapter
 from twisted.web.server import Session
 
+from .history import PrintRecord
+
 class IPrintedFiles(Interface):
     """
     Mapping of all files printed with a unique id for secure-ish retrieval
     """
     
-class PrintedFiles(dict):
+class PrintedFiles(object):
+    """
+    A session's view of the print service's :class:`autoprint.history.PrintHistory`
+    - records are looked up by uid, and only the session's own are visible.
+    """
     implements(IPrintedFiles)
     
-    def __init__(self, session, *args, **kwargs):
-        dict.__init__(self, *args, **kwargs)
+    def __init__(self, session):
+        self.session = session.uid
+        self.history = session.site.printHistory
+        
+        # the session's records go when it does
+        session.notifyOnExpire(lambda: self.history.forget(self.session))
+    
+    def __contains__(self, uid):
+        return self.get(uid) is not None
+    
+    def __getitem__(self, uid):
+        record = self.get(uid)
+        
+        if record is None:
+            raise KeyError(uid)
+        
+        return record
+    
+    def __len__(self):
+        return self.history.count(self.session)
+    
+    def get(self, uid, default=None):
+        record = self.history.get(self.session, uid)
+        
+        return default if record is None else record
+    
+    def add(self, filename, ip, renderer, cached, size, data, job_id=None):
+        """
+        Record a rendered file, returns its uid.
+        """
+        return self.history.add(PrintRecord(
+            self.session, filename, ip, renderer.name, renderer.title, cached, size, data, job_id,
+        ))
+    
+    def page(self, offset=0, limit=None):
+        """
+        The session's records, newest first.
+        """
+        return self.history.page(self.session, offset, limit)
     
 registerAdapter(PrintedFiles, Session, IPrintedFiles)
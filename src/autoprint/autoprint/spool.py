@@ -0,0 +1,197 @@
+"""
+Spool - the directory rendered files are written to.
+
+The spool hands out output paths in its directory (closing the descriptor
+:func:`tempfile.mkstemp` opens), and a sweeper keeps it within its quotas:
+files nothing refers to any more are deleted once they're older than
+:attr:`Spool.max_age`, and the oldest of them go early if the spool is over
+:attr:`Spool.max_bytes`.
+
+Only files the spool created (named ``spool-*``) are ever touched, so the
+directory can be shared - e.g. with the print job database.
+
+The directory is the same from one run to the next, so files left behind by
+an earlier run are swept like any others.
+"""
+import os, time, tempfile, getpass
+
+PREFIX = 'spool-'
+
+def default_directory():
+    """
+    Return the spool directory used when none is configured - one per user
+    in the system's temporary directory.
+    """
+    return os.path.join(tempfile.gettempdir(), 'autoprint-%s' % getpass.getuser())
+
+# files younger than this are never swept - they may still be being written
+GRACE = 600
+
+class Spool(object):
+    """
+    A directory of rendered files, with size and age quotas.
+    """
+
+    def __init__(self, directory=None, max_bytes=1024*1024*1024, max_age=60*60):
+        """
+        :param directory: where to write files - created if it doesn't
+                          exist, :func:`default_directory` if None
+        :param max_bytes: sweep unreferenced files, oldest first, while the
+                          spool is bigger than this
+        :param max_age: sweep unreferenced files older than this (seconds)
+        """
+        if directory is None:
+            directory = default_directory()
+
+        if not os.path.isdir(directory):
+            # only this user can read what's printed
+            os.makedirs(directory, 0700)
+
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+
+        # as of the last sweep
+        self.files = 0
+        self.bytes = 0
+        self.referenced_bytes = 0
+        self.swept = 0
+        self.swept_bytes = 0
+        self.sweeps = 0
+        self.last_sweep = None
+
+    def path(self, suffix='.pdf'):
+        """
+        Create an empty file in the spool, returns its path.
+        """
+        handle, path = tempfile.mkstemp(suffix=suffix, prefix=PREFIX, dir=self.directory)
+        os.close(handle)
+
+        return path
+
+    def store(self, data, name):
+        """
+        Write data to a file in the spool, named by name (e.g. a hash of
+        the data) unless it's already there, returns its path. Touches the
+        disk - run it in a thread.
+        """
+        path = os.path.join(self.directory, PREFIX + name)
+
+        if os.path.exists(path):
+            return path
+
+        # written under another name, then moved into place, so nothing
+        # ever sees it half-written
+        handle, written = tempfile.mkstemp(prefix='.' + PREFIX, dir=self.directory)
+
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+
+            os.rename(written, path)
+        except Exception:
+            os.remove(written)
+            raise
+
+        return path
+
+    def owns(self, path):
+        """
+        Return True if the file was created by the spool.
+        """
+        return os.path.dirname(os.path.abspath(path)) == self.directory and os.path.basename(path).startswith(PREFIX)
+
+    def listing(self):
+        """
+        Return a list of (modified time, size, path) of the spool's files.
+        """
+        files = []
+
+        for name in os.listdir(self.directory):
+            if not name.startswith(PREFIX):
+                continue
+
+            path = os.path.join(self.directory, name)
+
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # deleted since it was listed
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        return files
+
+    def sweep(self, referenced=frozenset(), now=None):
+        """
+        Delete the files that have outlived the quotas, except those in
+        referenced. Touches the disk - run it in a thread. Returns the
+        number of files deleted.
+        """
+        now = now or time.time()
+
+        files = sorted(self.listing())
+
+        total = sum(size for modified, size, path in files)
+        held = sum(size for modified, size, path in files if path in referenced)
+
+        removed = 0
+        removed_bytes = 0
+
+        for modified, size, path in files:
+            if path in referenced or now - modified < GRACE:
+                continue
+
+            if now - modified < self.max_age and total <= self.max_bytes:
+                continue
+
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+
+            total -= size
+            removed += 1
+            removed_bytes += size
+
+        self.files = len(files) - removed
+        self.bytes = total
+        self.referenced_bytes = held
+        self.swept += removed
+        self.swept_bytes += removed_bytes
+        self.sweeps += 1
+        self.last_sweep = now
+
+        return removed
+
+    def usage(self):
+        """
+        Return a tuple of the free space and the size of the file system
+        the spool is on, in bytes.
+        """
+        stat = os.statvfs(self.directory)
+
+        return stat.f_bavail*stat.f_frsize, stat.f_blocks*stat.f_frsize
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting -
+        the spool's contents are as of the last sweep.
+        """
+        free, size = self.usage()
+
+        return {
+            'directory': self.directory,
+            'files': self.files,
+            'bytes': self.bytes,
+            'referenced_bytes': self.referenced_bytes,
+            'max_bytes': self.max_bytes,
+            'max_age': self.max_age,
+            'over_quota': self.bytes > self.max_bytes,
+            'swept': self.swept,
+            'swept_bytes': self.swept_bytes,
+            'sweeps': self.sweeps,
+            'filesystem_free_bytes': free,
+            'filesystem_size_bytes': size,
+        }
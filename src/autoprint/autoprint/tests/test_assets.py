@@ -0,0 +1,42 @@
+"""
+Test the renderer image assets
+"""
+
+from unittest import TestCase
+
+class TestAssetManager(TestCase):
+    """
+    Icons should be loaded once, at print resolution
+    """
+
+    def _manager(self, **kwargs):
+        from autoprint.renderers import image_path
+        from autoprint.renderers.assets import AssetManager
+
+        return AssetManager(image_path, **kwargs)
+
+    def test_loaded(self):
+        manager = self._manager()
+
+        self.assertTrue('cards-heart.png' in manager)
+        self.assertEqual(manager.stats()['count'], 8)
+
+    def test_downsampled(self):
+        from reportlab.lib.units import inch
+
+        manager = self._manager(size=0.4*inch, dpi=300)
+
+        self.assertEqual(manager.get('cards-heart.png').getSize(), (120, 120))
+
+    def test_shared(self):
+        manager = self._manager()
+
+        first = manager.icon('cards-heart.png', 10, 10)
+        second = manager.icon('cards-heart.png', 10, 10)
+
+        self.assertTrue(first.image is second.image)
+
+    def test_missing(self):
+        manager = self._manager()
+
+        self.assertRaises(KeyError, manager.get, 'no-such-icon.png')
@@ -0,0 +1,78 @@
+"""
+Test the benchmark suite and its corpus
+"""
+
+from unittest import TestCase
+
+class TestCorpus(TestCase):
+    """
+    The issue card corpus should cover every type and priority, and be valid
+    """
+
+    def test_latest_version(self):
+        from autoprint.benchmarks.suite import load_corpus, corpus_versions
+
+        corpus = load_corpus('issuecard')
+
+        self.assertEqual(corpus['version'], corpus_versions('issuecard')[-1])
+        self.assertEqual(load_corpus('nonexistent'), None)
+
+    def test_combinations(self):
+        from autoprint.benchmarks.suite import load_corpus
+        from autoprint.renderers.issuecard import ISSUE_TYPES, ISSUE_PRIORITIES
+
+        corpus = load_corpus('issuecard', 1)
+
+        combinations = set((item['data']['issue_type'], item['data']['priority']) for item in corpus['payloads'])
+
+        for issue_type in ISSUE_TYPES:
+            for priority in ISSUE_PRIORITIES:
+                self.assertTrue((issue_type, priority) in combinations)
+
+    def test_payloads_valid(self):
+        from autoprint.benchmarks.suite import load_corpus
+        from autoprint.renderers.issuecard import IssueCardRendererSchema
+
+        corpus = load_corpus('issuecard', 1)
+        schema = IssueCardRendererSchema()
+
+        names = set()
+
+        for item in corpus['payloads']:
+            schema.deserialize(item['data'])
+            names.add(item['name'])
+
+        self.assertEqual(len(names), len(corpus['payloads']))
+
+class TestResults(TestCase):
+    """
+    Check the statistics helpers
+    """
+
+    def test_percentile(self):
+        from autoprint.benchmarks.suite import percentile
+
+        values = range(1, 101)
+
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([], 50), None)
+
+    def test_compare(self):
+        from autoprint.benchmarks.suite import compare
+
+        def results(p50, rate):
+            return {'renderers': {'issuecard': {
+                'corpus_version': 1,
+                'latency_ms': {'p50': p50, 'p99': p50},
+                'cards_per_sec': rate,
+                'rss_kb': {'peak': 100},
+                'pdf_bytes': {'mean': 100},
+            }}}
+
+        rows = dict((row[1], row[4]) for row in compare(results(10.0, 100.0), results(5.0, 200.0)))
+
+        self.assertEqual(rows['p50 ms'], 0.5)
+        self.assertEqual(rows['cards/sec'], 1.0)
+        self.assertEqual(rows['peak RSS kB'], 0.0)
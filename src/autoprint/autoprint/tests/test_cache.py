@@ -0,0 +1,154 @@
+"""
+Test the render cache
+"""
+
+from unittest import TestCase
+import tempfile, shutil, os, datetime
+
+class TestCacheKey(TestCase):
+    """
+    Keys should only depend on the content of the request
+    """
+
+    def test_key_order_independent(self):
+        from autoprint.cache import cache_key
+
+        first = cache_key('issuecard', {'a': 1, 'b': 2}, {'font': 'Helvetica'})
+        second = cache_key('issuecard', {'b': 2, 'a': 1}, {'font': 'Helvetica'})
+
+        self.assertEqual(first, second)
+
+    def test_key_varies(self):
+        from autoprint.cache import cache_key
+
+        data = {'date': datetime.datetime(2012, 1, 1, 10, 0)}
+
+        base = cache_key('issuecard', data, {'font': 'Helvetica'})
+
+        self.assertNotEqual(base, cache_key('other', data, {'font': 'Helvetica'}))
+        self.assertNotEqual(base, cache_key('issuecard', data, {'font': 'Courier'}))
+        self.assertNotEqual(base, cache_key('issuecard', {'date': datetime.datetime(2012, 1, 2)}, {'font': 'Helvetica'}))
+
+class TestRenderCache(TestCase):
+    """
+    Check the LRU and size bounds
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _file(self, name, size=10):
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'wb') as output:
+            output.write('x'*size)
+
+        return path
+
+    def test_hit_and_miss(self):
+        from autoprint.cache import RenderCache
+
+        cache = RenderCache(max_entries=2)
+        path = self._file('one.pdf')
+
+        self.assertEqual(cache.get('one'), None)
+        cache.put('one', path)
+        self.assertEqual(cache.get('one'), path)
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_lru_eviction(self):
+        from autoprint.cache import RenderCache
+
+        cache = RenderCache(max_entries=2)
+
+        cache.put('one', self._file('one.pdf'))
+        cache.put('two', self._file('two.pdf'))
+        cache.get('one')
+        cache.put('three', self._file('three.pdf'))
+
+        self.assertTrue('one' in cache)
+        self.assertFalse('two' in cache)
+        self.assertEqual(cache.evictions, 1)
+
+        self.assertTrue(cache.holds(os.path.join(self.directory, 'one.pdf')))
+        self.assertFalse(cache.holds(os.path.join(self.directory, 'two.pdf')))
+
+    def test_size_eviction(self):
+        from autoprint.cache import RenderCache
+
+        cache = RenderCache(max_entries=10, max_bytes=25)
+
+        cache.put('one', self._file('one.pdf'))
+        cache.put('two', self._file('two.pdf'))
+        cache.put('three', self._file('three.pdf'))
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.size, 20)
+
+    def test_missing_file(self):
+        from autoprint.cache import RenderCache
+
+        cache = RenderCache()
+        path = self._file('one.pdf')
+
+        cache.put('one', path)
+        os.unlink(path)
+
+        self.assertEqual(cache.get('one'), None)
+        self.assertEqual(cache.size, 0)
+
+class TestPreviewCache(TestCase):
+    """
+    Check previews are kept by uid within the byte limit
+    """
+
+    def test_get(self):
+        import hashlib
+        from autoprint.cache import PreviewCache
+
+        cache = PreviewCache()
+        cache.put('one', 'x' * 10)
+
+        body, hashed, added = cache.get('one')
+
+        self.assertEqual(body, 'x' * 10)
+        self.assertEqual(hashed, hashlib.sha1('x' * 10).hexdigest())
+        self.assertEqual(cache.get('two'), None)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_size_eviction(self):
+        from autoprint.cache import PreviewCache
+
+        cache = PreviewCache(max_bytes=25)
+
+        cache.put('one', 'x' * 10)
+        cache.put('two', 'x' * 10)
+        cache.get('one')
+        cache.put('three', 'x' * 10)
+
+        # the least recently used goes
+        self.assertTrue('one' in cache)
+        self.assertFalse('two' in cache)
+        self.assertEqual(cache.size, 20)
+
+        cache.put('four', 'x' * 30)
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+    def test_discard(self):
+        from autoprint.cache import PreviewCache
+
+        cache = PreviewCache()
+        cache.put('one', 'x' * 10)
+        cache.discard('one')
+        cache.discard('two')
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
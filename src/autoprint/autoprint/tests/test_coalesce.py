@@ -0,0 +1,97 @@
+"""
+Test coalescing print jobs
+"""
+
+from unittest import TestCase
+
+class TestBatches(TestCase):
+    """
+    Check how queued jobs are grouped
+    """
+
+    def _job(self, job_id, renderer='issuecard', created=100, attempts=0):
+        return {'id': job_id, 'renderer': renderer, 'created': created, 'attempts': attempts}
+
+    def test_grouped_by_renderer(self):
+        from autoprint.coalesce import batches
+
+        jobs = [self._job(1), self._job(2, 'other'), self._job(3)]
+
+        ready, held = batches(jobs, 200, window=1, size=10)
+
+        self.assertEqual([[job['id'] for job in batch] for batch in ready], [[1, 3], [2]])
+        self.assertFalse(held)
+
+    def test_held_in_window(self):
+        from autoprint.coalesce import batches
+
+        ready, held = batches([self._job(1), self._job(2)], 100.5, window=1, size=10)
+
+        self.assertEqual(ready, [])
+        self.assertTrue(held)
+
+    def test_full_batch_not_held(self):
+        from autoprint.coalesce import batches
+
+        jobs = [self._job(x) for x in range(5)]
+
+        ready, held = batches(jobs, 100, window=1, size=2)
+
+        self.assertEqual([[job['id'] for job in batch] for batch in ready], [[0, 1], [2, 3]])
+        self.assertTrue(held)
+
+    def test_retry_not_held(self):
+        from autoprint.coalesce import batches
+
+        ready, held = batches([self._job(1, attempts=1)], 100, window=1, size=10)
+
+        self.assertEqual(len(ready), 1)
+
+    def test_split_by_priority(self):
+        from autoprint.coalesce import batches
+        from autoprint import priority
+
+        jobs = [self._job(1), self._job(2), self._job(3)]
+        jobs[1]['priority'] = priority.URGENT
+
+        ready, held = batches(jobs, 100, window=1, size=10)
+
+        # the urgent card isn't held for the window
+        self.assertEqual([[job['id'] for job in batch] for batch in ready], [[2]])
+        self.assertTrue(held)
+
+    def test_title(self):
+        from autoprint.coalesce import batch_title
+
+        self.assertEqual(batch_title(['AP-1']), 'AP-1')
+        self.assertEqual(batch_title(['AP-1', 'AP-2', 'AP-3']), 'AP-1 (+2 more)')
+
+class TestMerge(TestCase):
+    """
+    Merge rendered cards into one document
+    """
+
+    def test_merge(self):
+        from autoprint.coalesce import PdfFileMerger, merge_pdfs
+        from autoprint.renderers.issuecard import IssueCardRenderer
+        from autoprint.benchmarks import sample_payload
+        import os
+
+        if PdfFileMerger is None:
+            return
+
+        renderer = IssueCardRenderer()
+        data = renderer.schema.deserialize(sample_payload())
+
+        files = [renderer(data), renderer.batch([data, data])]
+
+        try:
+            from PyPDF2 import PdfFileReader
+            from StringIO import StringIO
+
+            merged = merge_pdfs(files)
+
+            self.assertEqual(PdfFileReader(StringIO(merged)).getNumPages(), 3)
+        finally:
+            for filename in files:
+                os.remove(filename)
@@ -0,0 +1,153 @@
+"""
+Test the CUPS connection pool
+"""
+
+from unittest import TestCase
+
+class Refused(Exception):
+    """
+    Stands in for cups.IPPError - CUPS answered, but said no
+    """
+
+class Broken(Exception):
+    """
+    Stands in for a dropped connection
+    """
+
+class TestConnectionPool(TestCase):
+    """
+    Check connections are reused, and replaced when they break - calls are
+    made in the test's thread.
+    """
+
+    def _pool(self):
+        from autoprint.cupspool import ConnectionPool
+
+        made = []
+
+        class Connection(object):
+            def __init__(self):
+                made.append(self)
+                self.broken = False
+
+            def getDefault(self):
+                if self.broken:
+                    raise Broken()
+                return 'office'
+
+            def printFile(self, printer, filename, title, options):
+                if printer is None:
+                    raise Refused()
+                if self.broken:
+                    raise Broken()
+                return 42
+
+        return ConnectionPool(Connection, size=2, keep_on=(Refused,)), made
+
+    def test_reused(self):
+        pool, made = self._pool()
+
+        self.assertEqual(pool.call('getDefault'), 'office')
+        self.assertEqual(pool.call('getDefault'), 'office')
+
+        self.assertEqual(len(made), 1)
+        self.assertEqual(pool.stats()['idle'], 1)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_callable(self):
+        pool, made = self._pool()
+
+        jobid = pool.call(lambda connection: connection.printFile('office', '/tmp/a.pdf', 'A', {}))
+
+        self.assertEqual(jobid, 42)
+
+    def test_refused_keeps_connection(self):
+        pool, made = self._pool()
+
+        self.assertRaises(Refused, pool.call, 'printFile', None, '/tmp/a.pdf', 'A', {})
+
+        stats = pool.stats()
+
+        self.assertEqual(stats['failures'], 1)
+        self.assertEqual(stats['reconnects'], 0)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_broken_retried(self):
+        pool, made = self._pool()
+
+        pool.call('getDefault')
+        made[0].broken = True
+
+        # idempotent - retried on a new connection
+        self.assertEqual(pool.call('getDefault'), 'office')
+        self.assertEqual(len(made), 2)
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        self.assertEqual(pool.stats()['connections'], 1)
+
+    def test_broken_not_retried(self):
+        pool, made = self._pool()
+
+        pool.call('getDefault')
+        made[0].broken = True
+
+        # submitting a job isn't safe to repeat
+        self.assertRaises(Broken, pool.call, 'printFile', 'office', '/tmp/a.pdf', 'A', {})
+        self.assertEqual(pool.stats()['connections'], 0)
+
+        self.assertEqual(pool.call('printFile', 'office', '/tmp/a.pdf', 'A', {}), 42)
+        self.assertEqual(len(made), 2)
+
+class Streamed(object):
+    """
+    Records what's streamed to it, like a pycups connection would send it
+    """
+
+    def __init__(self, stop_after=None):
+        self.documents = []
+        self.cancelled = []
+        self.stop_after = stop_after
+
+    def createJob(self, printer, title, options):
+        return 7
+
+    def startDocument(self, printer, job_id, name, format, last):
+        self.documents.append([name, '', last])
+        return 100
+
+    def writeRequestData(self, data, length):
+        if self.stop_after is not None and len(self.documents[-1][1]) >= self.stop_after:
+            return 500
+
+        self.documents[-1][1] += data
+        return 100
+
+    def finishDocument(self, printer):
+        return 0
+
+    def cancelJob(self, job_id):
+        self.cancelled.append(job_id)
+
+class TestStreamJob(TestCase):
+    """
+    Check documents are streamed in chunks, and a job is cancelled if CUPS
+    stops taking them
+    """
+
+    def test_stream(self):
+        from autoprint.cupspool import stream_job
+        from StringIO import StringIO
+
+        connection = Streamed()
+
+        job_id = stream_job(connection, 'office', 'Cards', [('a', 'x' * 10), ('b', StringIO('y' * 5))], chunk_size=3)
+
+        self.assertEqual(job_id, 7)
+        self.assertEqual(connection.documents, [['a', 'x' * 10, 0], ['b', 'y' * 5, 1]])
+
+    def test_refused(self):
+        from autoprint.cupspool import stream_job, StreamError
+
+        connection = Streamed(stop_after=3)
+
+        self.assertRaises(StreamError, stream_job, connection, 'office', 'Cards', [('a', 'x' * 10)], chunk_size=3)
+        self.assertEqual(connection.cancelled, [7])
@@ -0,0 +1,114 @@
+"""
+Test the metrics exposition
+"""
+
+from unittest import TestCase
+
+class TestMetricsWriter(TestCase):
+    """
+    Check the text format
+    """
+
+    def test_gauge(self):
+        from autoprint.exposition import MetricsWriter
+
+        writer = MetricsWriter()
+        writer.gauge('sessions', "Active sessions.", 3)
+
+        self.assertEqual(writer.text(), '# HELP autoprint_sessions Active sessions.\n# TYPE autoprint_sessions gauge\nautoprint_sessions 3\n')
+
+    def test_labels_escaped(self):
+        from autoprint.exposition import MetricsWriter
+
+        writer = MetricsWriter()
+        writer.counter('jobs_total', "Jobs.", [({'outcome': 'failed', 'printer': 'a "b"'}, 2)])
+
+        self.assertTrue('autoprint_jobs_total{outcome="failed",printer="a \\"b\\""} 2\n' in writer.text())
+
+    def test_histogram(self):
+        from autoprint.exposition import MetricsWriter
+        from autoprint.timing import Histogram
+
+        histogram = Histogram(buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+
+        writer = MetricsWriter()
+        writer.histogram('render_seconds', "Renders.", [({'renderer': 'issuecard'}, histogram)])
+
+        lines = writer.text().splitlines()
+
+        self.assertTrue('autoprint_render_seconds_bucket{le="0.1",renderer="issuecard"} 1' in lines)
+        self.assertTrue('autoprint_render_seconds_bucket{le="1.0",renderer="issuecard"} 2' in lines)
+        self.assertTrue('autoprint_render_seconds_bucket{le="+Inf",renderer="issuecard"} 3' in lines)
+        self.assertTrue('autoprint_render_seconds_count{renderer="issuecard"} 3' in lines)
+
+class TestServiceMetrics(TestCase):
+    """
+    Check the metrics are built from the service's own counters
+    """
+
+    def _factory(self):
+        from collections import Counter
+        from autoprint.timing import Timings, RequestStats
+        from autoprint.cache import RenderCache, PreviewCache
+        from autoprint.workers import RenderExecutor
+        from autoprint.printerstate import PrinterStateCache
+        from autoprint.printers import PrinterPool
+        from autoprint.jobtracker import JobTracker
+        from autoprint.cupspool import ConnectionPool
+        from autoprint.jobqueue import PrintDispatcher
+        from autoprint.history import PrintHistory, PrintRecord
+        from autoprint.spool import Spool
+        from autoprint.thumbnails import Thumbnailer, ThumbnailCache
+        import tempfile
+
+        class Factory(object):
+            settings = {'working_directory': None}
+
+            timings = Timings()
+            requestStats = RequestStats()
+            renderCache = RenderCache()
+            previews = PreviewCache()
+            renderExecutor = RenderExecutor({})
+            printJobs = Counter(submitted=2, failed=1)
+            printerState = PrinterStateCache(None)
+            printers = PrinterPool(printerState)
+            cups = ConnectionPool(None)
+            dispatcher = PrintDispatcher(None, None)
+            jobTracker = JobTracker(None)
+            printHistory = PrintHistory()
+            spool = Spool()
+            thumbnailer = Thumbnailer(ThumbnailCache(tempfile.mkdtemp()), None)
+
+            sessions = {'one': None, 'two': None}
+
+        factory = Factory()
+        factory.printHistory.add(PrintRecord('one', '/tmp/a.pdf', '127.0.0.1', 'issuecard', 'Card', False, 100, [{}]))
+        factory.printHistory.add(PrintRecord('one', '/tmp/a.pdf', '127.0.0.1', 'issuecard', 'Card', True, 100, [{}]))
+        factory.printHistory.add(PrintRecord('two', '/tmp/c.pdf', '127.0.0.1', 'issuecard', 'Card', False, 50, [{}]))
+        factory.requestStats.observe('/renderers/{renderer}', 'PUT', 200, 0.2)
+        factory.timings.observe('issuecard', 'cups', 0.05)
+        factory.printerState.printers = {'office': {'printer-state': 3}}
+        factory.printers.submitted('office')
+
+        return factory
+
+    def test_metrics(self):
+        from autoprint.resources.metrics import service_metrics
+
+        lines = service_metrics(self._factory()).splitlines()
+
+        self.assertTrue('autoprint_http_requests_total{code="200",method="PUT",route="/renderers/{renderer}"} 1' in lines)
+        self.assertTrue('autoprint_phase_duration_seconds_count{phase="cups",renderer="issuecard"} 1' in lines)
+        self.assertTrue('autoprint_print_jobs_total{outcome="failed"} 1' in lines)
+        self.assertTrue('autoprint_sessions 2' in lines)
+        self.assertTrue('autoprint_printer_status_stale 1' in lines)
+        self.assertTrue('autoprint_printer_jobs_total{printer="office"} 1' in lines)
+        self.assertTrue('autoprint_history_entries 3' in lines)
+        self.assertTrue('autoprint_history_files 2' in lines)
+        self.assertTrue('autoprint_history_bytes 150' in lines)
+        self.assertTrue('autoprint_spool_files 0' in lines)
+        self.assertTrue('autoprint_spool_swept_files_total 0' in lines)
+        self.assertTrue('autoprint_thumbnails_made_total 0' in lines)
@@ -0,0 +1,86 @@
+"""
+Test fitting text into a box
+"""
+
+from unittest import TestCase
+
+class TestTextFitter(TestCase):
+    """
+    Check that text is fitted at the largest size, truncated if needed
+    """
+
+    def _fitter(self):
+        from reportlab.lib.styles import getSampleStyleSheet
+        from autoprint.renderers.fitting import TextFitter
+
+        style = getSampleStyleSheet()['BodyText']
+        style.fontSize = 12
+
+        return TextFitter(style)
+
+    def test_short_text_full_size(self):
+        fitter = self._fitter()
+
+        paragraph = fitter.fit(u"Fix the thing", 300, 60)
+
+        self.assertEqual(paragraph.style.fontSize, 12)
+        self.assertFalse(paragraph.text.endswith(u'...'))
+
+    def test_shrinks_before_truncating(self):
+        fitter = self._fitter()
+
+        text = u"word " * 60
+        paragraph = fitter.fit(text, 300, 60)
+
+        self.assertTrue(6 <= paragraph.style.fontSize < 12)
+        self.assertFalse(paragraph.text.endswith(u'...'))
+        self.assertTrue(paragraph.wrap(300, 60)[1] <= 60)
+
+    def test_huge_text_truncated(self):
+        fitter = self._fitter()
+
+        paragraph = fitter.fit(u"lorem ipsum dolor " * 20000, 300, 60)
+
+        self.assertEqual(paragraph.style.fontSize, 6)
+        self.assertTrue(paragraph.text.endswith(u'...'))
+        self.assertTrue(paragraph.wrap(300, 60)[1] <= 60)
+
+    def test_unbroken_text(self):
+        fitter = self._fitter()
+
+        paragraph = fitter.fit(u"x" * 5000, 300, 60)
+
+        self.assertTrue(paragraph.wrap(300, 60)[1] <= 60)
+
+    def test_wraps_cached(self):
+        fitter = self._fitter()
+
+        fitter.fit(u"word " * 60, 300, 60)
+        wraps = fitter.wraps
+
+        fitter.fit(u"word " * 60, 300, 60)
+
+        self.assertEqual(fitter.wraps, wraps)
+        self.assertTrue(fitter.stats()['hits'] > 0)
+
+    def test_few_wraps(self):
+        fitter = self._fitter()
+
+        paragraph = fitter.fit(u"Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 6, 300, 60)
+        wraps = fitter.wraps
+
+        self.assertTrue(6 <= paragraph.style.fontSize < 12)
+        self.assertTrue(wraps <= 3)
+
+        # laying it out at the width it was fitted at keeps its lines
+        paragraph.blPara = None
+        self.assertTrue(paragraph.wrap(300, 60)[1] <= 60)
+        self.assertEqual(paragraph.blPara, None)
+
+    def test_iter_words(self):
+        from autoprint.renderers.fitting import iter_words
+
+        words = iter_words(u"  one two\nthree ")
+
+        self.assertEqual(next(words), u"one")
+        self.assertEqual(list(words), [u"two", u"three"])
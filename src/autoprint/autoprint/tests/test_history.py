@@ -0,0 +1,157 @@
+"""
+Test the print history store
+"""
+
+from unittest import TestCase
+
+class TestPrintHistory(TestCase):
+    """
+    Check the limits and eviction
+    """
+
+    def _history(self, **options):
+        from autoprint.history import PrintHistory
+
+        history = PrintHistory(**options)
+        evicted = []
+        history.onEvict(evicted.append)
+
+        return history, evicted
+
+    def _record(self, session='one', filename='/tmp/a.pdf', size=100, printed=None):
+        from autoprint.history import PrintRecord
+
+        return PrintRecord(session, filename, '127.0.0.1', 'issuecard', 'Card', False, size, [{}], printed=printed)
+
+    def test_per_session(self):
+        history, evicted = self._history(per_session=2)
+
+        first = history.add(self._record(filename='/tmp/1.pdf'))
+        history.add(self._record(filename='/tmp/2.pdf'))
+        history.add(self._record(session='two', filename='/tmp/3.pdf'))
+        history.add(self._record(filename='/tmp/4.pdf'))
+
+        self.assertEqual([record.uid for record in evicted], [first])
+        self.assertEqual(history.count('one'), 2)
+        self.assertEqual(history.count('two'), 1)
+        self.assertEqual(history.stats()['evictions'], {'session': 1})
+
+    def test_global(self):
+        history, evicted = self._history(max_entries=2)
+
+        for session in ('one', 'two', 'three'):
+            history.add(self._record(session=session))
+
+        self.assertEqual(len(history), 2)
+        self.assertEqual(evicted[0].session, 'one')
+
+    def test_ttl(self):
+        import time
+
+        history, evicted = self._history(ttl=60)
+
+        old = history.add(self._record(printed=time.time() - 61))
+        new = history.add(self._record())
+
+        self.assertEqual([record.uid for record in evicted], [old])
+        self.assertEqual(history.get('one', old), None)
+        self.assertEqual(history.get('one', new).uid, new)
+
+    def test_sessions_isolated(self):
+        history, evicted = self._history()
+
+        uid = history.add(self._record())
+
+        self.assertEqual(history.get('two', uid), None)
+
+    def test_forget(self):
+        history, evicted = self._history()
+
+        history.add(self._record())
+        history.add(self._record())
+        history.add(self._record(session='two'))
+
+        history.forget('one')
+
+        self.assertEqual(len(evicted), 2)
+        self.assertEqual(len(history), 1)
+
+    def test_file_references(self):
+        history, evicted = self._history()
+
+        first = history.add(self._record())
+        history.add(self._record())
+
+        # the same (cached) file is only counted once
+        self.assertEqual(history.stats()['bytes'], 100)
+        self.assertEqual(history.references('/tmp/a.pdf'), 2)
+
+        history.forget('one')
+
+        self.assertEqual(history.references('/tmp/a.pdf'), 0)
+        self.assertEqual(history.stats()['bytes'], 0)
+
+    def test_in_memory(self):
+        history, evicted = self._history()
+
+        history.add(self._record(filename=None))
+
+        # previews rendered into memory have no file
+        self.assertEqual(history.filenames(), frozenset())
+        self.assertEqual(history.stats()['bytes'], 0)
+
+        history.forget('one')
+
+        self.assertEqual(len(evicted), 1)
+
+    def test_page(self):
+        history, evicted = self._history()
+
+        uids = [history.add(self._record(filename='/tmp/%s.pdf' % x)) for x in range(5)]
+
+        self.assertEqual([record.uid for record in history.page('one', 0, 2)], uids[:-3:-1])
+        self.assertEqual([record.uid for record in history.page('one', 4, 2)], uids[:1])
+        self.assertEqual(history.page('two'), [])
+
+    def test_json(self):
+        record = self._record()
+
+        info = record.__json__
+
+        self.assertEqual(info['renderer'], {'id': 'issuecard', 'title': 'Card'})
+        self.assertEqual(info['count'], 1)
+        self.assertFalse('filename' in info)
+
+class TestPrintedFiles(TestCase):
+    """
+    Check the per-session view
+    """
+
+    def test_session_view(self):
+        from twisted.web.server import Session
+        from autoprint.session import IPrintedFiles
+        from autoprint.history import PrintHistory
+
+        class Site(object):
+            printHistory = PrintHistory()
+            sessions = {}
+
+        class Renderer(object):
+            name = 'issuecard'
+            title = 'Card'
+
+        site = Site()
+        session = site.sessions['abc'] = Session(site, 'abc')
+        info = IPrintedFiles(session)
+
+        uid = info.add('/tmp/a.pdf', '127.0.0.1', Renderer(), False, 100, [{}])
+
+        self.assertTrue(uid in info)
+        self.assertEqual(info[uid].filename, '/tmp/a.pdf')
+        self.assertEqual(len(info), 1)
+
+        # expiring the session drops its history
+        session.expire()
+
+        self.assertFalse(uid in info)
+        self.assertEqual(len(Site.printHistory), 0)
@@ -0,0 +1,52 @@
+"""
+Test the imposition grid
+"""
+
+from unittest import TestCase
+
+class TestImposition(TestCase):
+    """
+    Check the grid math for index cards on common sheets
+    """
+
+    def _imposition(self, **kwargs):
+        from autoprint.renderers.imposition import Imposition
+        from reportlab.lib.units import inch
+
+        return Imposition((5*inch, 3*inch), **kwargs)
+
+    def test_landscape_chosen(self):
+        from reportlab.lib.pagesizes import letter
+
+        sheet = self._imposition()
+
+        # four 5x3 cards fit on a landscape letter sheet, only three portrait
+        self.assertEqual(sheet.per_sheet, 4)
+        self.assertEqual(sheet.sheet_size, (letter[1], letter[0]))
+
+    def test_slots_inside_sheet(self):
+        from reportlab.lib.units import inch
+
+        sheet = self._imposition()
+        width, height = sheet.sheet_size
+
+        self.assertEqual(len(sheet.slots), sheet.per_sheet)
+
+        for x, y in sheet.slots:
+            self.assertTrue(x >= sheet.margin and x+5*inch <= width-sheet.margin)
+            self.assertTrue(y >= sheet.margin and y+3*inch <= height-sheet.margin)
+
+    def test_reading_order(self):
+        sheet = self._imposition()
+        slots = sheet.slots
+
+        # first slot is top left, second is to its right
+        self.assertEqual(slots[0][1], slots[1][1])
+        self.assertTrue(slots[0][0] < slots[1][0])
+        self.assertTrue(slots[0][1] > slots[-1][1])
+
+    def test_too_big(self):
+        from reportlab.lib.units import inch
+        from autoprint.renderers.imposition import Imposition
+
+        self.assertRaises(ValueError, Imposition, (20*inch, 20*inch))
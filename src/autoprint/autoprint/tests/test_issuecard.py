@@ -0,0 +1,121 @@
+"""
+Test the issue card renderer
+"""
+
+from unittest import TestCase
+import os, re
+
+class TestIssueCardRenderer(TestCase):
+    """
+    Render some cards and check the output
+    """
+
+    def _renderer(self):
+        from autoprint.renderers.issuecard import IssueCardRenderer
+
+        return IssueCardRenderer()
+
+    def _data(self, renderer, **overrides):
+        payload = {
+            'summary': u'As a user, I want to print cards',
+            'detail': u'Cards should print quickly. '*20,
+            'issue_id': u'AP-1',
+            'reporter': u'Reporter',
+            'date': u'2012-06-01T10:00:00',
+            'priority': u'Major',
+            'issue_type': u'Story',
+        }
+        payload.update(overrides)
+
+        return renderer.schema.deserialize(payload)
+
+    def _pages(self, filename):
+        with open(filename, 'rb') as pdf:
+            return len(re.findall(r'/Type /Page\b', pdf.read()))
+
+    def test_single(self):
+        renderer = self._renderer()
+
+        filename = renderer(self._data(renderer))
+
+        try:
+            self.assertEqual(self._pages(filename), 1)
+        finally:
+            os.unlink(filename)
+
+    def test_batch(self):
+        renderer = self._renderer()
+
+        items = [self._data(renderer, issue_id=u'AP-%s' % x) for x in range(3)]
+
+        filename = renderer.batch(items)
+
+        try:
+            self.assertEqual(self._pages(filename), 3)
+        finally:
+            os.unlink(filename)
+
+    def test_buffer(self):
+        from StringIO import StringIO
+
+        renderer = self._renderer()
+
+        output = StringIO()
+
+        self.assertTrue(renderer(self._data(renderer), output) is output)
+        self.assertEqual(len(re.findall(r'/Type /Page\b', output.getvalue())), 1)
+
+    def test_imposed_batch(self):
+        renderer = self._renderer()
+
+        items = [self._data(renderer, issue_id=u'AP-%s' % x) for x in range(9)]
+
+        filename = renderer.batch(items, {'sheet_size': 'letter'})
+
+        try:
+            # four cards per landscape letter sheet
+            self.assertEqual(self._pages(filename), 3)
+        finally:
+            os.unlink(filename)
+
+    def test_background_shared(self):
+        renderer = self._renderer()
+
+        items = [self._data(renderer, issue_id=u'AP-%s' % x) for x in range(3)]
+
+        filename = renderer.batch(items)
+
+        try:
+            with open(filename, 'rb') as pdf:
+                forms = re.findall(r'/Subtype /Form\b', pdf.read())
+
+            # the static background is stored once, not once per card
+            self.assertEqual(len(forms), 1)
+        finally:
+            os.unlink(filename)
+
+    def test_encoded(self):
+        from autoprint.renderers.issuecard import IssueCardRenderer
+        import json
+
+        renderer = self._renderer()
+
+        body, etag = renderer.encoded()
+
+        self.assertTrue(renderer.encoded()[0] is body)
+        self.assertEqual(json.loads(body)['schema']['type'], 'object')
+
+        other = IssueCardRenderer(margin=renderer.settings['margin'] * 2)
+
+        # settings belong to the instance, not the class defaults
+        self.assertEqual(IssueCardRenderer.settings['margin'], renderer.settings['margin'])
+        self.assertNotEqual(other.encoded()[1], etag)
+
+    def test_priority(self):
+        from autoprint import priority
+
+        renderer = self._renderer()
+
+        self.assertEqual(renderer.priority(self._data(renderer, priority=u'Blocker')), priority.URGENT)
+        self.assertEqual(renderer.priority(self._data(renderer)), priority.NORMAL)
+        self.assertEqual(renderer.priority(self._data(renderer, priority=u'Trivial')), priority.LOW)
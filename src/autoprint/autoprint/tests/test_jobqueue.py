@@ -0,0 +1,386 @@
+"""
+Test the durable print job queue
+"""
+
+from unittest import TestCase
+
+class TestInteractions(TestCase):
+    """
+    Run the queue's transactions against an in-memory database
+    """
+
+    def setUp(self):
+        import sqlite3
+        from autoprint.jobqueue import _setup
+
+        self.connection = sqlite3.connect(':memory:')
+        self.txn = self.connection.cursor()
+
+        _setup(self.txn)
+
+    def test_claim_in_order(self):
+        from autoprint.jobqueue import _enqueue, _claim, _get
+
+        first = _enqueue(self.txn, '/tmp/a.pdf', 'A', 'issuecard', 100)
+        second = _enqueue(self.txn, '/tmp/b.pdf', 'B', 'issuecard', 101)
+
+        batches = _claim(self.txn, 1, 200)
+
+        self.assertEqual([[job['id'] for job in batch] for batch in batches], [[first]])
+        self.assertEqual(batches[0][0]['attempts'], 1)
+        self.assertEqual(_get(self.txn, first)['state'], 'submitting')
+
+        self.assertEqual([[job['id'] for job in batch] for batch in _claim(self.txn, 5, 200)], [[second]])
+        self.assertEqual(_claim(self.txn, 5, 200), [])
+
+    def test_claim_missing(self):
+        import tempfile
+        from autoprint.jobqueue import _enqueue, _claim
+
+        with tempfile.NamedTemporaryFile(suffix='.pdf') as present:
+            _enqueue(self.txn, present.name, 'A', 'issuecard', 100)
+            _enqueue(self.txn, '/nonexistent.pdf', 'B', 'issuecard', 101)
+
+            batches = _claim(self.txn, 5, 200)
+
+        self.assertEqual([batch[0]['missing'] for batch in batches], [False, True])
+
+    def test_claim_coalesced(self):
+        from autoprint.jobqueue import _enqueue, _claim, _submitted, _get
+
+        ids = [_enqueue(self.txn, '/tmp/%s.pdf' % x, 'Card', 'issuecard', 100) for x in range(5)]
+
+        # still inside the window, and the batch isn't full
+        self.assertEqual(_claim(self.txn, 1, 100.5, window=1, size=10), [])
+
+        batches = _claim(self.txn, 1, 101, window=1, size=10)
+
+        self.assertEqual([job['id'] for job in batches[0]], ids)
+
+        _submitted(self.txn, ids, 42, 102)
+
+        self.assertEqual(_get(self.txn, ids[-1])['cups_job_id'], 42)
+        self.assertEqual(_get(self.txn, ids[-1])['state'], 'submitted')
+
+    def test_claim_by_priority(self):
+        from autoprint.jobqueue import _enqueue, _claim, _position
+        from autoprint import priority
+
+        bulk = _enqueue(self.txn, '/tmp/bulk.pdf', 'Batch', 'issuecard', 100, priority.BULK)
+        low = _enqueue(self.txn, '/tmp/low.pdf', 'Card', 'issuecard', 100, priority.LOW)
+        urgent = _enqueue(self.txn, '/tmp/urgent.pdf', 'Card', 'issuecard', 110, priority.URGENT)
+
+        self.assertEqual(_position(self.txn, urgent, 60), 0)
+        self.assertEqual(_position(self.txn, bulk, 60), 2)
+
+        # with fast aging, the older cards go ahead of the urgent one
+        self.assertEqual(_position(self.txn, bulk, 1), 1)
+        self.assertEqual(_position(self.txn, urgent, 1), 2)
+
+        batches = _claim(self.txn, 3, 200, aging=60)
+
+        self.assertEqual([batch[0]['id'] for batch in batches], [urgent, low, bulk])
+        self.assertEqual(_position(self.txn, bulk, 60), None)
+
+    def test_get_many(self):
+        from autoprint.jobqueue import _enqueue, _claim, _get_many
+
+        first = _enqueue(self.txn, '/tmp/one.pdf', 'Card', 'issuecard', 100)
+        second = _enqueue(self.txn, '/tmp/two.pdf', 'Card', 'issuecard', 101)
+
+        _claim(self.txn, 1, 200)
+
+        jobs = _get_many(self.txn, [first, second, 99])
+
+        self.assertEqual(sorted(jobs), [first, second])
+        self.assertEqual(jobs[first]['state'], 'submitting')
+        self.assertEqual(jobs[first]['queue_position'], None)
+        self.assertEqual(jobs[second]['queue_position'], 0)
+
+        third = _enqueue(self.txn, '/tmp/three.pdf', 'Card', 'issuecard', 102)
+
+        self.assertEqual(_get_many(self.txn, [third, second])[third]['queue_position'], 1)
+
+    def test_migrate_priority(self):
+        from autoprint.jobqueue import _setup, _get
+        from autoprint import priority
+        import sqlite3
+
+        connection = sqlite3.connect(':memory:')
+        txn = connection.cursor()
+
+        txn.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT NOT NULL, title TEXT NOT NULL, renderer TEXT, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL, created REAL NOT NULL, updated REAL NOT NULL, cups_job_id INTEGER, error TEXT)")
+        txn.execute("INSERT INTO jobs (filename, title, state, next_attempt, created, updated) VALUES ('/tmp/old.pdf', 'Old', 'queued', 0, 0, 0)")
+
+        _setup(txn)
+
+        self.assertEqual(_get(txn, 1)['priority'], priority.NORMAL)
+
+    def test_retry_waits(self):
+        from autoprint.jobqueue import _enqueue, _claim, _update
+
+        job_id = _enqueue(self.txn, '/tmp/a.pdf', 'A', None, 100)
+        _claim(self.txn, 1, 100)
+
+        _update(self.txn, job_id, 100, state='queued', next_attempt=110, error='printer offline')
+
+        self.assertEqual(_claim(self.txn, 1, 105), [])
+
+        job = _claim(self.txn, 1, 110)[0][0]
+
+        self.assertEqual(job['attempts'], 2)
+        self.assertEqual(job['error'], 'printer offline')
+
+    def test_recover(self):
+        from autoprint.jobqueue import _enqueue, _claim, _recover, _counts
+
+        _enqueue(self.txn, '/tmp/a.pdf', 'A', None, 100)
+        _enqueue(self.txn, '/tmp/b.pdf', 'B', None, 100)
+        _claim(self.txn, 1, 100)
+
+        # the service died while submitting the first job
+        self.assertEqual(_recover(self.txn, 200), 1)
+
+        counts = _counts(self.txn)
+
+        self.assertEqual(counts['queued'], 2)
+        self.assertEqual(counts['submitting'], 0)
+
+    def test_prune(self):
+        from autoprint.jobqueue import _enqueue, _claim, _submitted, _update, _prune, _counts
+
+        old = _enqueue(self.txn, '/tmp/a.pdf', 'A', None, 100)
+        recent = _enqueue(self.txn, '/tmp/b.pdf', 'B', None, 100)
+        failed = _enqueue(self.txn, '/tmp/c.pdf', 'C', None, 100)
+        _enqueue(self.txn, '/tmp/d.pdf', 'D', None, 100)
+        _claim(self.txn, 3, 100)
+
+        _submitted(self.txn, [old], 1, 100)
+        _submitted(self.txn, [recent], 2, 300)
+        _update(self.txn, failed, 100, state='failed')
+
+        self.assertEqual(_prune(self.txn, 200), {'submitted': 1, 'failed': 1})
+
+        counts = _counts(self.txn)
+
+        # jobs still to be sent are kept, however old
+        self.assertEqual(counts['submitted'], 1)
+        self.assertEqual(counts['failed'], 0)
+        self.assertEqual(counts['queued'], 1)
+
+    def test_pending_files(self):
+        from autoprint.jobqueue import _enqueue, _claim, _update, _pending_files
+
+        failed = _enqueue(self.txn, '/tmp/a.pdf', 'A', None, 100)
+        _enqueue(self.txn, '/tmp/b.pdf', 'B', None, 100)
+        _enqueue(self.txn, '/tmp/c.pdf', 'C', None, 100)
+        _claim(self.txn, 2, 100)
+
+        _update(self.txn, failed, 100, state='failed')
+
+        self.assertEqual(_pending_files(self.txn), frozenset(['/tmp/b.pdf', '/tmp/c.pdf']))
+
+class FakeQueue(object):
+    """
+    Records what the dispatcher does with jobs
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.results = {}
+
+    def claim(self, limit, window, size, aging):
+        import os
+        from twisted.internet import defer
+
+        claimed, self.jobs = self.jobs[:limit*size], self.jobs[limit*size:]
+
+        for job in claimed:
+            job['attempts'] += 1
+            job['missing'] = not os.path.exists(job['filename'])
+
+        return defer.succeed([claimed[start:start+size] for start in range(0, len(claimed), size)])
+
+    def submitted(self, job_ids, cups_job_id):
+        from twisted.internet import defer
+
+        for job_id in job_ids:
+            self.results[job_id] = ('submitted', cups_job_id)
+
+        return defer.succeed(None)
+
+    def retry(self, job_id, error, delay):
+        from twisted.internet import defer
+
+        self.results[job_id] = ('retry', delay)
+        return defer.succeed(None)
+
+    def fail(self, job_id, error):
+        from twisted.internet import defer
+
+        self.results[job_id] = ('failed', error)
+        return defer.succeed(None)
+
+class TestPrintDispatcher(TestCase):
+    """
+    Check concurrency, retries and backoff
+    """
+
+    def _job(self, job_id, attempts=0):
+        import os, tempfile
+
+        handle, filename = tempfile.mkstemp(suffix='.pdf')
+        os.close(handle)
+        self.addCleanup(os.remove, filename)
+
+        return {'id': job_id, 'filename': filename, 'title': 'Card', 'renderer': 'issuecard', 'attempts': attempts}
+
+    def test_bounded(self):
+        from twisted.internet import defer
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(x) for x in range(5)])
+        pending = []
+
+        def submit(jobs):
+            d = defer.Deferred()
+            pending.append(d)
+            return d
+
+        dispatcher = PrintDispatcher(queue, submit, concurrency=2)
+        dispatcher.wake()
+
+        self.assertEqual(dispatcher.in_flight, 2)
+        self.assertEqual(len(queue.jobs), 3)
+
+        # finishing one job frees a slot for the next
+        pending[0].callback(7)
+
+        self.assertEqual(queue.results[0], ('submitted', 7))
+        self.assertEqual(dispatcher.in_flight, 2)
+        self.assertEqual(len(queue.jobs), 2)
+
+    def test_backoff(self):
+        from twisted.internet import defer
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(1, attempts=2)])
+
+        dispatcher = PrintDispatcher(queue, lambda jobs: defer.fail(IOError("offline")), retry_delay=2, max_attempts=5)
+        dispatcher.wake()
+
+        # third attempt failed - wait 2*2**2 seconds
+        self.assertEqual(queue.results[1], ('retry', 8))
+        self.assertEqual(dispatcher.delay(20), dispatcher.max_delay)
+
+    def test_gives_up(self):
+        from twisted.internet import defer
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(1, attempts=4)])
+
+        dispatcher = PrintDispatcher(queue, lambda jobs: defer.fail(IOError("offline")), max_attempts=5)
+        dispatcher.wake()
+
+        self.assertEqual(queue.results[1], ('failed', 'offline'))
+        self.assertEqual(dispatcher.failed, 1)
+
+    def test_missing_file(self):
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([{'id': 1, 'filename': '/nonexistent.pdf', 'title': 'Card', 'renderer': None, 'attempts': 0}])
+
+        dispatcher = PrintDispatcher(queue, lambda jobs: 1)
+        dispatcher.wake()
+
+        self.assertEqual(queue.results[1][0], 'failed')
+        self.assertEqual(dispatcher.in_flight, 0)
+
+    def test_batch_shares_job(self):
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(x) for x in range(3)])
+        submitted = []
+
+        def submit(jobs):
+            submitted.append([job['id'] for job in jobs])
+            return 7
+
+        dispatcher = PrintDispatcher(queue, submit, batch_size=10)
+        dispatcher.wake()
+
+        self.assertEqual(submitted, [[0, 1, 2]])
+        self.assertEqual([queue.results[x] for x in range(3)], [('submitted', 7)]*3)
+        self.assertEqual(dispatcher.stats()['batches'], 1)
+
+    def test_finished(self):
+        from twisted.internet import defer
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(1), self._job(2, attempts=4), {'id': 3, 'filename': '/nonexistent.pdf', 'title': 'Card', 'renderer': None, 'attempts': 0}])
+        finished = []
+
+        def submit(jobs):
+            if jobs[0]['id'] == 2:
+                return defer.fail(IOError("offline"))
+
+            return 7
+
+        dispatcher = PrintDispatcher(queue, submit, concurrency=3, max_attempts=5)
+        dispatcher.onFinished(lambda job: finished.append(job['id']))
+        dispatcher.wake()
+
+        # submitted, out of attempts and missing - each released once
+        self.assertEqual(sorted(finished), [1, 2, 3])
+
+    def test_counts(self):
+        from twisted.internet import defer
+        from autoprint.jobqueue import PrintDispatcher
+
+        queue = FakeQueue([self._job(1), self._job(2, attempts=4), self._job(3)])
+
+        def submit(jobs):
+            if jobs[0]['id'] == 3:
+                return defer.fail(IOError("offline"))
+
+            return 7
+
+        dispatcher = PrintDispatcher(queue, submit, concurrency=3, max_attempts=5)
+        dispatcher.jobs['queued'] = 3
+        dispatcher.wake()
+
+        # kept up to date without asking the queue
+        self.assertEqual(dispatcher.stats()['jobs'], {'queued': 1, 'submitting': 0, 'submitted': 2, 'failed': 0})
+
+class TestJobQueue(TestCase):
+    """
+    Check the queue against a database on disk
+    """
+
+    def setUp(self):
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_reopen(self):
+        import os
+        from autoprint.jobqueue import JobQueue
+
+        queue = JobQueue(os.path.join(self.directory, 'jobs.sqlite'))
+        first = queue.dbpool
+
+        queue.close()
+        queue.close()
+
+        self.assertEqual(queue.dbpool, None)
+
+        queue.open()
+
+        self.assertFalse(queue.dbpool is first)
+
+        queue.close()
@@ -0,0 +1,139 @@
+"""
+Test the CUPS job tracker
+"""
+
+from unittest import TestCase
+
+class FakePool(object):
+    """
+    Just enough of a ConnectionPool - getJobs answers from a dictionary,
+    in id order
+    """
+
+    def __init__(self, jobs):
+        self.jobs = jobs
+        self.calls = []
+
+    def run(self, func, *args, **kwargs):
+        from twisted.internet import defer
+
+        self.calls.append((func, kwargs))
+
+        found = sorted(job_id for job_id in self.jobs if job_id >= kwargs['first_job_id'])
+
+        return defer.succeed(dict(
+            (job_id, self.jobs[job_id]) for job_id in found[:kwargs.get('limit', len(found))]
+        ))
+
+class TestJobTracker(TestCase):
+    """
+    Check polling and the job table
+    """
+
+    def _tracker(self, jobs, **options):
+        from autoprint.jobtracker import JobTracker
+
+        pool = FakePool(jobs)
+
+        return JobTracker(pool, **options), pool
+
+    def test_one_call_per_poll(self):
+        tracker, pool = self._tracker({
+            10: {'job-state': 5, 'job-state-reasons': ['job-printing'], 'job-printer-uri': 'ipp://localhost/printers/cards'},
+            11: {'job-state': 3, 'job-state-reasons': 'none'},
+            12: {'job-state': 9},
+        })
+
+        for job_id in (10, 11, 12):
+            tracker.track(job_id)
+
+        tracker.poll()
+
+        self.assertEqual(len(pool.calls), 1)
+        self.assertEqual(pool.calls[0][1]['first_job_id'], 10)
+        self.assertEqual(pool.calls[0][1]['limit'], 3)
+
+        self.assertEqual(tracker.jobs[10].state, 'processing')
+        self.assertEqual(tracker.jobs[10].printer, 'cards')
+        self.assertEqual(tracker.jobs[11].reasons, ())
+        self.assertEqual(tracker.active(), [10, 11])
+
+        # only active jobs are asked about
+        tracker.poll()
+
+        self.assertEqual(len(pool.calls), 2)
+
+    def test_stuck_job(self):
+        from autoprint.jobtracker import job_ranges
+
+        jobs = dict((job_id, {'job-state': 9}) for job_id in range(1, 1000))
+        jobs[1] = jobs[998] = {'job-state': 5}
+
+        tracker, pool = self._tracker(jobs)
+
+        for job_id in (1, 998):
+            tracker.track(job_id)
+
+        tracker.poll()
+
+        # the jobs in between aren't fetched
+        self.assertEqual([(call[1]['first_job_id'], call[1]['limit']) for call in pool.calls], [(1, 1), (998, 1)])
+        self.assertEqual(tracker.active(), [1, 998])
+
+        self.assertEqual(job_ranges([30, 1, 5, 70]), [(1, 5), (30, 30), (70, 70)])
+
+    def test_idle(self):
+        tracker, pool = self._tracker({})
+
+        tracker.poll()
+
+        self.assertEqual(pool.calls, [])
+
+    def test_purged_job(self):
+        tracker, pool = self._tracker({})
+
+        tracker.track(5)
+        tracker.poll()
+
+        self.assertEqual(tracker.jobs[5].state, 'gone')
+        self.assertEqual(tracker.active(), [])
+
+    def test_expiry(self):
+        tracker, pool = self._tracker({1: {'job-state': 9}}, retention=60)
+
+        tracker.track(1)
+        tracker.poll()
+
+        tracker.jobs[1].updated -= 61
+        tracker.poll()
+
+        self.assertFalse(1 in tracker.jobs)
+
+    def test_bounded(self):
+        tracker, pool = self._tracker({}, max_jobs=2)
+
+        for job_id in range(5):
+            tracker.track(job_id)
+
+        self.assertEqual(list(tracker.jobs), [3, 4])
+
+    def test_asdict(self):
+        tracker, pool = self._tracker({7: {'job-state': 6, 'job-state-reasons': ['printer-stopped'], 'job-media-sheets-completed': 2}})
+
+        state = tracker.get(7)
+        tracker.poll()
+
+        info = state.asdict()
+
+        self.assertEqual(info['state'], 'stopped')
+        self.assertEqual(info['reasons'], ['printer-stopped'])
+        self.assertEqual(info['sheets'], 2)
+
+class TestParseIds(TestCase):
+
+    def test_parse(self):
+        from autoprint.resources.jobs import parse_ids
+
+        self.assertEqual(parse_ids(['1,2', '3']), [1, 2, 3])
+        self.assertEqual(parse_ids(['4,']), [4])
+        self.assertRaises(ValueError, parse_ids, ['1,x'])
@@ -0,0 +1,43 @@
+"""
+Test the font metrics cache
+"""
+
+from unittest import TestCase
+
+class TestMetricsCache(TestCase):
+    """
+    Cached measurements should match ReportLab's, and stay bounded
+    """
+
+    def test_matches_reportlab(self):
+        from autoprint.renderers.util import MetricsCache
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+
+        cache = MetricsCache()
+
+        for x in range(2):
+            self.assertEqual(cache.stringWidth(u'Blocked', 'Helvetica', 12), stringWidth(u'Blocked', 'Helvetica', 12))
+
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+
+    def test_bounded(self):
+        from autoprint.renderers.util import MetricsCache
+
+        cache = MetricsCache(max_entries=10)
+
+        for x in range(25):
+            cache.stringWidth(unicode(x), 'Helvetica', 12)
+
+        self.assertTrue(cache.stats()['entries'] <= 10)
+        self.assertEqual(cache.resets, 2)
+
+    def test_disabled(self):
+        from autoprint.renderers.util import MetricsCache
+
+        cache = MetricsCache()
+        cache.enabled = False
+
+        cache.stringWidth(u'Blocked', 'Helvetica', 12)
+
+        self.assertEqual(cache.stats()['entries'], 0)
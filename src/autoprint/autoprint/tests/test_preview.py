@@ -0,0 +1,122 @@
+"""
+Test serving previews
+"""
+
+from unittest import TestCase
+import tempfile, os
+
+class TestPreviewHeaders(TestCase):
+    """
+    Check Range and Accept-Encoding parsing
+    """
+
+    def test_range(self):
+        from autoprint.resources.preview import parse_range
+
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=500-5000', 1000), (500, 999))
+
+        # ignored - multiple ranges, or not a range at all
+        self.assertEqual(parse_range('bytes=0-1,5-6', 1000), None)
+        self.assertEqual(parse_range('bytes=9-1', 1000), None)
+        self.assertEqual(parse_range('pages=1-2', 1000), None)
+
+        self.assertRaises(ValueError, parse_range, 'bytes=1000-', 1000)
+        self.assertRaises(ValueError, parse_range, 'bytes=-0', 1000)
+
+    def test_gzip(self):
+        from autoprint.resources.preview import accepts_gzip
+
+        self.assertTrue(accepts_gzip('gzip, deflate'))
+        self.assertTrue(accepts_gzip('*'))
+        self.assertFalse(accepts_gzip('gzip;q=0, deflate'))
+        self.assertFalse(accepts_gzip(None))
+
+class TestPreview(TestCase):
+    """
+    Serve a file - its hash is already known, so nothing runs in a thread
+    """
+
+    def setUp(self):
+        from autoprint.resources.preview import remember
+        from autoprint.util import file_digest
+
+        handle, self.filename = tempfile.mkstemp(suffix='.pdf')
+
+        with os.fdopen(handle, 'wb') as out:
+            out.write('0123456789' * 10)
+
+        stat = os.stat(self.filename)
+        self.etag = '"%s"' % remember((self.filename, stat.st_size, stat.st_mtime), file_digest(self.filename))
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _get(self, **headers):
+        from twisted.web.test.requesthelper import DummyRequest
+        from autoprint.resources.preview import Preview
+
+        request = DummyRequest([])
+        request.headers.update(headers)
+        request.render(Preview(self.filename))
+
+        return request
+
+    def test_full(self):
+        request = self._get()
+
+        self.assertEqual(''.join(request.written), '0123456789' * 10)
+        self.assertEqual(request.outgoingHeaders['etag'], self.etag)
+        self.assertEqual(request.outgoingHeaders['content-length'], '100')
+        self.assertEqual(request.finished, 1)
+
+    def test_range(self):
+        request = self._get(range='bytes=10-14')
+
+        self.assertEqual(request.responseCode, 206)
+        self.assertEqual(''.join(request.written), '01234')
+        self.assertEqual(request.outgoingHeaders['content-range'], 'bytes 10-14/100')
+
+    def test_stale_if_range(self):
+        request = self._get(range='bytes=10-14', **{'if-range': '"other"'})
+
+        self.assertEqual(request.responseCode, None)
+        self.assertEqual(len(''.join(request.written)), 100)
+
+    def test_weak_if_range(self):
+        for condition in ('W/' + self.etag, '*'):
+            request = self._get(range='bytes=10-14', **{'if-range': condition})
+
+            self.assertEqual(request.responseCode, None)
+            self.assertEqual(len(''.join(request.written)), 100)
+
+    def test_gzip_kept(self):
+        from autoprint.resources import preview
+
+        # compressed by an earlier GET
+        preview.keep(self.etag.strip('"'), 'gzipped')
+
+        try:
+            request = self._get(**{'accept-encoding': 'gzip'})
+
+            self.assertEqual(''.join(request.written), 'gzipped')
+            self.assertEqual(request.outgoingHeaders['content-encoding'], 'gzip')
+            self.assertEqual(request.outgoingHeaders['etag'], self.etag[:-1] + '-gzip"')
+        finally:
+            preview._gzipped.clear()
+            preview._gzipped_bytes = 0
+
+    def test_unsatisfiable(self):
+        request = self._get(range='bytes=200-')
+
+        self.assertEqual(request.responseCode, 416)
+        self.assertEqual(request.outgoingHeaders['content-range'], 'bytes */100')
+
+    def test_not_modified(self):
+        request = self._get(**{'if-none-match': '"other", %s' % self.etag})
+
+        self.assertEqual(request.responseCode, 304)
+        self.assertEqual(request.written, [])
+        self.assertEqual(request.finished, 1)
@@ -0,0 +1,150 @@
+"""
+Test the printer pool
+"""
+
+from unittest import TestCase
+
+class FakeState(object):
+    """
+    Just enough of a PrinterStateCache
+    """
+
+    def __init__(self, printers):
+        self.printers = printers
+        self.updated = 100
+
+class TestMedia(TestCase):
+    """
+    Check page size and printer state checks
+    """
+
+    def test_media_size(self):
+        from autoprint.printers import media_size
+
+        self.assertEqual(media_size('na_index-3x5_3x5in'), (216.0, 360.0))
+        self.assertEqual(media_size('w360h216'), (360.0, 216.0))
+        self.assertEqual(media_size('Letter'), None)
+
+        width, height = media_size('iso_a4_210x297mm')
+
+        self.assertAlmostEqual(width, 595.3, 1)
+
+    def test_supports(self):
+        from autoprint.printers import supports
+
+        cards = {'media-supported': ['na_index-3x5_3x5in', 'na_index-4x6_4x6in']}
+        office = {'media-supported': ['na_letter_8.5x11in', 'iso_a4_210x297mm']}
+        custom = {'media-supported': ['custom_min_1x1in', 'custom_max_8.5x14in']}
+
+        self.assertTrue(supports(cards, (360, 216)))
+        self.assertFalse(supports(office, (360, 216)))
+        self.assertTrue(supports(office, (612, 792)))
+        self.assertTrue(supports(custom, (360, 216)))
+
+        # nothing listed, assume it's fine
+        self.assertTrue(supports({}, (360, 216)))
+
+    def test_unavailable(self):
+        from autoprint.printers import unavailable
+
+        self.assertEqual(unavailable({'printer-state': 3, 'printer-state-reasons': ['none']}), None)
+        self.assertEqual(unavailable({'printer-state': 5}), 'stopped')
+        self.assertEqual(unavailable({'printer-state': 3, 'printer-state-reasons': ['media-empty-error']}), 'media-empty-error')
+        self.assertEqual(unavailable({'printer-state': 3, 'printer-state-reasons': ['media-low-report']}), None)
+        self.assertEqual(unavailable({'printer-state': 3, 'printer-is-accepting-jobs': False}), 'not accepting jobs')
+
+    def test_page_size(self):
+        from autoprint.printers import page_size
+        from autoprint.renderers.issuecard import IssueCardRenderer
+        from autoprint.benchmarks import sample_payload
+        import os
+
+        renderer = IssueCardRenderer()
+
+        filename = renderer(renderer.schema.deserialize(sample_payload()))
+
+        try:
+            self.assertEqual(page_size(filename), (360.0, 216.0))
+        finally:
+            os.remove(filename)
+
+class TestPrinterPool(TestCase):
+    """
+    Check how printers are chosen
+    """
+
+    def _pool(self, **printers):
+        from autoprint.printers import PrinterPool
+        from collections import OrderedDict
+
+        return PrinterPool(FakeState(OrderedDict(sorted(printers.items()))))
+
+    def test_shallowest_queue(self):
+        pool = self._pool(
+            one={'printer-state': 4, 'queued-job-count': 3},
+            two={'printer-state': 3, 'queued-job-count': 1},
+        )
+
+        self.assertEqual(pool.choose(), 'two')
+
+        # jobs sent since the state was fetched count towards the depth
+        pool.submitted('two')
+        pool.submitted('two')
+        pool.submitted('two')
+
+        self.assertEqual(pool.choose(), 'one')
+
+    def test_skips_unavailable(self):
+        pool = self._pool(
+            one={'printer-state': 3, 'printer-state-reasons': ['media-empty-error']},
+            two={'printer-state': 5},
+            three={'printer-state': 3, 'queued-job-count': 10},
+        )
+
+        self.assertEqual(pool.choose(), 'three')
+
+    def test_page_size(self):
+        pool = self._pool(
+            cards={'printer-state': 3, 'queued-job-count': 5, 'media-supported': ['na_index-3x5_3x5in']},
+            office={'printer-state': 3, 'media-supported': ['na_letter_8.5x11in']},
+        )
+
+        self.assertEqual(pool.choose((360, 216)), 'cards')
+        self.assertEqual(pool.choose((612, 792)), 'office')
+
+    def test_failover(self):
+        from autoprint.printers import NoPrinterAvailable
+
+        pool = self._pool(
+            one={'printer-state': 3},
+            two={'printer-state': 3, 'queued-job-count': 1},
+        )
+
+        pool.failed('one', 'not accepting jobs')
+
+        self.assertEqual(pool.choose(), 'two')
+
+        self.assertRaises(NoPrinterAvailable, pool.choose, None, ['two'])
+
+        stats = pool.stats()
+
+        self.assertFalse(stats['one']['available'])
+        self.assertEqual(stats['one']['failures'], 1)
+
+    def test_throughput(self):
+        pool = self._pool(one={'printer-state': 3})
+
+        for x in range(5):
+            pool.submitted('one', files=2)
+
+        stats = pool.stats()['one']
+
+        self.assertEqual(stats['jobs'], 5)
+        self.assertEqual(stats['files'], 10)
+        self.assertEqual(stats['jobs_per_minute'], 1.0)
+
+    def test_printer_fault(self):
+        from autoprint.printers import printer_fault
+
+        self.assertTrue(printer_fault(Exception(0x0506, 'not accepting jobs')))
+        self.assertFalse(printer_fault(Exception(0x040a, 'document format not supported')))
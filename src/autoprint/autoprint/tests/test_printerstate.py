@@ -0,0 +1,127 @@
+"""
+Test the printer state cache
+"""
+
+from unittest import TestCase
+
+class FakeConnection(object):
+    """
+    Just enough of a cups.Connection
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.events = []
+        self.subscriptions = 0
+
+    def getDefault(self):
+        self.calls.append('getDefault')
+        return 'office'
+
+    def getPrinterAttributes(self, printer):
+        self.calls.append('getPrinterAttributes')
+
+        if printer == 'missing':
+            raise RuntimeError("client-error-not-found")
+
+        return {'printer-info': '%s printer' % printer.title(), 'printer-state': 3}
+
+    def createSubscription(self, uri, events=(), lease_duration=-1):
+        self.subscriptions += 1
+        return self.subscriptions
+
+    def renewSubscription(self, subscription, lease_duration):
+        pass
+
+    def cancelSubscription(self, subscription):
+        pass
+
+    def getNotifications(self, subscriptions, sequences):
+        return {'events': [event for event in self.events if event['notify-sequence-number'] >= sequences[0]]}
+
+class TestPrinterStateCache(TestCase):
+    """
+    Check fetching, event checks and staleness - the CUPS thread side is
+    called directly.
+    """
+
+    def _cache(self, **options):
+        from autoprint.printerstate import PrinterStateCache
+
+        connection = FakeConnection()
+
+        return PrinterStateCache(lambda: connection, **options), connection
+
+    def test_stale_until_fetched(self):
+        cache, connection = self._cache()
+
+        status = cache.status()
+
+        self.assertTrue(status['stale'])
+        self.assertEqual(status['updated'], None)
+        self.assertEqual(connection.calls, [])
+
+    def test_fetch(self):
+        cache, connection = self._cache()
+
+        cache._updated(cache._fetch())
+
+        status = cache.status()
+
+        self.assertEqual(status['printer'], 'office')
+        self.assertEqual(status['attributes']['printer-info'], 'Office printer')
+        self.assertFalse(status['stale'])
+
+    def test_fetch_several(self):
+        cache, connection = self._cache(printers=['cards', 'missing', 'office'])
+
+        cache._updated(cache._fetch())
+
+        self.assertEqual(cache.printer, 'cards')
+        self.assertEqual(list(cache.printers), ['cards', 'office'])
+        self.assertEqual(cache.errors, {'missing': 'client-error-not-found'})
+        self.assertFalse('getDefault' in connection.calls)
+
+    def test_fetch_none(self):
+        cache, connection = self._cache(printers=['missing'])
+
+        self.assertRaises(IOError, cache._fetch)
+
+    def test_goes_stale(self):
+        cache, connection = self._cache(interval=30)
+
+        cache._updated(cache._fetch())
+        cache.updated -= 61
+
+        self.assertTrue(cache.stale)
+
+    def test_failure_is_stale(self):
+        from twisted.python.failure import Failure
+
+        cache, connection = self._cache()
+
+        cache._updated(cache._fetch())
+        cache._failed(Failure(IOError("CUPS went away")))
+
+        status = cache.status()
+
+        self.assertTrue(status['stale'])
+        self.assertEqual(status['error'], "CUPS went away")
+        self.assertEqual(status['printer'], 'office')
+
+    def test_events(self):
+        cache, connection = self._cache()
+
+        self.assertEqual(cache._check(), 0)
+        self.assertEqual(cache.subscription, 1)
+
+        connection.events = [
+            {'notify-sequence-number': 1},
+            {'notify-sequence-number': 2},
+        ]
+
+        self.assertEqual(cache._check(), 2)
+        self.assertEqual(cache._check(), 0)
+
+        # the subscription is kept between checks
+        self.assertEqual(connection.subscriptions, 1)
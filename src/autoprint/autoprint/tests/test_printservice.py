@@ -0,0 +1,50 @@
+"""
+Test the print service
+"""
+
+from unittest import TestCase, SkipTest
+import tempfile, shutil
+
+class TestPrintServiceQueue(TestCase):
+    """
+    Check the print queue outlives the service with the default settings
+    """
+
+    def setUp(self):
+        try:
+            import cups
+        except ImportError:
+            raise SkipTest("pycups isn't installed")
+
+        self.directory = tempfile.mkdtemp()
+        self.saved, tempfile.tempdir = tempfile.tempdir, self.directory
+
+    def tearDown(self):
+        tempfile.tempdir = self.saved
+        shutil.rmtree(self.directory)
+
+    def test_reopened(self):
+        import sqlite3
+        from autoprint.services.printing import PrintService
+        from autoprint.jobqueue import _setup, _enqueue, _recover, _counts
+
+        first = PrintService()
+        first.jobQueue.close()
+
+        connection = sqlite3.connect(first.jobQueue.path)
+        _setup(connection.cursor())
+        _enqueue(connection.cursor(), first.spool.path(), 'Card', 'issuecard', 100)
+        connection.commit()
+        connection.close()
+
+        # restarted
+        second = PrintService()
+        second.jobQueue.close()
+
+        self.assertEqual(second.jobQueue.path, first.jobQueue.path)
+
+        connection = sqlite3.connect(second.jobQueue.path)
+        txn = connection.cursor()
+        _recover(txn, 200)
+
+        self.assertEqual(_counts(txn)['queued'], 1)
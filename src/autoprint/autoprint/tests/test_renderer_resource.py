@@ -0,0 +1,167 @@
+"""
+Test the renderer resource
+"""
+
+from unittest import TestCase
+import tempfile, os, json
+
+class TestRendererResource(TestCase):
+    """
+    Each response carries its own body - rendering is faked, so everything
+    happens before render() returns
+    """
+
+    def setUp(self):
+        handle, self.filename = tempfile.mkstemp(suffix='.pdf')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _request(self, method, body=None, factory=None, **headers):
+        from StringIO import StringIO
+        from twisted.internet import defer
+        from twisted.web.server import Session
+        from twisted.web.test.requesthelper import DummyRequest
+        from autoprint.timing import Timings
+        from autoprint.history import PrintHistory
+        from autoprint.cache import PreviewCache
+
+        filename = self.filename
+
+        class Factory(object):
+            timings = Timings()
+            printHistory = PrintHistory()
+            previews = PreviewCache()
+            sessions = {}
+
+            def timer(self, renderer):
+                return self.timings.timer(renderer)
+
+            def render(self, renderer, data, timer=None, priority=None, memory=False):
+                if memory:
+                    return defer.succeed(('%PDF-1.4 preview', False))
+
+                return defer.succeed((filename, False))
+
+            def queueFile(self, path, title, renderer=None, timer=None, priority=None):
+                return defer.succeed((7, 3))
+
+        class Transport(object):
+            pass
+
+        if factory is None:
+            factory = Factory()
+
+        request = DummyRequest([])
+        request.method = method
+        request.headers.update(headers)
+        request.content = StringIO(json.dumps(body))
+        request.transport = Transport()
+        request.transport.protocol = Transport()
+        request.transport.protocol.factory = factory
+        request.session = factory.sessions['abc'] = Session(factory, 'abc')
+
+        return request
+
+    def _render(self, request, child=None):
+        from autoprint.resources.renderers import Renderer
+        from autoprint.renderers.issuecard import IssueCardRenderer
+
+        renderer = IssueCardRenderer()
+        renderer.name = 'issuecard'
+
+        resource = Renderer(renderer)
+
+        if child is not None:
+            resource = resource.getChild(child, request)
+
+        request.render(resource)
+
+        return renderer, ''.join(request.written)
+
+    def _payload(self):
+        from autoprint.benchmarks import sample_payload
+
+        return sample_payload()
+
+    def test_get(self):
+        request = self._request('GET')
+        renderer, body = self._render(request)
+
+        self.assertEqual(body, renderer.encoded()[0])
+        self.assertEqual(request.outgoingHeaders['etag'], renderer.encoded()[1])
+
+    def test_not_modified(self):
+        from autoprint.renderers.issuecard import IssueCardRenderer
+
+        etag = IssueCardRenderer().encoded()[1]
+
+        request = self._request('GET', **{'if-none-match': etag})
+        renderer, body = self._render(request)
+
+        self.assertEqual(request.responseCode, 304)
+        self.assertEqual(body, '')
+
+    def test_invalid(self):
+        request = self._request('POST', {'summary': 'No issue id'})
+        renderer, body = self._render(request)
+
+        self.assertEqual(request.responseCode, 400)
+        self.assertTrue('issue_id' in json.loads(body))
+
+    def test_post(self):
+        request = self._request('POST', self._payload())
+        renderer, body = self._render(request)
+
+        printed = json.loads(body)['printed']
+        factory = request.transport.protocol.factory
+
+        # rendered into memory, never the spool
+        self.assertEqual(factory.printHistory.get('abc', printed).filename, None)
+        self.assertEqual(factory.previews.get(printed)[0], '%PDF-1.4 preview')
+
+    def test_preview_from_memory(self):
+        request = self._request('POST', self._payload())
+        renderer, body = self._render(request)
+
+        printed = json.loads(body)['printed']
+        factory = request.transport.protocol.factory
+
+        preview = self._request('GET', factory=factory)
+        renderer, body = self._render(preview, printed)
+
+        self.assertEqual(body, '%PDF-1.4 preview')
+        self.assertEqual(preview.outgoingHeaders['etag'], '"%s"' % factory.previews.get(printed)[1])
+
+        ranged = self._request('GET', factory=factory, range='bytes=5-7')
+        renderer, body = self._render(ranged, printed)
+
+        self.assertEqual(ranged.responseCode, 206)
+        self.assertEqual(body, '1.4')
+
+    def test_preview_evicted(self):
+        request = self._request('POST', self._payload())
+        renderer, body = self._render(request)
+
+        printed = json.loads(body)['printed']
+        factory = request.transport.protocol.factory
+
+        factory.previews.discard(printed)
+
+        preview = self._request('GET', factory=factory)
+        renderer, body = self._render(preview, printed)
+
+        self.assertEqual(preview.responseCode, 404)
+
+    def test_put(self):
+        request = self._request('PUT', self._payload())
+        renderer, body = self._render(request)
+
+        data = json.loads(body)
+
+        self.assertEqual(request.responseCode, 202)
+        self.assertEqual(data['job_id'], 7)
+        self.assertEqual(data['queue_position'], 3)
+        self.assertTrue('printed' in data)
+        self.assertEqual(request.transport.protocol.factory.printHistory.get('abc', data['printed']).filename, self.filename)
@@ -0,0 +1,118 @@
+"""
+Test the spool
+"""
+
+from unittest import TestCase
+import tempfile, shutil, os, time
+
+class TestSpool(TestCase):
+    """
+    Check paths are handed out cleanly and the sweeper keeps to the quotas
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _file(self, spool, size, age):
+        path = spool.path()
+
+        with open(path, 'wb') as out:
+            out.write('x' * size)
+
+        modified = time.time() - age
+        os.utime(path, (modified, modified))
+
+        return path
+
+    def test_path(self):
+        from autoprint.spool import Spool
+
+        spool = Spool(self.directory)
+
+        before = len(os.listdir('/proc/self/fd'))
+        path = spool.path()
+
+        self.assertEqual(len(os.listdir('/proc/self/fd')), before)
+        self.assertTrue(spool.owns(path))
+        self.assertFalse(spool.owns(os.path.join(self.directory, 'other.pdf')))
+
+    def test_sweep_age(self):
+        from autoprint.spool import Spool
+
+        spool = Spool(self.directory, max_age=3600)
+
+        old = self._file(spool, 10, 7200)
+        recent = self._file(spool, 10, 1800)
+
+        self.assertEqual(spool.sweep(), 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(recent))
+        self.assertEqual(spool.stats()['files'], 1)
+        self.assertEqual(spool.stats()['swept_bytes'], 10)
+
+    def test_sweep_quota(self):
+        from autoprint.spool import Spool
+
+        spool = Spool(self.directory, max_bytes=250, max_age=3600)
+
+        oldest = self._file(spool, 100, 3000)
+        older = self._file(spool, 100, 2000)
+        newest = self._file(spool, 100, 1000)
+
+        spool.sweep()
+
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(os.path.exists(older))
+        self.assertTrue(os.path.exists(newest))
+        self.assertEqual(spool.bytes, 200)
+
+    def test_sweep_keeps(self):
+        from autoprint.spool import Spool
+
+        spool = Spool(self.directory, max_bytes=0, max_age=0)
+
+        referenced = self._file(spool, 10, 7200)
+        fresh = self._file(spool, 10, 0)
+
+        other = os.path.join(self.directory, 'autoprint-jobs.sqlite')
+        open(other, 'wb').close()
+        os.utime(other, (0, 0))
+
+        self.assertEqual(spool.sweep(frozenset([referenced])), 0)
+        self.assertTrue(os.path.exists(referenced))
+        self.assertTrue(os.path.exists(fresh))
+        self.assertTrue(os.path.exists(other))
+        self.assertEqual(spool.referenced_bytes, 10)
+        self.assertTrue(spool.stats()['over_quota'])
+
+    def test_store(self):
+        from autoprint.spool import Spool
+
+        spool = Spool(self.directory)
+
+        path = spool.store('x' * 10, 'preview.pdf')
+
+        self.assertTrue(spool.owns(path))
+        self.assertEqual(open(path, 'rb').read(), 'x' * 10)
+        self.assertEqual(spool.store('y' * 10, 'preview.pdf'), path)
+        self.assertEqual(os.listdir(self.directory), [os.path.basename(path)])
+
+    def test_default_directory(self):
+        from autoprint.spool import Spool
+
+        saved, tempfile.tempdir = tempfile.tempdir, self.directory
+
+        try:
+            # a file the last run left behind
+            old = self._file(Spool(max_age=60), 10, 7200)
+
+            spool = Spool(max_age=60)
+
+            self.assertEqual(os.path.dirname(old), spool.directory)
+            self.assertEqual(spool.sweep(), 1)
+            self.assertFalse(os.path.exists(old))
+        finally:
+            tempfile.tempdir = saved
@@ -0,0 +1,132 @@
+"""
+Test the thumbnailer
+"""
+
+from unittest import TestCase
+import tempfile, shutil, os
+
+class TestThumbnails(TestCase):
+    """
+    Check thumbnails are made once per content and width, and the cache
+    stays within its size - rasterizing is faked
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _file(self, name, content):
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'wb') as out:
+            out.write(content)
+
+        return path
+
+    def _thumbnailer(self, max_bytes=1024):
+        from autoprint.thumbnails import Thumbnailer, ThumbnailCache
+
+        made = []
+
+        def rasterize(path, output, width):
+            made.append((path, width))
+
+            with open(output, 'wb') as out:
+                out.write('x' * width)
+
+        cache = ThumbnailCache(os.path.join(self.directory, 'thumbnails'), max_bytes)
+
+        return Thumbnailer(cache, rasterize, widths=(100, 200, 400), width=200), made
+
+    def test_snap(self):
+        from autoprint.thumbnails import snap
+
+        self.assertEqual(snap(50, (100, 200)), 100)
+        self.assertEqual(snap(150, (200, 100)), 200)
+        self.assertEqual(snap(5000, (100, 200)), 200)
+
+    def test_by_content(self):
+        thumbnailer, made = self._thumbnailer()
+
+        first = self._file('a.pdf', 'same')
+        second = self._file('b.pdf', 'same')
+
+        path = thumbnailer._make(first, 100)
+
+        self.assertEqual(thumbnailer._make(second, 100), path)
+        self.assertEqual(len(made), 1)
+        self.assertEqual(os.path.getsize(path), 100)
+
+        thumbnailer._make(first, 200)
+
+        self.assertEqual(len(made), 2)
+
+    def test_bounded(self):
+        thumbnailer, made = self._thumbnailer(max_bytes=500)
+
+        first = thumbnailer._make(self._file('a.pdf', 'a'), 400)
+        second = thumbnailer._make(self._file('b.pdf', 'b'), 200)
+
+        self.assertFalse(os.path.exists(first))
+        self.assertTrue(os.path.exists(second))
+        self.assertEqual(thumbnailer.stats()['bytes'], 200)
+        self.assertEqual(thumbnailer.stats()['evictions'], 1)
+
+    def test_reloaded(self):
+        from autoprint.thumbnails import ThumbnailCache
+
+        thumbnailer, made = self._thumbnailer()
+        thumbnailer._make(self._file('a.pdf', 'a'), 100)
+
+        cache = ThumbnailCache(thumbnailer.cache.directory)
+
+        self.assertEqual(cache.stats()['entries'], 1)
+        self.assertEqual(cache.stats()['bytes'], 100)
+
+class TestThumbnailService(TestCase):
+    """
+    Only files directly in the directory are served
+    """
+
+    def test_source(self):
+        from autoprint.services.thumbnails import ThumbnailService
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            open(os.path.join(directory, 'card.pdf'), 'wb').close()
+
+            service = ThumbnailService(directory=directory)
+
+            self.assertEqual(service.thumbnailSource('card.pdf', None), os.path.join(directory, 'card.pdf'))
+            self.assertEqual(service.thumbnailSource('missing.pdf', None), None)
+            self.assertEqual(service.thumbnailSource('..', None), None)
+            self.assertEqual(service.thumbnailSource('.thumbnails', None), None)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_stopped_once(self):
+        from autoprint.services.thumbnails import ThumbnailService
+
+        directory = tempfile.mkdtemp()
+
+        try:
+            service = ThumbnailService(directory=directory)
+            stopped = []
+
+            stop = service.thumbnailer.stop
+            service.thumbnailer.stop = lambda: stopped.append(stop())
+
+            service.doStart()
+            self.assertTrue(service.running)
+
+            # the reactor shutting down, then the port closing
+            service._shutdown()
+            service.doStop()
+
+            self.assertFalse(service.running)
+            self.assertEqual(len(stopped), 1)
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,125 @@
+"""
+Test the timing instrumentation
+"""
+
+from unittest import TestCase
+
+class TestHistogram(TestCase):
+    """
+    Check bucketing and the stats derived from it
+    """
+
+    def test_buckets(self):
+        from autoprint.timing import Histogram
+
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+
+        for seconds in (0.005, 0.05, 0.05, 0.5, 5.0):
+            histogram.observe(seconds)
+
+        stats = histogram.stats()
+
+        self.assertEqual(stats['count'], 5)
+        self.assertEqual(stats['buckets'], [[0.01, 1], [0.1, 3], [1.0, 4], ['+Inf', 5]])
+        self.assertEqual(stats['max_ms'], 5000.0)
+
+    def test_percentile(self):
+        from autoprint.timing import Histogram
+
+        histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+
+        for x in range(100):
+            histogram.observe(0.05)
+
+        p50 = histogram.percentile(50)
+
+        self.assertTrue(0.01 < p50 <= 0.05)
+        self.assertEqual(histogram.percentile(100), 0.05)
+        self.assertEqual(Histogram().percentile(50), None)
+
+class TestPhases(TestCase):
+    """
+    Check phases timed inside of a renderer are collected
+    """
+
+    def test_collect(self):
+        from autoprint.timing import phase, collect
+
+        def render(value):
+            with phase('layout'):
+                pass
+            with phase('layout'):
+                pass
+            return value
+
+        result, phases = collect(render, 'out.pdf')
+
+        self.assertEqual(result, 'out.pdf')
+        self.assertEqual(phases.keys(), ['layout'])
+
+    def test_not_collecting(self):
+        from autoprint.timing import phase
+
+        with phase('layout'):
+            pass
+
+    def test_renderer_phases(self):
+        from autoprint.timing import collect
+        from autoprint.renderers.issuecard import IssueCardRenderer
+        import os
+
+        renderer = IssueCardRenderer()
+
+        data = renderer.schema.deserialize({
+            'summary': u'A card',
+            'detail': u'Some detail',
+            'issue_id': u'AP-1',
+            'reporter': u'Someone',
+            'date': u'2012-06-01T10:00:00',
+        })
+
+        filename, phases = collect(renderer, data)
+        os.remove(filename)
+
+        self.assertEqual(sorted(phases), ['layout', 'save'])
+
+class TestRequestTimer(TestCase):
+    """
+    Check per-request timers feed the histograms and the header
+    """
+
+    def test_header(self):
+        from autoprint.timing import Timings
+
+        timings = Timings()
+        timer = timings.timer('issuecard')
+
+        timer.update({'save': 0.002, 'layout': 0.010, 'queue': 0.0})
+        timer.record('cups', 0.1)
+
+        self.assertEqual(timer.header(), 'queue;dur=0.0, layout;dur=10.0, save;dur=2.0, cups;dur=100.0')
+
+        stats = timings.stats()
+
+        self.assertEqual(sorted(stats['issuecard']), ['cups', 'layout', 'queue', 'save'])
+        self.assertEqual(stats['issuecard']['cups']['count'], 1)
+
+    def test_set_header(self):
+        from autoprint.timing import Timings
+
+        class Request(object):
+            headers = {}
+
+            def setHeader(self, name, value):
+                self.headers[name] = value
+
+        timer = Timings().timer('issuecard')
+
+        with timer.time('deserialize'):
+            pass
+
+        request = Request()
+        timer.setHeader(request)
+
+        self.assertTrue(request.headers['server-timing'].startswith('deserialize;dur='))
+        self.assertTrue('total;dur=' in request.headers['server-timing'])
@@ -0,0 +1,197 @@
+"""
+Test the render executors
+"""
+
+from unittest import TestCase
+
+class TestRenderExecutor(TestCase):
+    """
+    Check the slot accounting of the base executor
+    """
+
+    def _executor(self, size=2):
+        """
+        Build an executor whose jobs only finish when the test says so
+        """
+        from autoprint.workers import RenderExecutor
+        from twisted.internet import defer
+
+        class ManualExecutor(RenderExecutor):
+            backend = 'manual'
+
+            def __init__(self, *args, **kwargs):
+                RenderExecutor.__init__(self, *args, **kwargs)
+                self.jobs = []
+                self.started = []
+
+            def _execute(self, name, method, args):
+                d = defer.Deferred()
+                self.jobs.append(d)
+                self.started.append(args[0])
+                return d
+
+        return ManualExecutor({}, size)
+
+    def test_queue_depth(self):
+        executor = self._executor(size=2)
+
+        for x in range(5):
+            executor.render('test', x)
+
+        self.assertEqual(executor.in_flight, 2)
+        self.assertEqual(executor.queued, 3)
+
+    def test_finish_starts_next(self):
+        executor = self._executor(size=1)
+        results = []
+
+        executor.render('test', 1).addCallback(results.append)
+        executor.render('test', 2)
+
+        executor.jobs[0].callback(('/tmp/one.pdf', {}))
+
+        self.assertEqual(results, ['/tmp/one.pdf'])
+        self.assertEqual(executor.completed, 1)
+        self.assertEqual(executor.in_flight, 1)
+        self.assertEqual(executor.queued, 0)
+
+    def test_queue_phase(self):
+        executor = self._executor(size=1)
+        results = []
+
+        executor.submit('test', '__call__', 1).addCallback(results.append)
+        executor.jobs[0].callback(('/tmp/one.pdf', {'layout': 0.5}))
+
+        filename, phases = results[0]
+
+        self.assertEqual(filename, '/tmp/one.pdf')
+        self.assertEqual(phases['layout'], 0.5)
+        self.assertTrue(phases['queue'] >= 0)
+
+    def test_priority_order(self):
+        from autoprint import priority
+
+        executor = self._executor(size=1)
+
+        for data, level in [(1, priority.NORMAL), (2, priority.BULK), (3, priority.INTERACTIVE), (4, priority.URGENT)]:
+            executor.submit('test', '__call__', data, priority=level)
+
+        self.assertEqual(executor.started, [1])
+
+        for x in range(3):
+            executor.jobs[x].callback(('/tmp/x.pdf', {}))
+
+        self.assertEqual(executor.started, [1, 3, 4, 2])
+
+    def test_aging(self):
+        from autoprint import priority
+
+        executor = self._executor(size=1)
+        executor.aging = 0.001
+
+        executor.render('test', 1)
+        executor.submit('test', '__call__', 2, priority=priority.BULK)
+
+        import time
+        time.sleep(0.01)
+
+        executor.submit('test', '__call__', 3, priority=priority.INTERACTIVE)
+        executor.jobs[0].callback(('/tmp/x.pdf', {}))
+
+        # the bulk job has waited longer than 4 levels of aging
+        self.assertEqual(executor.started, [1, 2])
+
+    def test_failure_counted(self):
+        executor = self._executor(size=1)
+        errors = []
+
+        executor.render('test', 1).addErrback(errors.append)
+        executor.jobs[0].errback(RuntimeError("boom"))
+
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(executor.failed, 1)
+        self.assertEqual(executor.stats()['in_flight'], 0)
+
+class TestThreadExecutor(TestCase):
+    """
+    Check the paragraph metrics patch is only in place while asked for
+    """
+
+    def test_paragraph_metrics(self):
+        import reportlab.platypus.paragraph
+        from reportlab.pdfbase.pdfmetrics import stringWidth
+        from autoprint.workers import ThreadRenderExecutor
+        from autoprint.renderers import issuecard
+        from autoprint.renderers.util import metrics
+
+        # importing a renderer leaves ReportLab alone
+        self.assertTrue(reportlab.platypus.paragraph.stringWidth is stringWidth)
+
+        executor = ThreadRenderExecutor({}, 1, paragraph_metrics=True)
+        executor.start()
+
+        try:
+            self.assertEqual(reportlab.platypus.paragraph.stringWidth, metrics.stringWidth)
+        finally:
+            executor.stop()
+
+        self.assertTrue(reportlab.platypus.paragraph.stringWidth is stringWidth)
+
+class TestProcessWorker(TestCase):
+    """
+    Check the function that runs inside of the worker processes
+    """
+
+    def setUp(self):
+        import autoprint.workers
+
+        class Echo(object):
+            def __call__(self, data):
+                return data
+
+            def batch(self, items):
+                return list(items)
+
+        class Broken(object):
+            def __call__(self, data):
+                raise ValueError("bad payload")
+
+        class Write(object):
+            def __call__(self, data, output):
+                output.write(data)
+                return output
+
+        self._saved = autoprint.workers._worker_renderers
+        autoprint.workers._worker_renderers = {
+            'echo': Echo(),
+            'broken': Broken(),
+            'write': Write(),
+        }
+
+    def tearDown(self):
+        import autoprint.workers
+        autoprint.workers._worker_renderers = self._saved
+
+    def test_result(self):
+        from autoprint.workers import _runRenderer
+
+        self.assertEqual(_runRenderer('echo', '__call__', ('/tmp/out.pdf',)), ('ok', ('/tmp/out.pdf', {})))
+        self.assertEqual(_runRenderer('echo', 'batch', ((1, 2),)), ('ok', ([1, 2], {})))
+
+    def test_memory(self):
+        import pickle
+        from autoprint.workers import _runRenderer, MEMORY
+
+        # the marker is still the marker once it's sent to a worker
+        output = pickle.loads(pickle.dumps(MEMORY))
+
+        self.assertTrue(output is MEMORY)
+        self.assertEqual(_runRenderer('write', '__call__', ('card', output)), ('ok', ('card', {})))
+
+    def test_error_contained(self):
+        from autoprint.workers import _runRenderer
+
+        status, message = _runRenderer('broken', '__call__', ({},))
+
+        self.assertEqual(status, 'error')
+        self.assertTrue('bad payload' in message)
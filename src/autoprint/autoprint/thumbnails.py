@@ -0,0 +1,354 @@
+"""
+Thumbnails - small raster previews of rendered files.
+
+The first page is rasterized in-process with PyMuPDF (:mod:`fitz`) when it's
+installed, otherwise by ImageMagick's ``convert``. Thumbnails are kept in a
+size-bounded directory, keyed by a hash of the file they show and their
+width, so a document rendered twice is only rasterized once.
+
+Rasterizing runs in a thread pool of its own, so a burst of thumbnails never
+holds up renders or CUPS calls.
+"""
+import os, tempfile, threading, subprocess, functools
+from collections import OrderedDict
+
+from twisted.internet import reactor, defer
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from twisted.python import log, filepath, failure
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    # not Linux
+    inotify = None
+
+try:
+    import fitz
+except ImportError:
+    fitz = None
+
+from .util import file_digest
+from .printers import page_size
+
+# resolution ImageMagick rasterizes at when the page size isn't known
+DENSITY = 72
+
+def rasterize_fitz(path, output, width):
+    """
+    Write a PNG of the first page of a PDF, width pixels wide, with PyMuPDF.
+    """
+    document = fitz.open(path)
+
+    try:
+        page = document[0]
+        zoom = float(width) / page.rect.width
+
+        page.getPixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).writePNG(output)
+    finally:
+        document.close()
+
+def rasterize_imagemagick(path, output, width, convert='convert'):
+    """
+    Write a PNG of the first page of a PDF, width pixels wide, with
+    ImageMagick - at just enough resolution to scale down from.
+    """
+    size = page_size(path)
+    density = int(72.0 * width / size[0]) + 1 if size else DENSITY
+
+    subprocess.check_call([
+        convert,
+        '-density', str(density),
+        path + '[0]',
+        '-thumbnail', '%dx' % width,
+        '-background', 'white',
+        '-flatten',
+        'png:' + output,
+    ])
+
+def rasterizer(imagemagick_path=None):
+    """
+    Return the best available rasterizer - a callable taking the path of a
+    PDF, the path to write a PNG to and the width in pixels.
+
+    :param imagemagick_path: directory ImageMagick is installed in, if it
+                             isn't on the path
+    """
+    if fitz is not None:
+        return rasterize_fitz
+
+    convert = os.path.join(imagemagick_path, 'convert') if imagemagick_path else 'convert'
+
+    return functools.partial(rasterize_imagemagick, convert=convert)
+
+def snap(width, widths):
+    """
+    Return the smallest of widths that is at least width, or the largest if
+    none is - thumbnails are only made at a few sizes.
+    """
+    widths = sorted(widths)
+
+    for allowed in widths:
+        if allowed >= width:
+            return allowed
+
+    return widths[-1]
+
+class ThumbnailCache(object):
+    """
+    A directory of thumbnails, least recently used dropped first once they
+    take up more than :attr:`max_bytes`.
+
+    Used from the thumbnailer's threads.
+    """
+
+    def __init__(self, directory, max_bytes=64*1024*1024):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.size = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # thumbnails from before a restart, oldest first
+        existing = []
+
+        for name in os.listdir(directory):
+            if name.endswith('.png'):
+                stat = os.stat(os.path.join(directory, name))
+                existing.append((stat.st_mtime, name, stat.st_size))
+
+        for modified, name, size in sorted(existing):
+            self._entries[name] = size
+            self.size += size
+
+        with self._lock:
+            self._trim()
+
+    def path(self, hashed, width):
+        return os.path.join(self.directory, '%s-%d.png' % (hashed, width))
+
+    def get(self, hashed, width):
+        """
+        Return the path of a thumbnail, or None if it isn't cached.
+        """
+        path = self.path(hashed, width)
+        name = os.path.basename(path)
+
+        with self._lock:
+            size = self._entries.pop(name, None)
+
+            if size is None or not os.path.exists(path):
+                if size is not None:
+                    self.size -= size
+
+                self.misses += 1
+                return None
+
+            # re-insert to mark it as the most recently used
+            self._entries[name] = size
+            self.hits += 1
+
+        return path
+
+    def put(self, hashed, width, filename):
+        """
+        Move a new thumbnail into the cache, returns its path.
+        """
+        path = self.path(hashed, width)
+        name = os.path.basename(path)
+
+        os.rename(filename, path)
+        size = os.path.getsize(path)
+
+        with self._lock:
+            self.size -= self._entries.pop(name, 0)
+            self._entries[name] = size
+            self.size += size
+
+            self._trim()
+
+        return path
+
+    def _trim(self):
+        while self._entries and self.size > self.max_bytes:
+            name, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'entries': len(self._entries),
+            'bytes': self.size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+class Thumbnailer(object):
+    """
+    Makes thumbnails of PDFs in a pool of threads, through a
+    :class:`ThumbnailCache`.
+    """
+
+    def __init__(self, cache, rasterize, workers=2, widths=(128, 256, 512), width=256):
+        """
+        :param cache: :class:`ThumbnailCache`
+        :param rasterize: see :func:`rasterizer`
+        :param widths: the widths thumbnails are made at
+        :param width: the width thumbnails are made at ahead of time, and
+                      when none is asked for
+        """
+        self.cache = cache
+        self.rasterize = rasterize
+        self.workers = workers
+        self.widths = tuple(sorted(widths))
+        self.width = snap(width, self.widths)
+
+        # thumbnails being made, by (path, width) - later requests for the
+        # same one wait for it
+        self._making = {}
+
+        self.made = 0
+        self.failures = 0
+        self.error = None
+
+        self._pool = ThreadPool(minthreads=0, maxthreads=workers, name='autoprint-thumbnails')
+        self._notifier = None
+
+    def start(self):
+        self._pool.start()
+
+    def stop(self):
+        if self._notifier is not None:
+            self._notifier.loseConnection()
+            self._notifier = None
+
+        self._pool.stop()
+
+    def _make(self, path, width):
+        """
+        Return the path of a thumbnail of the file, rasterizing it if it
+        isn't cached. Runs in the pool's threads.
+        """
+        hashed = file_digest(path)
+
+        thumbnail = self.cache.get(hashed, width)
+
+        if thumbnail is not None:
+            return thumbnail
+
+        handle, output = tempfile.mkstemp(suffix='.tmp', dir=self.cache.directory)
+        os.close(handle)
+
+        try:
+            self.rasterize(path, output, width)
+        except Exception:
+            os.remove(output)
+            raise
+
+        self.made += 1
+
+        return self.cache.put(hashed, width, output)
+
+    def thumbnail(self, path, width=None):
+        """
+        Return a deferred that fires with the path of a PNG of the first page
+        of the file, at the nearest width thumbnails are made at.
+        """
+        width = snap(width or self.width, self.widths)
+        key = (path, width)
+
+        if key in self._making:
+            d = defer.Deferred()
+            self._making[key].append(d)
+            return d
+
+        waiting = self._making[key] = []
+
+        def done(result):
+            del self._making[key]
+
+            if isinstance(result, failure.Failure):
+                self.failures += 1
+                self.error = result.getErrorMessage()
+
+            for d in waiting:
+                if isinstance(result, failure.Failure):
+                    d.errback(result)
+                else:
+                    d.callback(result)
+
+            return result
+
+        d = deferToThreadPool(reactor, self._pool, self._make, path, width)
+        d.addBoth(done)
+
+        return d
+
+    def watch(self, directory, prefix=''):
+        """
+        Make thumbnails ahead of time of the files written to a directory
+        whose names start with prefix - needs inotify (Linux). Returns True
+        if the directory is being watched.
+        """
+        if inotify is None:
+            log.msg("Can't watch %s for new files, thumbnails are made on demand" % directory)
+            return False
+
+        def written(ignored, path, mask):
+            if not path.basename().startswith(prefix):
+                return
+
+            try:
+                if not path.getsize():
+                    # created, but not rendered into yet
+                    return
+            except OSError:
+                return
+
+            d = self.thumbnail(path.path)
+            d.addErrback(lambda failure: log.msg("Couldn't make a thumbnail of %s: %s" % (path.path, failure.getErrorMessage())))
+
+        self._notifier = inotify.INotify()
+        self._notifier.startReading()
+        self._notifier.watch(
+            filepath.FilePath(directory),
+            mask=inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO,
+            callbacks=[written],
+        )
+
+        return True
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        stats = self.cache.stats()
+        stats.update({
+            'rasterizer': 'fitz' if self.rasterize is rasterize_fitz else 'imagemagick',
+            'workers': self.workers,
+            'widths': list(self.widths),
+            'pending': len(self._making),
+            'made': self.made,
+            'failures': self.failures,
+            'error': self.error,
+        })
+
+        return stats
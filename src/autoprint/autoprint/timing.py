@@ -0,0 +1,254 @@
+"""
+Timing instrumentation for the render/print pipeline.
+
+Every request is split into phases - deserializing the payload, waiting for
+a render worker, laying the cards out, saving the file and adding it to the
+print queue; the dispatcher times waiting for a thread to talk to CUPS and
+CUPS itself. Each phase's duration is recorded in a
+histogram per renderer (reported by ``/status``), and the phases of a single
+request are sent back to the client in a ``Server-Timing`` header.
+
+Renderers run in worker threads or processes, so phases measured inside of
+them are collected with :func:`collect` and passed back with the result.
+"""
+import time, threading
+from contextlib import contextmanager
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# phases in the order they happen, for reporting
+PHASES = ('deserialize', 'queue', 'layout', 'save', 'render', 'enqueue', 'print_wait', 'merge', 'cups', 'total')
+
+_local = threading.local()
+
+@contextmanager
+def phase(name):
+    """
+    Time a block of code running inside of a renderer, if the call is being
+    timed (see :func:`collect`) - otherwise this is a no-op.
+    """
+    phases = getattr(_local, 'phases', None)
+
+    if phases is None:
+        yield
+        return
+
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + time.time() - start
+
+def collect(func, *args):
+    """
+    Call func, returns a tuple of its result and a dictionary of the phases
+    timed with :func:`phase` while it ran (in seconds).
+    """
+    _local.phases = {}
+
+    try:
+        result = func(*args)
+        return result, _local.phases
+    finally:
+        _local.phases = None
+
+class Histogram(object):
+    """
+    Counts of durations falling in fixed buckets (see :data:`BUCKETS`).
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0]*(len(buckets)+1)
+
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        index = 0
+
+        for bound in self.buckets:
+            if seconds <= bound:
+                break
+            index += 1
+
+        self.counts[index] += 1
+        self.count += 1
+        self.sum += seconds
+
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """
+        Estimate a percentile, interpolating within the bucket it falls in.
+        """
+        if not self.count:
+            return None
+
+        rank = percent/100.0*self.count
+        seen = 0
+        lower = 0.0
+
+        for upper, count in zip(self.buckets + (self.max,), self.counts):
+            if count and seen + count >= rank:
+                upper = min(upper, self.max)
+                return lower + (upper-lower)*(rank-seen)/count
+
+            seen += count
+            lower = upper
+
+        return self.max
+
+    def stats(self):
+        """
+        Return a dictionary suitable for status reporting - durations are in
+        milliseconds, buckets are cumulative (upper bound in seconds, count).
+        """
+        cumulative = []
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append([bound, total])
+
+        cumulative.append(['+Inf', self.count])
+
+        def ms(seconds):
+            return None if seconds is None else seconds*1000
+
+        return {
+            'count': self.count,
+            'sum_ms': self.sum*1000,
+            'mean_ms': ms(self.sum/self.count if self.count else None),
+            'max_ms': self.max*1000,
+            'p50_ms': ms(self.percentile(50)),
+            'p90_ms': ms(self.percentile(90)),
+            'p99_ms': ms(self.percentile(99)),
+            'buckets': cumulative,
+        }
+
+class Timings(object):
+    """
+    Histograms of phase durations, per renderer.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+
+    def observe(self, renderer, name, seconds):
+        key = (renderer, name)
+
+        try:
+            histogram = self._histograms[key]
+        except KeyError:
+            histogram = self._histograms[key] = Histogram()
+
+        histogram.observe(seconds)
+
+    def timer(self, renderer):
+        """
+        Return a :class:`RequestTimer` for a request to the named renderer.
+        """
+        return RequestTimer(self, renderer)
+
+    def histograms(self):
+        """
+        Return a list of ((renderer, phase), :class:`Histogram`) tuples.
+        """
+        return sorted(self._histograms.items())
+
+    def stats(self):
+        """
+        Return a dictionary of histogram stats, keyed by renderer then phase.
+        """
+        output = {}
+
+        for (renderer, name), histogram in self._histograms.iteritems():
+            output.setdefault(renderer, {})[name] = histogram.stats()
+
+        return output
+
+class RequestStats(object):
+    """
+    Request counts (by route, method and status code) and latency histograms
+    (by route and method) for every request a site handles.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self._histograms = {}
+
+    def observe(self, route, method, code, seconds):
+        key = (route, method, code)
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+        key = (route, method)
+
+        try:
+            histogram = self._histograms[key]
+        except KeyError:
+            histogram = self._histograms[key] = Histogram()
+
+        histogram.observe(seconds)
+
+    def histograms(self):
+        """
+        Return a list of ((route, method), :class:`Histogram`) tuples.
+        """
+        return sorted(self._histograms.items())
+
+class RequestTimer(object):
+    """
+    Phase timings of a single request - recorded into the service-wide
+    :class:`Timings` as they're made, and kept for the Server-Timing header.
+    """
+
+    def __init__(self, timings, renderer):
+        self.timings = timings
+        self.renderer = renderer
+        self.phases = []
+        self.start = time.time()
+
+    def record(self, name, seconds):
+        self.phases.append((name, seconds))
+        self.timings.observe(self.renderer, name, seconds)
+
+    def update(self, phases):
+        """
+        Record a dictionary of phases (e.g. from :func:`collect`), in
+        pipeline order.
+        """
+        for name in sorted(phases, key=lambda name: PHASES.index(name) if name in PHASES else len(PHASES)):
+            self.record(name, phases[name])
+
+    @contextmanager
+    def time(self, name):
+        start = time.time()
+
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+    def finish(self):
+        """
+        Record the 'total' phase - from when the timer was created.
+        """
+        self.record('total', time.time() - self.start)
+
+    def header(self):
+        """
+        Value for a Server-Timing header (durations in milliseconds).
+        """
+        return ', '.join('%s;dur=%.1f' % (name, seconds*1000) for name, seconds in self.phases)
+
+    def setHeader(self, request):
+        """
+        Finish the timer and set the Server-Timing header of the response.
+        """
+        self.finish()
+        request.setHeader('server-timing', self.header())
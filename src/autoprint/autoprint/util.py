@@ -1,7 +1,7 @@
 """
 Common utilities
 """
-import pkg_resources
+import pkg_resources, hashlib, mmap, os, json
 
 def loadRenderers():
     """
@@ -17,5 +17,46 @@ def loadRenderers():
         class_ = entry.load()
         
         output[name] = class_()
+        output[name].name = name
+        
+        # encode the description up front, rather than on the first request
+        if hasattr(output[name], 'encoded'):
+            output[name].encoded()
         
     return output
+
+def file_digest(path):
+    """
+    Return a hash of a file's content. Touches the disk - run it in a
+    thread.
+    """
+    hashed = hashlib.sha1()
+    
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            try:
+                hashed.update(mapped)
+            finally:
+                mapped.close()
+    
+    return hashed.hexdigest()
+
+class ResourceEncoder(json.JSONEncoder):
+    """
+    Custom encoder that flattens out objects in a sane way
+    """
+    
+    def default(self, obj):
+        """
+        Override default to provide a __json__ property. It's expected
+        to be a dictionary (or other json serializable object).
+        """
+        
+        try:
+            return obj.__json__
+        except AttributeError:
+            pass
+        
+        return json.JSONEncoder.default(self, obj)
@@ -0,0 +1,356 @@
+"""
+Render workers - run renderers away from the reactor thread.
+
+Rendering a card is CPU bound and can take a noticeable amount of time, so the
+print service hands that work off to an executor and gets a deferred back.
+"""
+import multiprocessing, traceback, time, heapq, itertools
+from operator import itemgetter
+from cStringIO import StringIO
+
+from twisted.internet import reactor, defer
+from twisted.internet.threads import deferToThreadPool, deferToThread
+from twisted.python.threadpool import ThreadPool
+from twisted.python.failure import Failure
+
+from .util import loadRenderers
+from .renderers.util import cache_paragraph_metrics
+from . import timing, priority
+
+class RenderError(Exception):
+    """
+    Raised (via errback) when a renderer fails in a worker process.
+    """
+
+class RenderTimeout(RenderError):
+    """
+    Raised (via errback) when a worker doesn't return a result in time -
+    typically because the worker process died.
+    """
+
+class _Memory(object):
+    """
+    See :data:`MEMORY`.
+    """
+    
+    def __reduce__(self):
+        # pickled by name, so it's still MEMORY in a worker process
+        return 'MEMORY'
+
+# pass as a render's output to have it written to a buffer, and the bytes
+# returned in place of the output
+MEMORY = _Memory()
+
+def _invoke(renderer, method, *args):
+    """
+    Call the given method of a renderer - rendering into memory if its 
+    output (the last argument) is :data:`MEMORY`.
+    """
+    if args and args[-1] is MEMORY:
+        output = StringIO()
+        getattr(renderer, method)(*(args[:-1] + (output,)))
+        return output.getvalue()
+    
+    return getattr(renderer, method)(*args)
+
+class RenderExecutor(object):
+    """
+    Base class for objects that run renderers on behalf of the print service.
+
+    Jobs are held in a pending queue and handed to the backend only when one
+    of the :attr:`size` slots is free, so :attr:`queued` and :attr:`in_flight`
+    are always accurate and only ever touched from the reactor thread.
+
+    Pending jobs are started in priority order, aged by :attr:`aging` (see
+    :mod:`autoprint.priority`).
+    """
+    backend = None
+
+    def __init__(self, renderers, size=4, aging=priority.AGING, paragraph_metrics=False, **options):
+        """
+        :param renderers: dictionary of renderer objects, keyed by name
+                          (see :func:`autoprint.util.loadRenderers`)
+        :param size: maximum number of renders to run at once
+        :param aging: seconds of waiting worth one level of priority
+        :param paragraph_metrics: wrap paragraphs with cached font metrics
+                                  while the executor runs (see
+                                  :func:`autoprint.renderers.util.cache_paragraph_metrics`)
+        
+        Backend-specific options are passed as keyword arguments - options
+        that don't apply to a given backend are ignored.
+        """
+        self.renderers = renderers
+        self.size = size
+        self.aging = aging
+        self.paragraph_metrics = paragraph_metrics
+
+        # heap of (sort key, sequence, job) - the sequence keeps jobs with
+        # the same key in the order they were submitted
+        self._pending = []
+        self._sequence = itertools.count()
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    @property
+    def queued(self):
+        return len(self._pending)
+
+    def start(self):
+        """
+        Called when the print service starts - spin up any workers.
+        """
+
+    def stop(self):
+        """
+        Called when the print service stops - shut down any workers. May
+        return a deferred.
+        """
+
+    def _execute(self, name, method, args):
+        """
+        Expected to be overloaded by child classes - call the given method of
+        the named renderer with the tuple of arguments, returning a deferred 
+        that fires with a tuple of the result and the phases timed while it
+        ran (see :func:`autoprint.timing.collect`).
+        """
+        raise NotImplementedError
+
+    def _dispatch(self):
+        """
+        Hand pending jobs to the backend while there are free slots.
+        """
+        while self._pending and self.in_flight < self.size:
+            key, sequence, (name, method, args, d, submitted) = heapq.heappop(self._pending)
+
+            self.in_flight += 1
+
+            job = defer.maybeDeferred(self._execute, name, method, args)
+            job.addBoth(self._finished)
+            job.addCallback(self._waited, time.time() - submitted)
+            job.chainDeferred(d)
+
+    def _finished(self, result):
+        """
+        Callback/errback for every job - update the counters and start the
+        next pending job.
+        """
+        self.in_flight -= 1
+
+        if isinstance(result, Failure):
+            self.failed += 1
+        else:
+            self.completed += 1
+
+        self._dispatch()
+
+        return result
+
+    def _waited(self, result, seconds):
+        """
+        Add the time the job spent in the pending queue to its phases.
+        """
+        value, phases = result
+        phases['queue'] = seconds
+
+        return value, phases
+
+    def submit(self, name, method, *args, **kwargs):
+        """
+        Queue a call to the given method of the named renderer. Returns a 
+        deferred that fires with a tuple of the result and a dictionary of 
+        phase timings.
+
+        Takes the job's priority as the keyword argument 'priority' 
+        (default: :data:`autoprint.priority.NORMAL`).
+        """
+        d = defer.Deferred()
+        now = time.time()
+
+        key = priority.sort_key(kwargs.get('priority', priority.NORMAL), now, self.aging)
+
+        heapq.heappush(self._pending, (key, next(self._sequence), (name, method, args, d, now)))
+        self._dispatch()
+
+        return d
+
+    def render(self, name, data):
+        """
+        Queue a render of the named renderer, returns a deferred that fires
+        with whatever the renderer returns (typically a file path).
+        """
+        return self.submit(name, '__call__', data).addCallback(itemgetter(0))
+
+    def renderBatch(self, name, items, imposition=None):
+        """
+        Queue a render of a list of items into a single multi-page file.
+        """
+        return self.submit(name, 'batch', items, imposition).addCallback(itemgetter(0))
+
+    def stats(self):
+        """
+        Return a dictionary of counters suitable for status reporting.
+        """
+        return {
+            'backend': self.backend,
+            'size': self.size,
+            'aging': self.aging,
+            'queued': self.queued,
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+
+class ThreadRenderExecutor(RenderExecutor):
+    """
+    Runs renderers in a dedicated thread pool, so a long render doesn't tie up
+    the reactor (or the reactor's own thread pool, used for CUPS calls).
+    """
+    backend = 'thread'
+
+    def __init__(self, renderers, size=4, **options):
+        RenderExecutor.__init__(self, renderers, size, **options)
+
+        self._pool = ThreadPool(minthreads=1, maxthreads=size, name='autoprint-render')
+
+    def start(self):
+        if self.paragraph_metrics:
+            cache_paragraph_metrics(True)
+
+        self._pool.start()
+
+    def stop(self):
+        self._pool.stop()
+
+        if self.paragraph_metrics:
+            cache_paragraph_metrics(False)
+
+    def _execute(self, name, method, args):
+        return deferToThreadPool(reactor, self._pool, timing.collect, _invoke, self.renderers[name], method, *args)
+
+# renderers loaded by each worker process, see _initWorker()
+_worker_renderers = None
+
+def _initWorker(paragraph_metrics=False):
+    """
+    Runs once in each worker process as it starts - load the renderers so
+    they aren't rebuilt for every job.
+    """
+    global _worker_renderers
+    
+    if paragraph_metrics:
+        cache_paragraph_metrics(True)
+    
+    _worker_renderers = loadRenderers()
+
+def _runRenderer(name, method, args):
+    """
+    Runs in a worker process. Never raises - returns a tuple of a status 
+    ('ok' or 'error') and a tuple of the renderer's result and its phase 
+    timings, or a formatted traceback.
+    """
+    try:
+        return ('ok', timing.collect(_invoke, _worker_renderers[name], method, *args))
+    except Exception:
+        return ('error', traceback.format_exc())
+
+class ProcessRenderExecutor(RenderExecutor):
+    """
+    Runs renderers in a pool of pre-forked worker processes, so rendering
+    scales past the one core the GIL allows.
+    
+    Workers are recycled after :attr:`max_jobs` renders. A renderer that
+    raises only fails its own job, and a job whose worker dies is failed with
+    :class:`RenderTimeout` after :attr:`timeout` seconds - the pool replaces
+    the dead worker on its own.
+    
+    :note: workers load their own renderers, so changes made to renderer 
+           settings in the service process are not seen by the workers.
+    """
+    backend = 'process'
+    
+    def __init__(self, renderers, size=4, max_jobs=100, timeout=60, **options):
+        RenderExecutor.__init__(self, renderers, size, **options)
+        
+        self.max_jobs = max_jobs
+        self.timeout = timeout
+        self.timeouts = 0
+        
+        self._pool = None
+    
+    def start(self):
+        self._pool = multiprocessing.Pool(
+            processes=self.size,
+            initializer=_initWorker,
+            initargs=(self.paragraph_metrics,),
+            maxtasksperchild=self.max_jobs,
+        )
+    
+    def stop(self):
+        """
+        Tear down the pool in a thread - terminating it from the reactor 
+        thread can deadlock with the reactor's SIGCHLD handling.
+        """
+        if self._pool is None:
+            return
+        
+        pool, self._pool = self._pool, None
+        
+        return deferToThread(pool.terminate)
+    
+    def _execute(self, name, method, args):
+        d = defer.Deferred()
+        
+        def timedOut():
+            self.timeouts += 1
+            d.errback(RenderTimeout("Render of %s timed out after %s seconds" % (name, self.timeout)))
+        
+        timer = reactor.callLater(self.timeout, timedOut)
+        
+        def done(result):
+            # runs on the reactor thread, after the result handler thread
+            # hands it over
+            if not timer.active():
+                return
+            
+            timer.cancel()
+            
+            status, value = result
+            
+            if status == 'ok':
+                d.callback(value)
+            else:
+                d.errback(RenderError(value))
+        
+        self._pool.apply_async(
+            _runRenderer, 
+            (name, method, args), 
+            callback=lambda result: reactor.callFromThread(done, result),
+        )
+        
+        return d
+    
+    def stats(self):
+        stats = RenderExecutor.stats(self)
+        stats['max_jobs'] = self.max_jobs
+        stats['timeouts'] = self.timeouts
+        
+        return stats
+
+# available backends, keyed by the value of the 'render_backend' setting
+EXECUTORS = {
+    'thread': ThreadRenderExecutor,
+    'process': ProcessRenderExecutor,
+}
+
+def createExecutor(backend, renderers, size, **options):
+    """
+    Build the executor for the given backend name.
+    """
+    try:
+        class_ = EXECUTORS[backend]
+    except KeyError:
+        raise ValueError("Unknown render backend: %s" % backend)
+
+    return class_(renderers, size, **options)
@@ -32,6 +32,14 @@ setup(name='autoprint',
           'jinja2',
           # -*- Extra requirements: -*-
       ],
+      extras_require={
+          # SVG icons for renderers
+          'svg': ['svglib'],
+          # merge coalesced print jobs into a single document
+          'merge': ['PyPDF2'],
+          # rasterize thumbnails in-process instead of with ImageMagick
+          'thumbnails': ['PyMuPDF'],
+      },
       entry_points="""
       # -*- Entry points: -*-
       [autoprint.renderers]